@@ -0,0 +1,8 @@
+"""
+Load generator and benchmark suite for webserv.
+
+Every client is a raw asyncio socket speaking HTTP/1.1, so the numbers measure
+the server rather than process startup (see `python3 -m bench --help`).
+"""
+
+__all__ = ["client", "procstat", "regress", "runner", "scenarios", "stats"]
@@ -0,0 +1,18 @@
+"""
+Run benchmark scenarios against a running webserv:
+
+    ./webserv config/default.conf &
+    python3 -m bench                                # every scenario, 10s each
+    python3 -m bench static pipeline -d 30 -c 100 --json results.json
+
+Server CPU and memory come from /proc/<pid> (the only process named "webserv",
+or --pid). Use --processes to spread the clients when one Python process
+cannot saturate the server (client_cpu_percent close to 100).
+
+`python3 -m bench.regress` starts its own server and compares against a baseline.
+"""
+import sys
+
+from .runner import main
+
+sys.exit(main())
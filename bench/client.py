@@ -0,0 +1,134 @@
+"""
+Minimal HTTP/1.1 client on asyncio streams: just enough to drive webserv.
+"""
+import asyncio
+
+
+class HttpError(Exception):
+    """The server closed the connection or sent something that is not HTTP."""
+
+
+class Response:
+    __slots__ = ("status", "headers", "body_length", "keep_alive")
+
+    def __init__(self, status, headers, body_length, keep_alive):
+        self.status = status
+        self.headers = headers
+        self.body_length = body_length
+        self.keep_alive = keep_alive
+
+
+def build_request(method, path, host, headers=None, body=b"", chunk_size=0, close=False):
+    """Serialize one request. A non-zero chunk_size sends the body chunked."""
+    lines = ["%s %s HTTP/1.1" % (method, path), "Host: %s" % host]
+    for name, value in (headers or {}).items():
+        lines.append("%s: %s" % (name, value))
+    if close:
+        lines.append("Connection: close")
+    if chunk_size:
+        lines.append("Transfer-Encoding: chunked")
+        payload = b"".join(
+            b"%x\r\n%s\r\n" % (len(body[i:i + chunk_size]), body[i:i + chunk_size])
+            for i in range(0, len(body), chunk_size)
+        ) + b"0\r\n\r\n"
+    else:
+        if body or method in ("POST", "PUT"):
+            lines.append("Content-Length: %d" % len(body))
+        payload = body
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + payload
+
+
+class Connection:
+    """One keep-alive connection. Responses are read in the order requests were sent."""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.bytes_read = 0
+
+    @classmethod
+    async def open(cls, host, port, timeout=10.0):
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        return cls(reader, writer)
+
+    async def send(self, data):
+        self.writer.write(data)
+        await self.writer.drain()
+
+    async def read_response(self, head=False):
+        """Read one response, discarding the body. head=True for HEAD requests."""
+        try:
+            header_block = await self.reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError as error:
+            raise HttpError("connection closed" if not error.partial else "truncated headers")
+        except asyncio.LimitOverrunError:
+            raise HttpError("headers too large")
+        self.bytes_read += len(header_block)
+
+        lines = header_block.decode("latin-1").split("\r\n")
+        parts = lines[0].split(" ", 2)
+        if len(parts) < 2 or not parts[0].startswith("HTTP/") or not parts[1].isdigit():
+            raise HttpError("bad status line %r" % lines[0])
+        status = int(parts[1])
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+
+        keep_alive = headers.get("connection", "").lower() != "close" and parts[0] == "HTTP/1.1"
+        if head or status in (204, 304) or 100 <= status < 200:
+            length = 0
+        elif "chunked" in headers.get("transfer-encoding", "").lower():
+            length = await self._read_chunked()
+        elif "content-length" in headers:
+            length = int(headers["content-length"])
+            await self._discard(length)
+        else:
+            length = await self._read_to_close()
+            keep_alive = False
+        return Response(status, headers, length, keep_alive)
+
+    async def _discard(self, length):
+        remaining = length
+        while remaining > 0:
+            data = await self.reader.read(min(remaining, 1 << 16))
+            if not data:
+                raise HttpError("body truncated")
+            remaining -= len(data)
+        self.bytes_read += length
+
+    async def _read_chunked(self):
+        total = 0
+        while True:
+            try:
+                size_line = await self.reader.readuntil(b"\r\n")
+            except asyncio.IncompleteReadError:
+                raise HttpError("chunked body truncated")
+            size = int(size_line.split(b";", 1)[0].strip() or b"0", 16)
+            self.bytes_read += len(size_line)
+            if size == 0:
+                # Trailers end with an empty line
+                while True:
+                    line = await self.reader.readuntil(b"\r\n")
+                    self.bytes_read += len(line)
+                    if line == b"\r\n":
+                        return total
+            await self._discard(size + 2)
+            total += size
+
+    async def _read_to_close(self):
+        total = 0
+        while True:
+            data = await self.reader.read(1 << 16)
+            if not data:
+                self.bytes_read += total
+                return total
+            total += len(data)
+
+    async def close(self):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
@@ -0,0 +1,96 @@
+"""
+Server resource usage sampled from /proc while a scenario runs (Linux only).
+"""
+import os
+import threading
+import time
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def find_pid(name="webserv"):
+    """PID of the only process called `name`, or None if there are zero or several."""
+    found = []
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return None
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open("/proc/%s/comm" % entry) as f:
+                if f.read().strip() == name:
+                    found.append(int(entry))
+        except OSError:
+            continue
+    return found[0] if len(found) == 1 else None
+
+
+def read_usage(pid):
+    """(cpu seconds, rss KiB, open fds) of a process, or None if it is gone."""
+    try:
+        with open("/proc/%d/stat" % pid) as f:
+            # The command name may contain spaces: fields start after the last ')'
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / float(CLOCK_TICKS)
+        rss = 0
+        with open("/proc/%d/status" % pid) as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    rss = int(line.split()[1])
+                    break
+        fds = len(os.listdir("/proc/%d/fd" % pid))
+    except (OSError, IndexError, ValueError):
+        return None
+    return cpu, rss, fds
+
+
+class ProcessSampler:
+    """Samples a PID every `interval` seconds from a background thread until stopped."""
+
+    def __init__(self, pid, interval=0.25):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.pid is None:
+            return
+        self._sample()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def _sample(self):
+        usage = read_usage(self.pid)
+        if usage is not None:
+            self.samples.append((time.monotonic(),) + usage)
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._sample()
+
+    def summary(self):
+        if len(self.samples) < 2:
+            return None
+        first, last = self.samples[0], self.samples[-1]
+        wall = last[0] - first[0] or 1e-9
+        cpu = last[1] - first[1]
+        return {
+            "pid": self.pid,
+            "cpu_s": round(cpu, 3),
+            "cpu_percent": round(cpu / wall * 100, 1),
+            "rss_kib_start": first[2],
+            "rss_kib_max": max(sample[2] for sample in self.samples),
+            "rss_kib_end": last[2],
+            "fds_max": max(sample[3] for sample in self.samples),
+            "fds_end": last[3],
+        }
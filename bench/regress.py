@@ -0,0 +1,312 @@
+"""
+Performance regression check: start ./webserv on a generated configuration,
+run a fixed scenario matrix, store the results under bench/results/<commit>.json
+and fail when throughput or p99 latency got worse than the baseline, or when too
+many requests of a scenario failed.
+
+    make && python3 -m bench.regress                     # compare with bench/baseline.json
+    python3 -m bench.regress --save-baseline              # accept the current numbers
+    python3 -m bench.regress --baseline bench/results/1a2b3c4.json
+
+Exit status: 0 within thresholds (or no baseline yet), 1 regression, 2 setup error.
+Only compare results from the same machine: absolute numbers are not portable.
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from . import runner
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+# Scenario matrix: the same for every build so results stay comparable
+MATRIX = ["static", "pipeline", "churn", "upload", "chunked", "cgi", "slowloris"]
+MATRIX_OPTIONS = ["--connections", "32", "--body-size", str(256 << 10), "--idle-clients", "100",
+                  "--timeout", "2"]
+
+CONFIG_TEMPLATE = """# Generated by bench/regress.py
+access_log off;
+
+server {
+    listen 127.0.0.1:%(port)d;
+    server_name localhost;
+    root %(root)s;
+    index index.html;
+    client_max_body_size 64M;
+
+    location / {
+        methods GET;
+    }
+
+    location /uploads {
+        methods GET POST DELETE;
+        upload_store %(uploads)s;
+        client_max_body_size 64M;
+    }
+
+    location /cgi-bin {
+        methods GET POST;
+        cgi .py %(python)s;
+    }
+}
+"""
+
+
+class SetupError(Exception):
+    pass
+
+
+def git_commit():
+    """Short hash of HEAD, with "-dirty" when tracked files have local changes."""
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                                         stderr=subprocess.DEVNULL).decode().strip()
+        dirty = subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"],
+                                        cwd=REPO_DIR, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return commit + ("-dirty" if dirty else "")
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def prepare_site(workdir, port):
+    """Document root with the site's index.html and CGI scripts; uploads stay in `workdir`."""
+    root = os.path.join(workdir, "www")
+    uploads = os.path.join(workdir, "uploads")
+    os.makedirs(root)
+    os.makedirs(uploads)
+    shutil.copy(os.path.join(REPO_DIR, "www", "index.html"), root)
+    os.symlink(os.path.join(REPO_DIR, "www", "cgi-bin"), os.path.join(root, "cgi-bin"))
+
+    config = os.path.join(workdir, "bench.conf")
+    with open(config, "w") as f:
+        f.write(CONFIG_TEMPLATE % {"port": port, "root": root, "uploads": uploads,
+                                   "python": sys.executable})
+    return config
+
+
+def start_server(binary, config, workdir, port):
+    log = open(os.path.join(workdir, "webserv.log"), "w")
+    server = subprocess.Popen([binary, config], cwd=workdir, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            log.close()
+            raise SetupError("webserv exited with status %d:\n%s" % (server.returncode, tail(log.name)))
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return server, log
+        except OSError:
+            time.sleep(0.05)
+    stop_server(server, log)
+    raise SetupError("webserv did not accept connections on port %d" % port)
+
+
+def stop_server(server, log):
+    if server.poll() is None:
+        server.terminate()
+        try:
+            server.wait(5)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+    log.close()
+
+
+def tail(path, lines=20):
+    with open(path) as f:
+        return "".join(f.readlines()[-lines:])
+
+
+def median(values):
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    return ordered[middle] if len(ordered) % 2 else (ordered[middle - 1] + ordered[middle]) / 2.0
+
+
+def combine_runs(reports):
+    """One report from several runs: each scenario keeps the run with the median throughput,
+    with the median throughput and p99 of all runs (and every run's values under "runs")."""
+    combined = dict(reports[0])
+    combined["scenarios"] = {}
+    for name in reports[0]["scenarios"]:
+        results = [report["scenarios"][name] for report in reports]
+        throughputs = [result["throughput_rps"] for result in results]
+        p99s = [result["latency_ms"]["p99"] for result in results if result["latency_ms"]["p99"] is not None]
+        chosen = dict(sorted(results, key=lambda result: result["throughput_rps"])[len(results) // 2])
+        chosen["latency_ms"] = dict(chosen["latency_ms"])
+        chosen["throughput_rps"] = round(median(throughputs), 1)
+        chosen["latency_ms"]["p99"] = round(median(p99s), 3) if p99s else None
+        chosen["runs"] = {"throughput_rps": throughputs, "p99_ms": p99s}
+        combined["scenarios"][name] = chosen
+    return combined
+
+
+def change(before, after):
+    """Relative change in percent (None if there is nothing to compare)."""
+    if not before or after is None:
+        return None
+    return (after - before) / float(before) * 100
+
+
+def error_rate(result):
+    """Failed requests (connection errors, timeouts, 4xx/5xx) in percent of all attempts."""
+    attempts = result["requests"] + result["errors"]
+    if not attempts:
+        return 100.0
+    return (attempts - result["ok"]) / float(attempts) * 100
+
+
+def check_errors(current, max_rate):
+    """Names of the scenarios whose error rate is above `max_rate` percent; checked even
+    without a baseline, so a broken scenario cannot pass as a fast one."""
+    failed = []
+    for name, result in current["scenarios"].items():
+        rate = error_rate(result)
+        if rate > max_rate:
+            print("%-10s error rate %.1f%% (%d of %d), limit %.1f%%" % (
+                name, rate, result["requests"] + result["errors"] - result["ok"],
+                result["requests"] + result["errors"], max_rate))
+            failed.append(name)
+    return failed
+
+
+def compare(baseline, current, max_drop, max_rise, slack_ms):
+    """Print a comparison table; returns the names of the scenarios that regressed."""
+    if baseline.get("options") != current.get("options"):
+        print("warning: baseline was recorded with different options, numbers may not be comparable")
+    print("%-10s %12s %12s %8s   %10s %10s %8s" % ("scenario", "base req/s", "req/s", "change",
+                                                  "base p99", "p99", "change"))
+    regressions = []
+    for name, result in current["scenarios"].items():
+        base = baseline["scenarios"].get(name)
+        if base is None:
+            print("%-10s %12s %12.1f   (not in baseline)" % (name, "-", result["throughput_rps"]))
+            continue
+        rps_change = change(base["throughput_rps"], result["throughput_rps"])
+        base_p99, p99 = base["latency_ms"]["p99"], result["latency_ms"]["p99"]
+        p99_change = change(base_p99, p99)
+
+        problems = []
+        if rps_change is not None and rps_change < -max_drop:
+            problems.append("throughput")
+        # Sub-millisecond p99 jitter is noise: require both the relative and the absolute rise
+        if p99_change is not None and p99_change > max_rise and p99 - base_p99 > slack_ms:
+            problems.append("p99")
+        if problems:
+            regressions.append(name)
+
+        def number(value, width, precision):
+            return ("%*.*f" % (width, precision, value)) if value is not None else "%*s" % (width, "-")
+
+        def percent(value):
+            return ("%+7.1f%%" % value) if value is not None else "%8s" % "-"
+
+        print("%-10s %s %s %s   %s %s %s  %s" % (
+            name, number(base["throughput_rps"], 12, 1), number(result["throughput_rps"], 12, 1),
+            percent(rps_change), number(base_p99, 10, 2), number(p99, 10, 2), percent(p99_change),
+            "REGRESSION (%s)" % ", ".join(problems) if problems else "ok"))
+    return regressions
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="python3 -m bench.regress", description="webserv performance regression check")
+    parser.add_argument("--binary", default=os.path.join(REPO_DIR, "webserv"), help="server to test (default: ./webserv)")
+    parser.add_argument("--baseline", default=os.path.join(BENCH_DIR, "baseline.json"))
+    parser.add_argument("--results-dir", default=os.path.join(BENCH_DIR, "results"))
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    parser.add_argument("-d", "--duration", type=float, default=5.0, help="seconds per scenario")
+    parser.add_argument("--runs", type=int, default=1, help="repeat the matrix and compare medians")
+    parser.add_argument("--scenarios", nargs="+", choices=MATRIX, default=MATRIX, help="subset of the matrix")
+    parser.add_argument("--max-throughput-drop", type=float, default=10.0, metavar="PERCENT")
+    parser.add_argument("--max-p99-rise", type=float, default=20.0, metavar="PERCENT")
+    parser.add_argument("--max-error-rate", type=float, default=1.0, metavar="PERCENT",
+                        help="fail a scenario when more of its requests fail")
+    parser.add_argument("--p99-slack", type=float, default=1.0, metavar="MS",
+                        help="ignore p99 increases smaller than this")
+    args = parser.parse_args(argv)
+    # The server runs in a temporary directory: a relative path would be resolved there
+    args.binary = os.path.abspath(args.binary)
+    if args.runs < 1:
+        parser.error("--runs must be at least 1")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    if not os.access(args.binary, os.X_OK):
+        print("error: %s not found, build it with make" % args.binary, file=sys.stderr)
+        return 2
+
+    commit = git_commit()
+    workdir = tempfile.mkdtemp(prefix="webserv-bench-")
+    reports = []
+    try:
+        port = free_port()
+        config = prepare_site(workdir, port)
+        for run in range(args.runs):
+            # A fresh server per run so one run's leftovers (memory, cached files) do not leak into the next
+            server, log = start_server(args.binary, config, workdir, port)
+            try:
+                print("run %d/%d of %s on port %d" % (run + 1, args.runs, commit, port))
+                bench_args = runner.parse_args(args.scenarios + MATRIX_OPTIONS + [
+                    "--port", str(port), "--pid", str(server.pid), "--duration", str(args.duration)])
+                reports.append(runner.run(bench_args))
+            finally:
+                stop_server(server, log)
+    except SetupError as error:
+        print("error: %s" % error, file=sys.stderr)
+        return 2
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    current = combine_runs(reports)
+    current["commit"] = commit
+    current["runs"] = args.runs
+    if not os.path.isdir(args.results_dir):
+        os.makedirs(args.results_dir)
+    results_file = os.path.join(args.results_dir, "%s.json" % commit)
+    write_json(results_file, current)
+    print("results: %s" % os.path.relpath(results_file))
+
+    failed = check_errors(current, args.max_error_rate)
+    if failed:
+        print("too many errors in: %s" % ", ".join(failed))
+        return 1
+    if args.save_baseline:
+        write_json(args.baseline, current)
+        print("baseline saved: %s" % os.path.relpath(args.baseline))
+        return 0
+    if not os.path.exists(args.baseline):
+        print("no baseline at %s: run with --save-baseline to create one" % os.path.relpath(args.baseline))
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    print("baseline: %s (commit %s)" % (os.path.relpath(args.baseline), baseline.get("commit", "unknown")))
+    regressions = compare(baseline, current, args.max_throughput_drop, args.max_p99_rise, args.p99_slack)
+    if regressions:
+        print("performance regression in: %s" % ", ".join(regressions))
+        return 1
+    return 0
+
+
+def write_json(path, data):
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+"""
+Command line and scenario runner behind `python3 -m bench`.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import platform
+import sys
+import time
+
+from .procstat import ProcessSampler, find_pid
+from .scenarios import SCENARIOS, Options, delete_uploads
+from .stats import Stats
+
+JSON_VERSION = 1
+
+
+def parse_args(argv):
+    defaults = Options()
+    parser = argparse.ArgumentParser(prog="python3 -m bench", description="webserv load generator")
+    parser.add_argument("scenarios", nargs="*", metavar="scenario",
+                        help="%s (default: all)" % ", ".join(SCENARIOS))
+    parser.add_argument("--host", default=defaults.host)
+    parser.add_argument("-p", "--port", type=int, default=defaults.port)
+    parser.add_argument("-d", "--duration", type=float, default=10.0, help="seconds per scenario")
+    parser.add_argument("-w", "--warmup", type=float, default=1.0, help="unmeasured seconds before each scenario")
+    parser.add_argument("-c", "--connections", type=int, default=defaults.connections, help="concurrent clients")
+    parser.add_argument("--processes", type=int, default=1, help="client processes sharing the connections")
+    parser.add_argument("--path", default=defaults.path, help="static file for static/pipeline/slowloris/churn")
+    parser.add_argument("--depth", type=int, default=defaults.depth, help="pipelined requests per batch")
+    parser.add_argument("--upload-path", default=defaults.upload_path)
+    parser.add_argument("--body-size", type=int, default=defaults.body_size, help="upload size in bytes")
+    parser.add_argument("--chunk-size", type=int, default=defaults.chunk_size, help="chunk size of chunked uploads")
+    parser.add_argument("--cgi-path", action="append", dest="cgi_paths", help="CGI URI (repeatable)")
+    parser.add_argument("--idle-clients", type=int, default=defaults.idle_clients, help="slowloris connections")
+    parser.add_argument("--idle-interval", type=float, default=defaults.idle_interval,
+                        help="seconds between slowloris header lines")
+    parser.add_argument("--timeout", type=float, default=defaults.timeout, help="connect timeout")
+    parser.add_argument("--pid", type=int, help="server PID to sample (default: find \"webserv\")")
+    parser.add_argument("--json", metavar="FILE", help="write results as JSON (\"-\" for stdout)")
+    args = parser.parse_args(argv)
+
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error("unknown scenario %s (choose from %s)" % (", ".join(unknown), ", ".join(SCENARIOS)))
+    if args.connections < 1 or args.processes < 1 or args.processes > args.connections:
+        parser.error("need 1 <= --processes <= --connections")
+    return args
+
+
+def options_for(args, share=0):
+    """Options of one client process: connections and idle clients are split between processes."""
+    values = dict((name, getattr(args, name)) for name in (
+        "host", "port", "path", "depth", "upload_path", "body_size", "chunk_size",
+        "idle_interval", "timeout"))
+    if args.cgi_paths:
+        values["cgi_paths"] = args.cgi_paths
+    values["connections"] = args.connections // args.processes + (share < args.connections % args.processes)
+    values["idle_clients"] = args.idle_clients // args.processes + (share < args.idle_clients % args.processes)
+    return Options(**values)
+
+
+def run_share(job):
+    """Run one process' share of a scenario until `deadline` (monotonic, shared by all processes).
+    Returns what it recorded and the CPU seconds it used."""
+    name, options, deadline = job
+    stats = Stats()
+    cpu = time.process_time()
+    asyncio.run(SCENARIOS[name](options, stats, deadline))
+    return stats.raw(), time.process_time() - cpu
+
+
+def run_scenario(name, args, pool):
+    shares = [options_for(args, share) for share in range(args.processes)]
+
+    if args.warmup > 0:
+        deadline = time.monotonic() + args.warmup
+        warm = Stats()
+        for raw, _ in pool.map(run_share, [(name, options, deadline) for options in shares]):
+            warm.merge(raw)
+        if warm.created:
+            asyncio.run(delete_uploads(shares[0], warm.created))
+
+    stats = Stats()
+    sampler = ProcessSampler(args.pid)
+    client_cpu = 0.0
+    sampler.start()
+    stats.start()
+    deadline = time.monotonic() + args.duration
+    for raw, cpu in pool.map(run_share, [(name, options, deadline) for options in shares]):
+        stats.merge(raw)
+        client_cpu = max(client_cpu, cpu)
+    stats.stop()
+    sampler.stop()
+
+    if stats.created:
+        asyncio.run(delete_uploads(shares[0], stats.created))
+
+    result = stats.summary()
+    # Busiest client process: near 100% means the load generator, not the server, is the limit
+    result["client_cpu_percent"] = round(client_cpu / (stats.elapsed or 1e-9) * 100, 1)
+    result["server"] = sampler.summary()
+    return result
+
+
+def format_line(name, result):
+    latency = result["latency_ms"]
+
+    def ms(value):
+        return "%8.2f" % value if value is not None else "       -"
+
+    line = "%-10s %9.1f req/s  p50 %s  p99 %s  p99.9 %s ms  errors %d" % (
+        name, result["throughput_rps"], ms(latency["p50"]), ms(latency["p99"]), ms(latency["p99.9"]),
+        result["errors"])
+    server = result.get("server")
+    if server:
+        line += "  server cpu %5.1f%% rss %d->%d KiB" % (
+            server["cpu_percent"], server["rss_kib_start"], server["rss_kib_max"])
+    # Only errors: the latency columns measured timeouts, not the server
+    if result["ok"] == 0:
+        line += "  FAILED (%s)" % (", ".join(sorted(result["error_kinds"])) or "no successful responses")
+    return line
+
+
+def run(args, progress=sys.stdout):
+    """Run the scenarios of parsed `args`, printing one line per scenario. Returns the JSON report."""
+    names = args.scenarios or list(SCENARIOS)
+    report = {
+        "version": JSON_VERSION,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "target": "%s:%d" % (args.host, args.port),
+        "host": platform.node(),
+        "options": {
+            "duration_s": args.duration, "warmup_s": args.warmup, "connections": args.connections,
+            "processes": args.processes, "path": args.path, "depth": args.depth,
+            "body_size": args.body_size, "chunk_size": args.chunk_size, "idle_clients": args.idle_clients,
+        },
+        "scenarios": {},
+    }
+    # Forked workers run their own event loop; a single process runs in place
+    pool = multiprocessing.Pool(args.processes) if args.processes > 1 else None
+    try:
+        for name in names:
+            result = run_scenario(name, args, pool or _InlinePool())
+            report["scenarios"][name] = result
+            print(format_line(name, result), file=progress)
+            progress.flush()
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return report
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    if args.pid is None:
+        args.pid = find_pid()
+        if args.pid is None:
+            print("warning: webserv process not found (use --pid), server usage not sampled", file=sys.stderr)
+
+    report = run(args, sys.stderr if args.json == "-" else sys.stdout)
+
+    if args.json == "-":
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+    elif args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write("\n")
+    failed = [name for name, result in report["scenarios"].items() if result["ok"] == 0]
+    return 1 if failed else 0
+
+
+class _InlinePool:
+    """pool.map() in the current process."""
+
+    def map(self, function, jobs):
+        return [function(job) for job in jobs]
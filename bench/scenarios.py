@@ -0,0 +1,229 @@
+"""
+Load scenarios. Each one drives `options.connections` closed-loop clients
+(send a request, wait for the answer, repeat) until the deadline.
+"""
+import asyncio
+import time
+
+from .client import Connection, HttpError, build_request
+
+CLIENT_ERRORS = (HttpError, OSError, asyncio.TimeoutError, ValueError)
+
+
+class Options:
+    """Scenario parameters, filled from the command line."""
+
+    def __init__(self, **values):
+        self.host = "127.0.0.1"
+        self.port = 8080
+        self.connections = 50
+        self.path = "/index.html"
+        self.depth = 8                              # Pipelined requests per batch
+        self.upload_path = "/uploads"
+        self.body_size = 1 << 20
+        self.chunk_size = 16 << 10
+        self.cgi_paths = ["/cgi-bin/api.py", "/cgi-bin/session.py"]
+        self.idle_clients = 200                     # Slowloris connections next to the regular clients
+        self.idle_interval = 5.0                    # Seconds between two header lines of an idle client
+        self.timeout = 10.0                         # Connect timeout, and grace period after the deadline
+        self.__dict__.update(values)
+
+    @property
+    def host_header(self):
+        return "%s:%d" % (self.host, self.port)
+
+
+async def _drop(connection):
+    if connection is not None:
+        await connection.close()
+
+
+async def closed_loop(options, stats, deadline, next_request, fresh_connections=False, on_response=None):
+    """One client: `next_request()` returns (bytes, is_head). Reconnects after errors and Connection: close."""
+    connection = None
+    while time.monotonic() < deadline:
+        try:
+            if connection is None:
+                connection = await Connection.open(options.host, options.port, options.timeout)
+                stats.count("connections")
+            request, head = next_request()
+            started = time.monotonic()
+            before = connection.bytes_read
+            await connection.send(request)
+            response = await connection.read_response(head)
+            stats.record(time.monotonic() - started, response.status, len(request), connection.bytes_read - before)
+            if on_response is not None:
+                on_response(response)
+            if fresh_connections or not response.keep_alive:
+                await _drop(connection)
+                connection = None
+        except CLIENT_ERRORS as error:
+            stats.error(type(error).__name__)
+            await _drop(connection)
+            connection = None
+            await asyncio.sleep(0.01)
+    await _drop(connection)
+
+
+async def static(options, stats, deadline):
+    """Keep-alive GETs of one static file."""
+    request = build_request("GET", options.path, options.host_header)
+    await _closed_loops(options, stats, deadline, lambda: (request, False))
+
+
+async def pipeline(options, stats, deadline):
+    """Batches of `depth` GETs written at once; latency is measured from the batch write."""
+    batch = build_request("GET", options.path, options.host_header) * options.depth
+
+    async def client():
+        connection = None
+        while time.monotonic() < deadline:
+            try:
+                if connection is None:
+                    connection = await Connection.open(options.host, options.port, options.timeout)
+                    stats.count("connections")
+                started = time.monotonic()
+                await connection.send(batch)
+                keep_alive = True
+                for _ in range(options.depth):
+                    before = connection.bytes_read
+                    response = await connection.read_response()
+                    stats.record(time.monotonic() - started, response.status,
+                                 len(batch) // options.depth, connection.bytes_read - before)
+                    keep_alive = keep_alive and response.keep_alive
+                if not keep_alive:
+                    await _drop(connection)
+                    connection = None
+            except CLIENT_ERRORS as error:
+                stats.error(type(error).__name__)
+                await _drop(connection)
+                connection = None
+                await asyncio.sleep(0.01)
+        await _drop(connection)
+
+    await _run_clients(options, stats, deadline, client)
+
+
+def _upload(options, stats, deadline, chunked):
+    body = b"x" * options.body_size
+    request = build_request("POST", options.upload_path, options.host_header,
+                            {"Content-Type": "application/octet-stream"}, body,
+                            chunk_size=options.chunk_size if chunked else 0)
+
+    def remember(response):
+        if response.status == 201 and "location" in response.headers:
+            stats.created.append(response.headers["location"])
+
+    return _closed_loops(options, stats, deadline, lambda: (request, False), on_response=remember)
+
+
+async def upload(options, stats, deadline):
+    """POSTs of `body_size` bytes to the upload location (files are deleted afterwards)."""
+    await _upload(options, stats, deadline, chunked=False)
+
+
+async def chunked(options, stats, deadline):
+    """Same uploads with Transfer-Encoding: chunked in `chunk_size` pieces."""
+    await _upload(options, stats, deadline, chunked=True)
+
+
+async def cgi(options, stats, deadline):
+    """Keep-alive GETs cycling through the CGI scripts."""
+    requests = [build_request("GET", path, options.host_header) for path in options.cgi_paths]
+
+    def client():
+        position = [0]
+
+        def next_request():
+            position[0] = (position[0] + 1) % len(requests)
+            return requests[position[0]], False
+
+        return closed_loop(options, stats, deadline, next_request)
+
+    await _run_clients(options, stats, deadline, client)
+
+
+async def churn(options, stats, deadline):
+    """A new TCP connection for every request (Connection: close)."""
+    request = build_request("GET", options.path, options.host_header, close=True)
+    await _closed_loops(options, stats, deadline, lambda: (request, False), fresh_connections=True)
+
+
+async def slowloris(options, stats, deadline):
+    """Static GETs while `idle_clients` connections trickle one header line every `idle_interval`."""
+    head = ("GET %s HTTP/1.1\r\nHost: %s\r\n" % (options.path, options.host_header)).encode("latin-1")
+
+    async def idle_client(number):
+        # Spread the first writes so the idle clients do not all wake up together
+        await asyncio.sleep(options.idle_interval * number / max(options.idle_clients, 1))
+        connection = None
+        while time.monotonic() < deadline:
+            try:
+                if connection is None:
+                    connection = await Connection.open(options.host, options.port, options.timeout)
+                    stats.count("idle_connections")
+                    await connection.send(head)
+                await asyncio.sleep(min(options.idle_interval, max(deadline - time.monotonic(), 0)))
+                await connection.send(b"X-Idle-%d: x\r\n" % number)
+                if connection.reader.at_eof():
+                    raise HttpError("closed by server")
+            except CLIENT_ERRORS:
+                stats.count("idle_dropped")
+                await _drop(connection)
+                connection = None
+                await asyncio.sleep(0.1)
+        await _drop(connection)
+
+    request = build_request("GET", options.path, options.host_header)
+    idle = [asyncio.ensure_future(idle_client(number)) for number in range(options.idle_clients)]
+    try:
+        await _closed_loops(options, stats, deadline, lambda: (request, False))
+    finally:
+        for task in idle:
+            task.cancel()
+        await asyncio.gather(*idle, return_exceptions=True)
+
+
+async def _run_clients(options, stats, deadline, make_client):
+    """Run the clients; any still waiting on the server `timeout` seconds after the deadline is
+    cancelled and counted as a Timeout error (a stalled server must not hang the benchmark)."""
+    clients = [asyncio.ensure_future(make_client()) for _ in range(options.connections)]
+    _, stalled = await asyncio.wait(clients, timeout=max(deadline - time.monotonic(), 0) + options.timeout)
+    for client in stalled:
+        client.cancel()
+        stats.error("Timeout")
+    await asyncio.gather(*clients, return_exceptions=True)
+
+
+def _closed_loops(options, stats, deadline, next_request, **loop_options):
+    """`connections` closed_loop() clients sharing one request generator."""
+    return _run_clients(options, stats, deadline,
+                        lambda: closed_loop(options, stats, deadline, next_request, **loop_options))
+
+
+async def delete_uploads(options, locations):
+    """Remove the files created by the upload scenarios (not measured)."""
+    connection = None
+    for location in locations:
+        try:
+            if connection is None:
+                connection = await Connection.open(options.host, options.port, options.timeout)
+            await connection.send(build_request("DELETE", location, options.host_header))
+            if not (await connection.read_response()).keep_alive:
+                await _drop(connection)
+                connection = None
+        except CLIENT_ERRORS:
+            await _drop(connection)
+            connection = None
+    await _drop(connection)
+
+
+SCENARIOS = {
+    "static": static,
+    "pipeline": pipeline,
+    "upload": upload,
+    "chunked": chunked,
+    "cgi": cgi,
+    "slowloris": slowloris,
+    "churn": churn,
+}
@@ -0,0 +1,105 @@
+"""
+Latency and throughput bookkeeping for one scenario run.
+"""
+import math
+import time
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list (None if empty)."""
+    if not sorted_values:
+        return None
+    rank = max(1, int(math.ceil(pct / 100.0 * len(sorted_values))))
+    return sorted_values[rank - 1]
+
+
+class Stats:
+    """Counts every request of a scenario. Latencies are kept in full (seconds)."""
+
+    def __init__(self):
+        self.latencies = []
+        self.statuses = {}
+        self.errors = {}
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.counters = {}
+        self.created = []                   # Upload Locations to delete after the run
+        self.started = None
+        self.finished = None
+
+    def start(self):
+        self.started = time.monotonic()
+
+    def stop(self):
+        self.finished = time.monotonic()
+
+    def record(self, latency, status, sent=0, received=0):
+        self.latencies.append(latency)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        self.bytes_sent += sent
+        self.bytes_received += received
+
+    def error(self, kind):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def count(self, name, amount=1):
+        """Scenario-specific counter (slow clients dropped, connections opened, ...)."""
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def raw(self):
+        """Everything recorded, as picklable data for merge() in another process."""
+        return {
+            "latencies": self.latencies,
+            "statuses": self.statuses,
+            "errors": self.errors,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "counters": self.counters,
+            "created": self.created,
+        }
+
+    def merge(self, raw):
+        self.latencies.extend(raw["latencies"])
+        for target, source in ((self.statuses, raw["statuses"]), (self.errors, raw["errors"]),
+                               (self.counters, raw["counters"])):
+            for key, value in source.items():
+                target[key] = target.get(key, 0) + value
+        self.bytes_sent += raw["bytes_sent"]
+        self.bytes_received += raw["bytes_received"]
+        self.created.extend(raw["created"])
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.started
+
+    def summary(self):
+        """Plain dict for JSON: rates per second, latencies in milliseconds."""
+        ordered = sorted(self.latencies)
+        elapsed = self.elapsed or 1e-9
+        requests = len(ordered)
+        ok = sum(n for status, n in self.statuses.items() if 200 <= status < 400)
+        result = {
+            "duration_s": round(self.elapsed, 3),
+            "requests": requests,
+            "ok": ok,
+            "errors": sum(self.errors.values()),
+            "error_kinds": dict(self.errors),
+            "statuses": {str(status): n for status, n in sorted(self.statuses.items())},
+            "throughput_rps": round(requests / elapsed, 1),
+            "sent_mib_s": round(self.bytes_sent / elapsed / (1 << 20), 3),
+            "received_mib_s": round(self.bytes_received / elapsed / (1 << 20), 3),
+            "latency_ms": {
+                "mean": round(sum(ordered) / requests * 1000, 3) if requests else None,
+                "max": round(ordered[-1] * 1000, 3) if requests else None,
+            },
+        }
+        for pct in PERCENTILES:
+            value = percentile(ordered, pct)
+            result["latency_ms"]["p%s" % pct] = round(value * 1000, 3) if value is not None else None
+        if self.counters:
+            result["counters"] = dict(self.counters)
+        return result
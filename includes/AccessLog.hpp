@@ -0,0 +1,102 @@
+#ifndef ACCESSLOG_HPP
+#define ACCESSLOG_HPP
+
+#include <string>
+#include <vector>
+#include <ctime>
+#include <sys/time.h>
+#include "RequestTimeline.hpp"
+
+class	Request;
+
+// Pending log data kept in memory when the log cannot keep up (then lines are dropped)
+#define ACCESS_LOG_BACKLOG_FACTOR	16
+
+// Everything a log line can refer to, collected when a response has been sent
+struct	AccessLogRecord
+{
+	const Request*		request;			// May be incomplete (400 before the request line was read)
+	std::string			remote_addr;
+	std::string			server_name;		// Virtual host that answered
+	int					status;
+	size_t				bytes_sent;			// Headers + body actually written
+	size_t				body_bytes_sent;
+	const RequestTimeline*	timeline;		// Phase timestamps ($request_time, $handler_time, ...)
+	struct timeval		end;				// Wall-clock time of the last byte ($time_local, $msec)
+
+	AccessLogRecord() : request(NULL), status(0), bytes_sent(0), body_bytes_sent(0), timeline(NULL) {}
+};
+
+// A log_format compiled once into literal text and variables ($status, $http_user_agent, ...)
+class	LogFormat
+{
+	private:
+		enum	Variable
+		{
+			LOG_LITERAL,
+			LOG_REMOTE_ADDR,
+			LOG_TIME_LOCAL,
+			LOG_TIME_ISO8601,
+			LOG_MSEC,
+			LOG_REQUEST,
+			LOG_REQUEST_METHOD,
+			LOG_REQUEST_URI,
+			LOG_URI,
+			LOG_SERVER_PROTOCOL,
+			LOG_STATUS,
+			LOG_BYTES_SENT,
+			LOG_BODY_BYTES_SENT,
+			LOG_SPAN,				// Seconds between two phases ($request_time, $upstream_response_time, ...)
+			LOG_PHASE_TIMES,		// Every phase as an offset from the first byte
+			LOG_HOST,
+			LOG_SERVER_NAME,
+			LOG_HTTP_HEADER
+		};
+
+		struct	Segment
+		{
+			Variable		variable;
+			std::string		text;		// Literal text, or the header name for LOG_HTTP_HEADER
+			RequestPhase	from;		// LOG_SPAN bounds
+			RequestPhase	to;
+
+			Segment() : variable(LOG_LITERAL), from(PHASE_COUNT), to(PHASE_COUNT) {}
+		};
+
+		std::vector<Segment>	segments;
+	public:
+		bool	compile(const std::string& format, std::string& error);
+		void	append(std::string& line, const AccessLogRecord& record) const;
+};
+
+// One log file shared by every server block that writes to the same path.
+// Lines are collected in memory and written with a single write() once `buffer_size`
+// bytes are pending or `flush_interval` seconds have passed (nginx access_log buffer= flush=).
+// The file is opened non-blocking so a slow pipe (stdout) cannot stall the event loop.
+class	AccessLog
+{
+	private:
+		std::string	path;
+		int			fd;
+		std::string	buffer;
+		size_t		buffer_size;
+		time_t		flush_interval;
+		time_t		last_flush;
+		size_t		dropped;			// Lines lost because the backlog was full
+
+		// Not copyable (owns a descriptor)
+		AccessLog(const AccessLog&);
+		AccessLog&	operator=(const AccessLog&);
+	public:
+		AccessLog();
+		~AccessLog();
+
+		bool				open(const std::string& file_path);
+		void				configure(size_t size, time_t interval);
+		void				write(const std::string& line);
+		void				tick(time_t now);
+		void				flush();
+		const std::string&	getPath() const { return path; }
+};
+
+#endif
@@ -5,10 +5,21 @@
 #include <vector>
 #include <map>
 
+// How a location block matches the request path (nginx modifiers)
+enum	LocationMatch
+{
+	LOCATION_PREFIX,				// location /images
+	LOCATION_PREFIX_NO_REGEX,		// location ^~ /images (longest prefix wins over regexes)
+	LOCATION_EXACT,					// location = /favicon.ico
+	LOCATION_REGEX,					// location ~ \.php$
+	LOCATION_REGEX_ICASE			// location ~* \.(png|jpg)$
+};
+
 // Represents a location block
 struct	LocationConfig
 {
-	std::string							path;						// "/" or "/upload"
+	std::string							path;						// "/" or "/upload" (or the pattern for regex locations)
+	LocationMatch						match;						// Prefix, exact or regex matching
 	std::string							root;						// Custom root for this location
 	std::string							index;						// Custom index file for this location
 	std::vector<std::string>			methods;					// ["GET", "POST"]
@@ -18,39 +29,128 @@ struct	LocationConfig
 	size_t								client_max_body_size;		// Override for this location (0 = use server default)
 	int									redirect_code;				// 301, 302, etc. (0 = no redirect)
 	std::string							redirect_url;				// URL to redirect to
+	std::string							default_type;				// Content-Type for unknown extensions (empty = server default)
+	bool								metrics;					// metrics on (Prometheus counters instead of files)
+	std::string							proxy_pass;					// proxy_pass http://backend -> upstream name ("backend" or "host:port")
+	std::string							proxy_uri;					// URI part of proxy_pass, replaces the location prefix (empty = URI passed unchanged)
 
-	LocationConfig() : autoindex(false), client_max_body_size(0), redirect_code(0) {}
+	LocationConfig() : match(LOCATION_PREFIX), autoindex(false), client_max_body_size(0), redirect_code(0), metrics(false) {}
+
+	// `uri` without the location prefix for prefix and ^~ locations; unchanged for = and regex ones
+	std::string	relativeUri(const std::string& uri) const;
+};
+
+// access_log <path> [format] [buffer=size] [flush=time] | off
+struct	AccessLogConfig
+{
+	std::string	path;						// "/var/log/webserv/access.log" (empty = not set here, "off" = disabled)
+	std::string	format_name;				// log_format name ("combined")
+	std::string	format;						// Text of that format (resolved when parsing ends)
+	size_t		buffer;						// buffer=64k (lines are written in batches this large)
+	int			flush;						// flush=1s (pending lines are written at least this often)
+
+	AccessLogConfig() : format_name("combined"), buffer(65536), flush(1) {}
+};
+
+// server <address> [max_fails=N] [fail_timeout=time] inside an upstream block
+struct	UpstreamServerConfig
+{
+	std::string	host;						// 127.0.0.1, backend.local, ::1
+	int			port;						// 80 when not given
+	int			max_fails;					// max_fails=1 (failures within fail_timeout before the server is skipped, 0 = never)
+	int			fail_timeout;				// fail_timeout=10s (failure window, then how long the server is skipped)
+
+	UpstreamServerConfig() : port(80), max_fails(1), fail_timeout(10) {}
+};
+
+// upstream <name> { server ...; least_conn; keepalive 32; } (proxy_pass http://host:port gets one too)
+struct	UpstreamConfig
+{
+	std::vector<UpstreamServerConfig>	servers;
+	bool								least_conn;		// least_conn (fewest active requests, default round-robin)
+	size_t								keepalive;		// keepalive 32 (idle connections kept for reuse, 0 = close after each request)
+
+	UpstreamConfig() : least_conn(false), keepalive(32) {}
 };
 
 // Represents a server block
 struct	ServerConfig
 {
+	std::string					host;						// listen 127.0.0.1:8080 or [::]:8080 (empty = all IPv4 addresses)
 	int							port;						// 8080
-	std::string					server_name;				// "localhost"
+	std::string					unix_path;					// listen unix:/run/webserv.sock (port is unused)
+	int							defer_accept;				// listen 8080 deferred (TCP_DEFER_ACCEPT seconds, 0 = off)
+	int							fastopen;					// listen 8080 fastopen=256 (TCP_FASTOPEN queue length, 0 = off)
+	bool						tcp_nodelay;				// tcp_nodelay on (disable Nagle on client sockets)
+	bool						tcp_nopush;					// tcp_nopush on (cork header+body into full packets)
+	bool						default_server;				// listen 8080 default_server (fallback for unknown Host headers)
+	bool						gzip;						// gzip on (compress text responses on the fly, needs zlib)
+	bool						gzip_static;				// gzip_static on (serve file.br / file.gz siblings when accepted)
+	size_t						gzip_min_length;			// gzip_min_length 256 (smaller files are sent as-is)
+	size_t						gzip_cache_size;			// gzip_cache_size 8M (compressed bodies kept in memory)
+	std::string					mime_types_file;			// mime_types /etc/mime.types (loaded on top of the built-in table)
+	std::map<std::string, std::string>	types;				// types { text/html html htm; } (extension -> type, overrides the rest)
+	std::string					default_type;				// default_type application/octet-stream
+	size_t						open_file_cache_max;		// open_file_cache max=1000 (0 = off)
+	int							open_file_cache_inactive;	// open_file_cache ... inactive=60s (close fds unused this long)
+	int							open_file_cache_valid;		// open_file_cache_valid 60s (re-stat cached paths this often)
+	bool						open_file_cache_errors;		// open_file_cache_errors on (also cache "not found")
+	AccessLogConfig				access_log;					// access_log logs/access.log main buffer=64k flush=1s
+	std::vector<std::string>	server_names;				// ["example.com", "*.example.com", "www.example.*"]
 	std::string					root;						// "./www"
 	std::string					index;						// "index.html"
 	size_t						client_max_body_size;		// 10485760 (10M in bytes)
 	std::map<int, std::string>	error_pages;				// {404: "/404.html"}
 	std::vector<LocationConfig>	locations;
 	
-	ServerConfig() : port(8080), client_max_body_size(1048576) {}	// Default 1M
+	ServerConfig() : port(8080), defer_accept(0), fastopen(0), tcp_nodelay(true), tcp_nopush(false), default_server(false),
+					gzip(false), gzip_static(false), gzip_min_length(256), gzip_cache_size(8388608),
+					default_type("application/octet-stream"), open_file_cache_max(0), open_file_cache_inactive(60),
+					open_file_cache_valid(60), open_file_cache_errors(false), client_max_body_size(1048576) {}	// Default 1M
+
+	// Canonical "address:port" / "[v6]:port" / "unix:path" string identifying the listening socket
+	std::string	listenAddress() const;
+};
+
+// Directives outside server blocks (process-wide settings)
+struct	GlobalConfig
+{
+	int									disk_io_threads;	// disk_io_threads 2 (uploads/DELETE off the event loop, 0 = inline)
+	int									slow_loop_threshold;	// slow_loop_threshold 100ms (log event loop iterations longer than this, 0 = off)
+	size_t								buffer_budget;		// buffer_budget 256M (connection buffers before reads pause, 0 = unlimited)
+	std::map<std::string, std::string>	log_formats;		// log_format main '$remote_addr ...' ("combined" is built in)
+	std::map<std::string, UpstreamConfig>	upstreams;		// upstream backend { ... } (plus one per proxy_pass host:port)
+	AccessLogConfig						access_log;			// Default for server blocks without their own (/dev/stdout)
+
+	GlobalConfig();
 };
 
 class	Config
 {
 	private:
+		GlobalConfig				global;
 		std::vector<ServerConfig>	servers;
 
 		std::string					trim(const std::string& str);
 		std::vector<std::string>	split(const std::string& str, char delimiter);
 		size_t						parseSize(const std::string& size_str);
+		int							parseTime(const std::string& time_str);
+		int							parseMilliseconds(const std::string& time_str);
 		bool						isNumber(const std::string& str);
+		bool						parseListen(const std::string& value, ServerConfig& server);
+		bool						parseAccessLog(const std::vector<std::string>& tokens, AccessLogConfig& log);
+		std::string					unquote(const std::string& str);
+		bool						resolveAccessLogs();
+		bool						parseUpstreamServer(const std::vector<std::string>& tokens, UpstreamConfig& upstream);
+		bool						parseProxyPass(const std::string& url, LocationConfig& location);
+		bool						resolveUpstreams();
 		bool						validatePorts() const;
 	public:
 		Config();
 
 		bool								parse(const std::string& filename);
 		const std::vector<ServerConfig>&	getServers() const { return servers; }
+		const GlobalConfig&					getGlobal() const { return global; }
 		void								print() const;
 };
 
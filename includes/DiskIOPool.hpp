@@ -0,0 +1,75 @@
+#ifndef DISKIOPOOL_HPP
+#define DISKIOPOOL_HPP
+
+#include <string>
+#include <vector>
+#include <deque>
+#include <pthread.h>
+
+class	Server;
+
+enum	DiskOperation
+{
+	DISK_UPLOAD,					// Create the directory if needed and write files
+	DISK_DELETE						// Remove one file
+};
+
+// One file written by an upload
+struct	DiskFile
+{
+	std::string	name;				// Requested file name
+	std::string	data;
+	std::string	saved;				// Name actually used (filled in by the worker)
+};
+
+// A blocking file operation for one request, run off the event loop.
+// Everything the worker needs is copied in; it never touches Server or Request.
+struct	DiskJob
+{
+	DiskOperation			operation;
+	int						client_fd;		// Connection waiting for the result
+	Server*					server;			// Builds the response once the job is done
+	std::string				directory;		// Upload directory (created if missing)
+	std::vector<DiskFile>	files;			// Upload contents
+	bool					unique_names;	// Never overwrite: create with O_EXCL, add a _N suffix on collision
+	std::string				path;			// DELETE target
+	std::string				location_uri;	// URI prefix for the Location header of uploads
+	int						status;			// Filled in by the worker: 0 = done, else HTTP error code
+
+	DiskJob(DiskOperation op) : operation(op), client_fd(-1), server(NULL), unique_names(false), status(0) {}
+};
+
+// Worker threads for blocking file operations (uploads, DELETE).
+// Finished jobs are signalled through a pipe so they complete inside poll().
+class	DiskIOPool
+{
+	private:
+		std::vector<pthread_t>	threads;
+		pthread_mutex_t			mutex;
+		pthread_cond_t			cond;
+		std::deque<DiskJob*>	pending;		// Waiting for a worker
+		std::deque<DiskJob*>	done;			// Waiting for the event loop
+		int						notify_pipe[2];	// Worker -> loop wakeup
+		bool					stopping;
+
+		static void*	worker(void* arg);
+
+		// Not copyable (owns threads)
+		DiskIOPool(const DiskIOPool&);
+		DiskIOPool&	operator=(const DiskIOPool&);
+	public:
+		DiskIOPool();
+		~DiskIOPool();
+
+		bool		start(size_t count);
+		void		stop();
+		bool		isRunning() const { return !threads.empty(); }
+		int			getNotifyFd() const { return notify_pipe[0]; }
+		void		submit(DiskJob* job);
+		void		collect(std::vector<DiskJob*>& jobs);
+
+		// The blocking part itself (also used inline when the pool is disabled)
+		static void	execute(DiskJob& job);
+};
+
+#endif
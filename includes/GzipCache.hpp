@@ -0,0 +1,43 @@
+#ifndef GZIPCACHE_HPP
+#define GZIPCACHE_HPP
+
+#include <string>
+#include <map>
+#include <list>
+#include <sys/stat.h>
+
+// Default memory budget for compressed bodies kept by one server block
+#define GZIP_CACHE_SIZE	(8 * 1024 * 1024)
+
+// Bounded LRU cache of gzip-compressed static files, keyed by path.
+// An entry is only reused while the file's mtime and size are unchanged.
+class	GzipCache
+{
+	private:
+		struct	Entry
+		{
+			time_t								mtime;
+			off_t								size;
+			std::string							data;		// Compressed body
+			std::list<std::string>::iterator	lru;		// Position in lru (front = most recently used)
+		};
+
+		std::map<std::string, Entry>	entries;
+		std::list<std::string>			lru;
+		size_t							max_bytes;
+		size_t							used_bytes;
+
+		void	evict(std::map<std::string, Entry>::iterator it);
+	public:
+		GzipCache();
+
+		void				setLimit(size_t bytes) { max_bytes = bytes; }
+		const std::string*	find(const std::string& path, const struct stat& st);
+		void				insert(const std::string& path, const struct stat& st, const std::string& data);
+
+		// false when zlib is unavailable (built with WITH_ZLIB=0) or compression fails
+		static bool			available();
+		static bool			compress(const std::string& input, std::string& output);
+};
+
+#endif
@@ -0,0 +1,53 @@
+#ifndef LOCATIONROUTER_HPP
+#define LOCATIONROUTER_HPP
+
+#include <string>
+#include <vector>
+#include <map>
+#include <regex.h>
+#include "Config.hpp"
+
+// Location lookup compiled once per server block.
+// Matching follows nginx precedence:
+//   1. exact (=) locations
+//   2. longest prefix; used directly if it is a ^~ location
+//   3. regex (~, ~*) locations in config order, first match wins
+//   4. otherwise the longest prefix
+class	LocationRouter
+{
+	private:
+		struct	TrieNode
+		{
+			std::map<char, TrieNode*>	children;
+			int							location;		// Index of the prefix location ending here (-1 = none)
+
+			TrieNode() : location(-1) {}
+		};
+
+		struct	RegexLocation
+		{
+			regex_t	compiled;
+			int		location;
+		};
+
+		const std::vector<LocationConfig>*	locations;
+		TrieNode*							trie;
+		std::map<std::string, int>			exact;
+		std::vector<RegexLocation>			regexes;
+
+		void	freeNode(TrieNode* node);
+		void	clear();
+		void	insertPrefix(const std::string& prefix, int index);
+
+		// Not copyable (owns compiled regexes and trie nodes)
+		LocationRouter(const LocationRouter&);
+		LocationRouter&	operator=(const LocationRouter&);
+	public:
+		LocationRouter();
+		~LocationRouter();
+
+		void					compile(const std::vector<LocationConfig>& locs);
+		const LocationConfig*	match(const std::string& path) const;
+};
+
+#endif
@@ -0,0 +1,39 @@
+#ifndef MAPPEDFILE_HPP
+#define MAPPEDFILE_HPP
+
+#include <cstddef>
+#include <sys/types.h>
+#include <sys/stat.h>
+
+// Read-only mmap of a whole file, shared by every response sending it.
+// Reference counted: the owning server's cache holds one reference and each
+// queued response another; the region is unmapped when the last one is released.
+// Only the kernel reads the mapping (write/writev), so a file truncated under
+// us makes the write fail with EFAULT instead of raising SIGBUS.
+class	MappedFile
+{
+	private:
+		void*		addr;
+		size_t		length;
+		ino_t		ino;
+		off_t		size;
+		time_t		mtime;
+		int			refs;
+
+		MappedFile(void* a, const struct stat& st);
+		~MappedFile();
+
+		// Not copyable (owns the mapping)
+		MappedFile(const MappedFile&);
+		MappedFile&	operator=(const MappedFile&);
+	public:
+		static MappedFile*	map(int fd, const struct stat& st);
+
+		void				retain() { refs++; }
+		void				release();
+		bool				matches(const struct stat& st) const;
+		const char*			data() const { return static_cast<const char*>(addr); }
+		size_t				getLength() const { return length; }
+};
+
+#endif
@@ -0,0 +1,180 @@
+#ifndef METRICS_HPP
+#define METRICS_HPP
+
+#include <string>
+#include <vector>
+#include <map>
+#include <ctime>
+#include <ostream>
+#include "RequestTimeline.hpp"
+
+// Latency buckets in microseconds, HdrHistogram layout: exact below 2 * LATENCY_SUB_BUCKETS,
+// then LATENCY_SUB_BUCKETS linear buckets per power of two (at most ~6% relative error)
+#define LATENCY_SUB_BITS		4
+#define LATENCY_SUB_BUCKETS		(1 << LATENCY_SUB_BITS)
+#define LATENCY_MAX_BITS		36		// Larger values are clamped (2^36 us is about 19 hours)
+#define LATENCY_BUCKETS			((LATENCY_MAX_BITS - LATENCY_SUB_BITS + 1) * LATENCY_SUB_BUCKETS)
+// Powers of two (us) exported as Prometheus "le" bounds: 128us .. 67s
+#define LATENCY_EXPORT_FIRST	7
+#define LATENCY_EXPORT_LAST		26
+
+class	LatencyHistogram
+{
+	private:
+		std::vector<unsigned long>	counts;
+		unsigned long				total;
+		unsigned long long			sum;			// Microseconds
+
+		static size_t				bucketIndex(unsigned long long value);
+		static unsigned long long	bucketHighest(size_t index);
+	public:
+		LatencyHistogram();
+
+		void				record(unsigned long long microseconds);
+		unsigned long		countBelow(int power_of_two) const;
+		unsigned long long	percentile(double fraction) const;
+		unsigned long		getCount() const { return total; }
+		unsigned long long	getSum() const { return sum; }
+};
+
+// Connection states counted by ServerManager when the metrics page is rendered
+struct	ConnectionCounts
+{
+	size_t	reading;		// Receiving a request
+	size_t	writing;		// Request being handled or response being sent
+	size_t	idle;			// Keep-alive, waiting for the next request
+	size_t	cgi;			// CGI processes running
+
+	ConnectionCounts() : reading(0), writing(0), idle(0), cgi(0) {}
+};
+
+// Buffers of a connection counted by the memory accounting
+enum	MemoryBuffer
+{
+	MEMORY_REQUEST_RAW,			// Received bytes not parsed yet
+	MEMORY_REQUEST_BODY,		// Decoded request body
+	MEMORY_MULTIPART,			// Multipart parts (a copy of the body)
+	MEMORY_RESPONSE,			// Response headers and in-memory body waiting to be sent
+	MEMORY_CGI_INPUT,			// Request body waiting to be written to a CGI
+	MEMORY_CGI_OUTPUT,			// CGI output collected so far
+	MEMORY_UPSTREAM,			// Request bytes waiting for an upstream, and its response head
+	MEMORY_BUFFER_COUNT
+};
+
+// Bytes held by one connection, per buffer
+struct	ConnectionMemory
+{
+	size_t	bytes[MEMORY_BUFFER_COUNT];
+
+	ConnectionMemory() { for (int i = 0; i < MEMORY_BUFFER_COUNT; i++) bytes[i] = 0; }
+
+	size_t				total() const;
+	static const char*	bufferName(MemoryBuffer buffer);
+};
+
+// Work done by one event loop iteration, by kind of handler
+enum	LoopHandler
+{
+	LOOP_ACCEPT,			// Draining a listening socket
+	LOOP_CLIENT_READ,		// Reading and handling a request (static files, autoindex, ...)
+	LOOP_CLIENT_WRITE,		// Sending a response
+	LOOP_CLIENT_CLOSE,		// Hangups and errors on client sockets
+	LOOP_CGI_READ,			// Reading CGI output
+	LOOP_CGI_WRITE,			// Writing a request body to a CGI
+	LOOP_CGI_FINISH,		// Reaping a CGI (waitpid) and building its response
+	LOOP_UPSTREAM,			// Connecting, writing to and reading from proxy_pass upstreams
+	LOOP_DISK,				// Completed disk I/O jobs
+	LOOP_TIMEOUTS,			// Idle connection and CGI timeout scan
+	LOOP_LOG_FLUSH,			// Access log writes
+	LOOP_HANDLER_COUNT
+};
+
+// Times every handler call of the event loop. Everything runs on one thread, so a
+// single slow call (a large readFile, a blocking waitpid) delays every client:
+// iterations longer than the threshold are reported with their slowest call.
+class	LoopProfiler
+{
+	private:
+		unsigned long long	threshold;							// Microseconds, 0 = no slow iteration trace
+
+		// Current iteration
+		unsigned long long	iteration_start;
+		unsigned long long	iteration_time;						// Set by endIteration()
+		int					ready;								// fds reported by poll()
+		unsigned long long	spent[LOOP_HANDLER_COUNT];
+		unsigned long		calls[LOOP_HANDLER_COUNT];
+		LoopHandler			slowest_handler;
+		int					slowest_fd;							// Client fd (CGI calls report their client, -1 = none)
+		unsigned long long	slowest_time;
+
+		// Since startup
+		unsigned long		iterations;
+		unsigned long		slow_iterations;
+		unsigned long long	ready_total;
+		unsigned long long	poll_wait_total;					// Microseconds blocked in poll()
+		unsigned long long	spent_total[LOOP_HANDLER_COUNT];
+		unsigned long		calls_total[LOOP_HANDLER_COUNT];
+		LatencyHistogram	busy;								// Iteration time after poll() returned
+	public:
+		LoopProfiler();
+
+		static const char*	handlerName(LoopHandler handler);
+
+		void				setThreshold(unsigned long long microseconds) { threshold = microseconds; }
+		void				beginIteration(unsigned long long poll_started, int ready_fds);
+		void				stop(LoopHandler handler, int fd, unsigned long long started);
+		bool				endIteration();
+		std::string			trace() const;
+		int					getSlowestFd() const { return slowest_fd; }
+		void				render(std::ostream& out) const;
+};
+
+// Process-wide counters for the metrics location (survive configuration reloads)
+class	Metrics
+{
+	private:
+		time_t						started;
+		unsigned long				connections_accepted;
+		unsigned long long			bytes_received;
+		unsigned long long			bytes_sent;
+		unsigned long				cgi_spawned;
+		unsigned long				cgi_spawn_failures;
+		unsigned long				cgi_timeouts;
+		unsigned long				cgi_failures;		// Crashed, non-zero exit or bad output
+		std::map<std::pair<std::string, std::string>, unsigned long>	upstream_connects;	// (upstream, peer) -> requests on new connections
+		std::map<std::pair<std::string, std::string>, unsigned long>	upstream_reuses;	// (upstream, peer) -> requests on pooled connections
+		std::map<std::pair<std::string, std::string>, unsigned long>	upstream_failures;	// (upstream, peer) -> connect errors, resets, timeouts
+		std::map<std::string, std::map<int, unsigned long> >				requests;	// Server -> status -> count
+		std::map<std::pair<std::string, std::string>, LatencyHistogram>	latency;	// (server, location) -> request time
+		std::map<std::string, LatencyHistogram>							phases;		// Phase span name -> duration
+		size_t						memory[MEMORY_BUFFER_COUNT];		// Bytes held by all connections
+		size_t						memory_peak[MEMORY_BUFFER_COUNT];	// High-water mark of each buffer kind
+		size_t						memory_total;
+		size_t						memory_total_peak;
+		size_t						connection_memory_peak;				// Largest single connection
+		size_t						buffer_budget;						// 0 = unlimited
+		bool						reads_paused;
+		unsigned long				read_pauses;
+	public:
+		Metrics();
+
+		void		connectionAccepted() { connections_accepted++; }
+		void		received(size_t bytes) { bytes_received += bytes; }
+		void		cgiSpawned() { cgi_spawned++; }
+		void		cgiSpawnFailed() { cgi_spawn_failures++; }
+		void		cgiTimedOut() { cgi_timeouts++; }
+		void		cgiFailed() { cgi_failures++; }
+		void		upstreamRequest(const std::string& upstream, const std::string& peer, bool reused);
+		void		upstreamFailed(const std::string& upstream, const std::string& peer) { upstream_failures[std::make_pair(upstream, peer)]++; }
+		void		memoryChanged(const ConnectionMemory& before, const ConnectionMemory& after);
+		size_t		getMemoryTotal() const { return memory_total; }
+		size_t		getMemoryTotalPeak() const { return memory_total_peak; }
+		size_t		getConnectionMemoryPeak() const { return connection_memory_peak; }
+		void		setBufferBudget(size_t bytes) { buffer_budget = bytes; }
+		void		readsPaused(bool paused) { reads_paused = paused; if (paused) read_pauses++; }
+		void		requestDone(const std::string& server, const std::string& location, int status,
+						size_t sent, const RequestTimeline& timeline);
+		std::string	render(const ConnectionCounts& connections, const LoopProfiler& loop) const;
+};
+
+#endif
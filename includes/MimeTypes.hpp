@@ -0,0 +1,24 @@
+#ifndef MIMETYPES_HPP
+#define MIMETYPES_HPP
+
+#include <string>
+#include <map>
+
+// Extension -> Content-Type table, built once per server block.
+// Layers, later ones overriding earlier: built-in defaults, mime_types file, types {} block.
+class	MimeTypes
+{
+	private:
+		std::map<std::string, std::string>	types;		// Lowercase extension without the dot -> MIME type
+
+	public:
+		MimeTypes();
+
+		void				add(const std::string& extension, const std::string& type);
+		void				add(const std::map<std::string, std::string>& table);
+		bool				loadFile(const std::string& path);
+		const std::string&	lookup(const std::string& path, const std::string& default_type) const;
+		size_t				size() const { return types.size(); }
+};
+
+#endif
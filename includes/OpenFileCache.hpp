@@ -0,0 +1,61 @@
+#ifndef OPENFILECACHE_HPP
+#define OPENFILECACHE_HPP
+
+#include <string>
+#include <map>
+#include <list>
+#include <ctime>
+#include <sys/stat.h>
+
+// Result of a path lookup: metadata plus, for readable regular files,
+// a read-only descriptor owned by the cache (never close it, dup() it)
+struct	FileInfo
+{
+	struct stat	st;
+	int			fd;			// -1 = not open (directory, unreadable, or cache disabled)
+
+	FileInfo() : fd(-1) {}
+};
+
+// Bounded cache of open descriptors and stat results (nginx open_file_cache).
+// Entries are re-validated with stat() every `valid` seconds (cached descriptors
+// are fstat()ed on every hit), dropped after `inactive` seconds without use, and
+// evicted least recently used first.
+class	OpenFileCache
+{
+	private:
+		struct	Entry
+		{
+			FileInfo							info;
+			bool								exists;		// false = cached lookup error (open_file_cache_errors)
+			time_t								validated;	// Last stat() against the path
+			time_t								last_used;
+			std::list<std::string>::iterator	lru;		// Position in lru (front = most recently used)
+		};
+
+		std::map<std::string, Entry>	entries;
+		std::list<std::string>			lru;
+		size_t							max_entries;	// 0 = disabled
+		time_t							inactive;
+		time_t							valid;
+		bool							cache_errors;
+		time_t							last_sweep;
+
+		void	evict(std::map<std::string, Entry>::iterator it);
+		void	sweep(time_t now);
+		bool	load(const std::string& path, Entry& entry);
+
+		// Not copyable (owns descriptors)
+		OpenFileCache(const OpenFileCache&);
+		OpenFileCache&	operator=(const OpenFileCache&);
+	public:
+		OpenFileCache();
+		~OpenFileCache();
+
+		void	configure(size_t max, time_t inactive_secs, time_t valid_secs, bool errors);
+		bool	enabled() const { return max_entries > 0; }
+		bool	lookup(const std::string& path, FileInfo& info);
+		void	invalidate(const std::string& path);
+};
+
+#endif
@@ -0,0 +1,51 @@
+#ifndef OUTPUTQUEUE_HPP
+#define OUTPUTQUEUE_HPP
+
+#include <string>
+#include <deque>
+#include <sys/types.h>
+#include "MappedFile.hpp"
+
+// Largest file slice sent per write so one download cannot starve other clients
+#define FILE_SEND_CHUNK (512 * 1024)
+// Segments gathered into one writev
+#define OUTPUT_IOV_MAX 16
+
+// One piece of a queued response. Exactly one source is used:
+// data (owned bytes), map (a region of a shared mapping) or fd (a file region).
+struct	OutputSegment
+{
+	std::string	data;			// Header block, in-memory body, CGI output
+	MappedFile*	map;			// Mapped file body (one reference held)
+	int			fd;				// File body sent with sendfile (owned, -1 = none)
+	off_t		offset;			// Next byte to send within data, the mapping or the file
+	size_t		remaining;		// Bytes still to send
+
+	OutputSegment() : map(NULL), fd(-1), offset(0), remaining(0) {}
+	const char*	bytes() const;	// Next byte in memory (NULL for file segments)
+};
+
+// Bytes waiting to go out on a connection, in order. Memory and mapped segments
+// are gathered into one writev; a file segment at the front goes out with sendfile.
+// Copies share the segments' fds and mappings: only one copy may clear() them.
+class	OutputQueue
+{
+	private:
+		std::deque<OutputSegment>	segments;
+
+		void		consume(size_t written);
+		ssize_t		sendFile(int socket_fd, OutputSegment& segment, size_t& attempted);
+	public:
+		void		pushData(const std::string& data);
+		void		pushMapped(MappedFile* map, off_t offset, size_t length);	// Takes a reference
+		void		pushFile(int fd, off_t offset, size_t length);				// Takes ownership of fd
+		bool		empty() const { return segments.empty(); }
+		size_t		memoryBytes() const;	// Capacity of the in-memory segments
+
+		// One write of what is at the front; `attempted` is what was offered.
+		// > 0: bytes written (consumed), <= 0: the connection must be closed (do NOT check errno)
+		ssize_t		send(int socket_fd, size_t& attempted);
+		void		clear();				// Drop everything, closing fds and releasing mappings
+};
+
+#endif
@@ -0,0 +1,99 @@
+#ifndef PROXY_HPP
+#define PROXY_HPP
+
+#include <string>
+#include <vector>
+#include <ctime>
+#include "Request.hpp"
+#include "Config.hpp"
+#include "Upstream.hpp"
+
+// Seconds to wait for an upstream connect, and for the next byte of its response
+#define PROXY_CONNECT_TIMEOUT 5
+#define PROXY_READ_TIMEOUT 60
+// Bytes buffered in each direction before the side producing them is no longer read
+#define PROXY_BUFFER_SIZE (256 * 1024)
+// Largest response head accepted from an upstream, and longest chunk size or trailer line
+#define PROXY_HEADER_MAX (64 * 1024)
+#define PROXY_LINE_MAX 4096
+
+// Finds where an HTTP/1.1 message body ends without changing it: chunked
+// framing is passed through as it is, only followed to find the last chunk.
+class	BodyFramer
+{
+	public:
+		enum	Mode
+		{
+			NONE,					// No body
+			LENGTH,					// Content-Length bytes
+			CHUNKED,				// Chunks up to the zero-size one and the trailers
+			UNTIL_CLOSE				// Everything until the sender closes (responses only)
+		};
+	private:
+		enum	ChunkState
+		{
+			CHUNK_SIZE,
+			CHUNK_DATA,
+			CHUNK_TRAILER
+		};
+
+		Mode		mode;
+		size_t		remaining;		// LENGTH: body bytes left, CHUNKED: chunk data and its CRLF left
+		ChunkState	chunk_state;
+		std::string	line;			// Chunk size or trailer line being read
+		bool		done;
+		bool		error;
+	public:
+		BodyFramer() : mode(NONE), remaining(0), chunk_state(CHUNK_SIZE), done(true), error(false) {}
+
+		void		start(Mode body_mode, size_t length);
+		size_t		feed(const char* data, size_t length);	// How many of these bytes belong to the body
+		Mode		getMode() const { return mode; }
+		bool		isDone() const { return done; }
+		bool		hasError() const { return error; }
+};
+
+// A request forwarded to an upstream (proxy_pass), owned by its ClientState.
+// The request body is streamed to the upstream as it arrives and the response
+// body to the client as it is read, each bounded by PROXY_BUFFER_SIZE.
+struct	ProxyState
+{
+	Upstream*			upstream;
+	int					peer;				// Peer being used (-1 = none)
+	int					fd;					// Connection to it (-1 = none)
+	bool				connected;			// connect() finished
+	bool				reused;				// Connection came from the keep-alive pool
+	bool				received;			// Anything read on this connection yet
+	std::vector<bool>	tried;				// Peers that failed for this request
+	std::string			request;			// Request head, then the body as the client sends it
+	size_t				request_sent;		// Bytes of `request` written to the upstream
+	bool				replayable;			// `request` still holds everything: another peer can be tried
+	BodyFramer			request_body;		// End of the client's body
+	size_t				body_received;		// Client body bytes (with chunk framing) so far
+	size_t				body_limit;			// client_max_body_size of the location
+	std::string			header;				// Response head being read
+	bool				headers_sent;		// Response head queued for the client
+	BodyFramer			response_body;
+	bool				keep_upstream;		// Connection can be pooled after this response
+	bool				head_request;		// HEAD: the response has no body
+	bool				paused;				// Upstream not read until the client catches up
+	time_t				last_activity;
+
+	explicit ProxyState(Upstream* target);
+
+	short		pollEvents() const;			// What the upstream connection waits for
+	bool		wantsClientBody() const;	// More body to read from the client, and room to buffer it
+	size_t		pending() const { return request.length() - request_sent; }
+	size_t		memoryBytes() const { return request.capacity() + header.capacity(); }
+	void		restart();					// Forget the connection before another attempt
+	void		compact();					// Drop request bytes already written once the buffer grows
+
+	// -1: invalid head, 0: interim 1xx response (skipped), 1: done (framing set,
+	// `client_head` is the head to forward, `client_keep_alive` cleared if the body ends with the connection)
+	int			parseResponseHead(const std::string& block, bool& client_keep_alive, std::string& client_head, int& status);
+
+	static std::string	buildRequestHead(const Request& req, const LocationConfig& location,
+							const std::string& remote_addr, bool keep_alive);
+};
+
+#endif
@@ -5,6 +5,8 @@
 #include <map>
 #include <vector>
 
+struct	LocationConfig;
+
 // Structure to hold a single multipart form field
 struct	MultipartPart
 {
@@ -38,6 +40,10 @@ class	Request
 		std::vector<MultipartPart>			multipart_parts;
 		bool								multipart_parsed;
 
+		// Routing result cached by Server::resolveLocation
+		const LocationConfig*				location;
+		bool								location_resolved;
+
 		void		parseContentDisposition(const std::string& header, std::string& name, std::string& filename);
 		void		parseContentType(const std::string& header, std::string& mime_type);
 		std::string	trim(const std::string& str) const;
@@ -56,21 +62,38 @@ class	Request
 		bool								parseHeaders();
 		bool								isHeadersComplete() const { return headers_complete; }
 		bool								isComplete() const { return headers_complete && body_complete; }
+		bool								hasPendingData() const { return !raw_data.empty(); }
 		bool								hasParseError() const { return parse_error; }
 		int									getErrorCode() const { return error_code; }
 		
 		// Getters
 		std::string							getMethod() const { return method; }
 		std::string							getPath() const { return path; }
+		std::string							getVersion() const { return version; }
 		std::string							getBody() const { return body; }
 		std::string							getHeader(const std::string& key) const;
+		const std::map<std::string, std::string>&	getHeaders() const { return headers; }
 		size_t								getContentLength() const { return content_length; }
+		bool								isChunked() const { return is_chunked; }
+		std::string							getRawBody() const;		// Body bytes as received (chunk framing kept)
+		std::string							getPipelined() const;	// Bytes received after this request
+		std::string							getUriPath() const;
+		
+		// Cached location match (set once per request by the server that handles it)
+		bool								isLocationResolved() const { return location_resolved; }
+		const LocationConfig*				getLocation() const { return location; }
+		void								setLocation(const LocationConfig* loc) { location = loc; location_resolved = true; }
 		
 		// For multipart parsing
 		std::string							getBoundary() const;
 		bool								isMultipart() const;
 		bool								parseMultipart();
 		const std::vector<MultipartPart>&	getParts() const { return multipart_parts; }
+
+		// Memory held by the buffers (allocated capacity, not just the bytes in use)
+		size_t								rawBytes() const { return raw_data.capacity(); }
+		size_t								bodyBytes() const { return body.capacity(); }
+		size_t								multipartBytes() const;
 		
 		// Utility functions
 		static std::string					urlDecode(const std::string& str);
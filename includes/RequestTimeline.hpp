@@ -0,0 +1,51 @@
+#ifndef REQUESTTIMELINE_HPP
+#define REQUESTTIMELINE_HPP
+
+#include <string>
+
+// Points in the life of one request, in the order they normally happen
+enum	RequestPhase
+{
+	PHASE_ACCEPT,				// Connection accepted (first request on a connection only)
+	PHASE_FIRST_BYTE,			// First request byte read
+	PHASE_HEADERS,				// Request line and headers parsed
+	PHASE_BODY,					// Body complete
+	PHASE_HANDLER_START,		// Routing / handler started
+	PHASE_HANDLER_END,			// Response built (or disk job finished, or CGI started)
+	PHASE_CGI_SPAWN,			// CGI process forked (or proxy_pass upstream connection started)
+	PHASE_CGI_FIRST_OUTPUT,		// First bytes read from the CGI (or upstream)
+	PHASE_CGI_EXIT,				// CGI reaped (or upstream response complete)
+	PHASE_FIRST_WRITE,			// First response byte written
+	PHASE_LAST_WRITE,			// Last response byte written (or the connection closed)
+	PHASE_COUNT
+};
+
+// A named duration between two phases: $<name>_time in the access log,
+// phase="<name>" in the metrics. phase_spans ends with a NULL name.
+struct	PhaseSpan
+{
+	const char*		name;
+	RequestPhase	from;
+	RequestPhase	to;
+};
+
+extern const PhaseSpan	phase_spans[];
+
+// Monotonic clock in microseconds (unaffected by wall-clock changes)
+unsigned long long	monotonicMicros();
+
+// Monotonic timestamps of one request's phases (0 = not reached)
+struct	RequestTimeline
+{
+	unsigned long long	at[PHASE_COUNT];
+
+	RequestTimeline() { reset(); }
+
+	void		reset();
+	void		mark(RequestPhase phase) { if (!at[phase]) at[phase] = monotonicMicros(); }
+	bool		reached(RequestPhase phase) const { return at[phase] != 0; }
+	long long	span(RequestPhase from, RequestPhase to) const;
+	std::string	describe() const;
+};
+
+#endif
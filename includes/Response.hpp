@@ -3,6 +3,9 @@
 
 #include <string>
 #include <map>
+#include <ctime>
+#include <sys/types.h>
+#include "MappedFile.hpp"
 
 class	Response
 {
@@ -11,17 +14,39 @@ class	Response
 		std::string							status_message;
 		std::map<std::string, std::string>	headers;
 		std::string							body;
+		int									body_fd;		// File sent after the headers instead of body (-1 = none)
+		off_t								body_offset;	// Where the file body starts
+		size_t								body_length;	// How many file bytes to send
+		MappedFile*							body_map;		// Shared mapping sent after the headers (NULL = none)
 	public:
 		Response();
+		Response(const Response& other);
+		Response&	operator=(const Response& other);
+		~Response();
 
 		void				setStatus(int code, const std::string& message);
 		void				setHeader(const std::string& key, const std::string& value);
 		void				setBody(const std::string& content);
+		void				setFileBody(int fd, off_t offset, size_t length);
+		void				setMappedBody(MappedFile* map);
 		int					getStatusCode() const;
-		std::string			toString() const;
+		int					getBodyFd() const { return body_fd; }
+		off_t				getBodyOffset() const { return body_offset; }
+		size_t				getBodyLength() const { return body_length; }
+		MappedFile*			getBodyMap() const { return body_map; }
+		const std::string&	getBody() const { return body; }
+		std::string			headerString() const;	// Status line and headers, up to the blank line
+		std::string			toString() const;	// Headers plus in-memory body (file bodies are sent separately)
 		
-		// Helper function to get Content-Type from file extension
-		static std::string	getContentType(const std::string& path);
+		// Standard reason phrase for a status code ("Error" if unknown)
+		static std::string	reasonPhrase(int code);
+
+		// Fully serialized minimal error response, built once per status code and Connection value
+		static const std::string&	canned(int code, bool keep_alive);
+
+		// HTTP-date helpers (RFC 7231 IMF-fixdate); parseHttpDate returns -1 on bad input
+		static std::string	httpDate(time_t t);
+		static time_t		parseHttpDate(const std::string& date);
 };
 
 #endif
\ No newline at end of file
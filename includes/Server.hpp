@@ -2,9 +2,58 @@
 #define SERVER_HPP
 
 #include <string>
+#include <sys/socket.h>
+#include <sys/stat.h>
 #include "Request.hpp"
 #include "Response.hpp"
 #include "Config.hpp"
+#include "LocationRouter.hpp"
+#include "GzipCache.hpp"
+#include "MimeTypes.hpp"
+#include "OpenFileCache.hpp"
+#include "DiskIOPool.hpp"
+#include "AccessLog.hpp"
+
+// Files above this size are sent from disk (sendfile) instead of being read into memory
+#define FILE_STREAM_THRESHOLD	(1024 * 1024)
+// Limits for multipart/byteranges responses (larger requests get the full file)
+#define MAX_RANGES				16
+#define MAX_MULTIRANGE_BYTES	FILE_STREAM_THRESHOLD
+
+// One byte range of a file (inclusive bounds, as in Content-Range)
+struct	ByteRange
+{
+	off_t	first;
+	off_t	last;
+
+	ByteRange(off_t f, off_t l) : first(f), last(l) {}
+};
+
+// Files above this size (up to FILE_STREAM_THRESHOLD) are sent from a shared mmap
+#define MMAP_THRESHOLD			(64 * 1024)
+// Total size of the mappings a server block keeps open for reuse
+#define MMAP_CACHE_SIZE			(64 * 1024 * 1024)
+
+// Autoindex page cache limits (per server block)
+#define AUTOINDEX_CACHE_ENTRIES	64
+#define AUTOINDEX_CACHE_TTL		10
+
+// One entry of an autoindex listing
+struct	DirectoryEntry
+{
+	std::string	name;
+	bool		is_dir;
+	off_t		size;
+	time_t		mtime;
+};
+
+// Rendered autoindex page, reused while the directory is unchanged
+struct	DirectoryListing
+{
+	time_t		mtime;		// Directory mtime when rendered
+	time_t		rendered;	// When it was rendered
+	std::string	html;
+};
 
 // Structure to hold CGI info for async execution
 struct	CGIInfo
@@ -21,6 +70,19 @@ class	Server
 	private:
 		int				server_fd;
 		ServerConfig	config;
+		LocationRouter	router;			// Compiled from config.locations
+		GzipCache		gzip_cache;		// On-the-fly gzip results (gzip on)
+		MimeTypes		mime_types;		// Built-in table + mime_types file + types {} block
+		std::map<std::string, DirectoryListing>	listing_cache;	// "fs_path\nuri_path" -> rendered autoindex page
+		std::map<int, Response>					error_responses;	// Prebuilt error pages by status code
+		OpenFileCache							open_files;			// open_file_cache (plain stat() when off)
+		std::map<std::string, MappedFile*>		mappings;			// Mid-size files mapped for reuse (one reference each)
+		size_t									mapped_bytes;		// Total length of mappings
+		AccessLog*								access_log;			// Shared per path, owned by the configuration generation (NULL = off)
+		LogFormat								log_format;			// Compiled access_log format
+		std::string								log_line;			// Reused for every line (keeps its capacity)
+
+		void					applyListenOptions();
 
 		// Location matching
 		const LocationConfig*	findLocation(const std::string& path) const;
@@ -28,30 +90,49 @@ class	Server
 
 		// File operations
 		std::string				readFile(const std::string& path);
+		std::string				readFile(const std::string& path, const FileInfo& info);
+		int						openBody(const std::string& path, const FileInfo& info);
+		MappedFile*				mapFile(const std::string& path, const FileInfo& info);
 		bool					fileExists(const std::string& path);
-		bool					isDirectory(const std::string& path);
-		bool					writeFile(const std::string& path, const std::string& content);
 		
+		// Conditional GET validators
+		std::string				makeETag(const struct stat& st) const;
+		bool					isNotModified(const Request& req, const std::string& etag, time_t mtime) const;
+
+		// Range requests
+		int						parseRanges(const std::string& header, off_t size, std::vector<ByteRange>& ranges) const;
+		bool					ifRangeMatches(const Request& req, const std::string& etag, time_t mtime) const;
+		Response				serveRanges(const std::string& path, const FileInfo& info, const std::vector<ByteRange>& ranges, const std::string& content_type);
+
+		// Content-Encoding negotiation
+		bool					acceptsEncoding(const std::string& accept_encoding, const std::string& coding) const;
+		bool					isCompressible(const std::string& content_type) const;
+		bool					findPrecompressed(const std::string& path, const std::string& accept_encoding, std::string& encoded_path, FileInfo& encoded, std::string& encoding);
+
 		// Response builders
-		Response				serveFile(const std::string& path, const LocationConfig* location);
-		Response				serveDirectory(const std::string& fs_path, const std::string& uri_path, const LocationConfig* location);
+		Response				serveFile(const Request& req, const std::string& path, const LocationConfig* location);
+		Response				serveDirectory(const Request& req, const std::string& fs_path, const std::string& uri_path, const LocationConfig* location);
+		const std::string*		directoryListing(const std::string& fs_path, const std::string& uri_path);
 		Response				serveErrorPage(int code, const std::string& message);
+		Response				buildErrorPage(int code, const std::string& message);
+		void					loadErrorPages();
 		Response				serveRedirect(int code, const std::string& url);
 		Response				serve403();
 		Response				serve404();
 		Response				serve405();
 		Response				serve413();
+		Response				serve416(off_t size);
 		Response				serve500();
 		Response				serve501();
 		
 		// POST handling
-		Response				handlePost(const Request& req, const LocationConfig* location);
-		Response				handleMultipartUpload(const Request& req, const LocationConfig* location);
-		Response				handleRawUpload(const Request& req, const LocationConfig* location);
+		Response				handlePost(const Request& req, const LocationConfig* location, DiskJob*& job);
+		Response				handleMultipartUpload(const Request& req, const LocationConfig* location, DiskJob*& job);
+		Response				handleRawUpload(const Request& req, const LocationConfig* location, DiskJob*& job);
+		std::string				uploadLocationUri(const LocationConfig* location) const;
 		
 		// DELETE handling
-		Response				handleDelete(const Request& req, const LocationConfig* location);
-		bool					deleteFile(const std::string& path);
+		Response				handleDelete(const Request& req, const LocationConfig* location, DiskJob*& job);
 		
 		// Helper
 		std::string				buildFilePath(const std::string& uri, const LocationConfig* location);
@@ -63,20 +144,33 @@ class	Server
 		
 		bool				start();
 		void				stop();
+		bool				resolveListenAddress(struct sockaddr_storage& addr, socklen_t& addr_len) const;
+		void				adoptListener(int fd);
+		int					releaseListener();
 		
 		// Expose server_fd for poll()
 		int					getServerFd() const { return server_fd; }
 		
 		// Get config info
 		int					getPort() const { return config.port; }
-		std::string			getServerName() const { return config.server_name; }
+		std::string			getListenAddress() const { return config.listenAddress(); }
+		bool				isUnixSocket() const { return !config.unix_path.empty(); }
+		std::string			getServerName() const { return config.server_names.empty() ? "" : config.server_names[0]; }
 		const ServerConfig&	getConfig() const { return config; }
 		
+		// Location matching, cached on the request
+		const LocationConfig*	resolveLocation(Request& req) const;
+
 		// CGI detection for async handling
-		bool				isCGIRequest(const Request& req, CGIInfo& info);
+		bool				isCGIRequest(Request& req, CGIInfo& info);
 		
-		// Handle non-CGI request (excludes CGI processing)
-		Response			handleNonCGIRequest(const Request& req);
+		// Handle non-CGI request (excludes CGI processing); disk work is handed back as a job
+		Response			handleNonCGIRequest(Request& req, DiskJob*& job);
+		Response			finishDiskJob(const DiskJob& job);
+
+		// Access log (buffered, see AccessLog)
+		void				setAccessLog(AccessLog* log) { access_log = log; }
+		void				logRequest(const AccessLogRecord& record);
 };
 
 #endif
\ No newline at end of file
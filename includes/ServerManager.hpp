@@ -9,22 +9,71 @@
 #include "Config.hpp"
 #include "Request.hpp"
 #include "CGI.hpp"
+#include "Metrics.hpp"
+#include "RequestTimeline.hpp"
+#include "OutputQueue.hpp"
+#include "Upstream.hpp"
+#include "Proxy.hpp"
 #include <ctime>
+#include <csignal>
 
 // Connection timeout in seconds (for idle connections)
 #define CONNECTION_TIMEOUT 60
 #define CGI_TIMEOUT 30
+// Most response bytes written to one client per event so one download cannot starve the others
+#define OUTPUT_FLUSH_LIMIT (4 * FILE_SEND_CHUNK)
+// Connections listed by the SIGUSR1 memory report
+#define MEMORY_DUMP_TOP 10
+// Paused reads resume once connection buffers drop below this share of buffer_budget
+#define BUFFER_BUDGET_RESUME_PERCENT 75
+
+// Virtual host lookup for one listen address, built once at startup.
+// Checked in nginx order: exact name, longest leading wildcard, longest trailing wildcard, default.
+struct	VirtualHostTable
+{
+	std::map<std::string, int>	exact;					// "example.com" -> server index
+	std::map<std::string, int>	leading_wildcards;		// ".example.com" (from *.example.com or .example.com)
+	std::map<std::string, int>	trailing_wildcards;		// "www.example." (from www.example.*)
+	int							default_server;			// listen ... default_server, else first block on the address
+
+	VirtualHostTable() : default_server(-1) {}
+};
+
+// One loaded configuration. A reload builds a new generation; the previous one
+// stays alive until the last connection still using it has finished its request.
+struct	ServerGeneration
+{
+	std::vector<Server*>					servers;
+	std::map<std::string, VirtualHostTable>	virtual_hosts;	// Listen address -> name lookup table
+	std::map<std::string, int>				listeners;		// Listen address -> index of the server owning the socket
+	std::map<std::string, int>				shared;			// "127.0.0.1:80" accepted by the 0.0.0.0:80 socket -> its first server
+	std::map<std::string, AccessLog*>		access_logs;	// Path -> log shared by the servers writing to it
+	std::map<std::string, Upstream*>		upstreams;		// Name -> proxy_pass target (peers and keep-alive pool)
+	int										connections;	// Client connections bound to this generation
+
+	ServerGeneration() : connections(0) {}
+	~ServerGeneration();
+};
 
 // Tracks the state of a client connection
 struct	ClientState
 {
 	Request		request;
-	std::string	response_buffer;	// Buffer for outgoing response
-	size_t		bytes_sent;			// How many bytes have been sent
-	int			server_index;
+	OutputQueue	output;				// Response bytes still to send (headers, body, file regions)
+	size_t		bytes_sent;			// Bytes of the current response written so far
+	ServerGeneration*	generation;	// Configuration this connection is served with
+	int			server_index;		// Listening server within the generation
 	bool		response_ready;
 	time_t		last_activity;		// Timestamp of last activity
 	bool		keep_alive;			// Whether to keep connection alive after response
+	bool		corked;				// TCP_CORK/TCP_NOPUSH held while a response is being written
+
+	// Access log
+	std::string	remote_addr;		// Peer address ("unix:" for Unix sockets)
+	Server*		request_server;		// Virtual host answering the current request (NULL = listening server)
+	int			response_status;	// Status code of the queued response
+	size_t		response_header_bytes;	// Size of its status line and headers
+	RequestTimeline	timeline;		// Phase timestamps of the current request (reset once recorded)
 	
 	// CGI state (for non-blocking CGI execution through poll)
 	bool		cgi_in_progress;
@@ -36,33 +85,87 @@ struct	ClientState
 	std::string	cgi_output;				// Collected CGI output
 	time_t		cgi_start_time;			// For timeout detection
 	CGI*		cgi_handler;			// CGI context for building response
+
+	DiskJob*	disk_job;				// Upload/DELETE running on the disk I/O pool (NULL = none)
+	ProxyState*	proxy;					// Request being forwarded to a proxy_pass upstream (NULL = none)
+	ConnectionMemory	memory;			// Buffer sizes last added to the metrics totals
 	
-	ClientState() : bytes_sent(0), server_index(-1), response_ready(false),
-					last_activity(time(NULL)), keep_alive(true), cgi_in_progress(false),
-					cgi_stdin_fd(-1), cgi_stdout_fd(-1), cgi_pid(-1),
-					cgi_input_sent(0), cgi_start_time(0), cgi_handler(NULL) {}
+	ClientState() : bytes_sent(0), generation(NULL), server_index(-1), response_ready(false),
+					last_activity(time(NULL)), keep_alive(true), corked(false), request_server(NULL), response_status(0),
+					response_header_bytes(0),
+					cgi_in_progress(false), cgi_stdin_fd(-1), cgi_stdout_fd(-1), cgi_pid(-1),
+					cgi_input_sent(0), cgi_start_time(0), cgi_handler(NULL), disk_job(NULL), proxy(NULL) {}
 };
 
 class   ServerManager
 {
 	private:
-		std::vector<Server*>		servers;
-		std::vector<struct pollfd>	poll_fds;
-		std::map<int, int>			fd_to_server;			// Maps fd to server index
-		std::set<int>				server_fds;				// Track which fds are server sockets
-		std::map<int, ClientState>	client_states;			// Track partial requests for each client
-		std::map<int, int>			cgi_fd_to_client;		// Maps CGI pipe fds to client fds
+		ServerGeneration*				current;				// Configuration new requests are served with
+		std::vector<ServerGeneration*>	retired;				// Older configurations with requests still in flight
+		std::string						config_file;			// Re-read on SIGHUP
+		std::vector<struct pollfd>		poll_fds;
+		std::map<int, int>				fd_to_server;			// Maps listening fd to server index in the current generation
+		std::set<int>					server_fds;				// Track which fds are server sockets
+		std::map<int, ClientState>		client_states;			// Track partial requests for each client
+		std::map<int, int>				cgi_fd_to_client;		// Maps CGI pipe fds to client fds
+		std::map<int, int>				proxy_fd_to_client;		// Maps upstream connection fds to client fds
+		std::vector<int>				pipelined;				// Clients with a pipelined request already buffered
+		DiskIOPool						disk_pool;				// Worker threads for uploads and DELETE
+		int								disk_io_threads;		// Pool size (fixed at startup)
+		Metrics							metrics;				// Served by "metrics on" locations
+		LoopProfiler					profiler;				// Time spent per event loop iteration and handler
+		size_t							buffer_budget;			// Connection buffer bytes before reads pause (0 = unlimited)
+		bool							reads_paused;			// Over budget: idle clients and CGI pipes are not read
+
+		static volatile sig_atomic_t	reload_requested;
+		static volatile sig_atomic_t	memory_dump_requested;
+		static volatile sig_atomic_t	stop_requested;
 		
 		void		addPollFd(int fd, short events);
 		void		removePollFd(int fd);
 		void		updatePollEvents(int fd, short events);
+		bool		readBlocked(int fd) const;
+		short		throttleEvents(int fd, short events) const;
+		short		clientEvents(const ClientState& state) const;
+		void		handleEvents();
 		void		handleNewConnection(int server_index);
 		void		handleClientRequest(int client_fd);
+		void		processRequest(int client_fd, ClientState& state);
+		void		handlePipelined();
+		Server*		routeRequest(ClientState& state);
 		void		handleClientWrite(int client_fd);
 		void		queueResponse(int client_fd, const std::string& response);
+		void		queueResponse(int client_fd, const Response& response);
+		void		startResponse(int client_fd, ClientState& state);
+		bool		writeOutput(int client_fd, ClientState& state, bool polled);
+		void		completeResponse(int client_fd, ClientState& state);
 		void		closeClient(int client_fd);
 		void		checkTimeouts();
-		int			findServerByHost(const std::string& host, int port) const;
+		void		addVirtualHost(ServerGeneration& generation, int server_index);
+		int			findServerByHost(const ServerGeneration& generation, const std::string& host, const std::string& listen_address) const;
+
+		// Configuration generations (SIGHUP reload)
+		ServerGeneration*	createGeneration(const std::vector<ServerConfig>& configs, const std::map<std::string, UpstreamConfig>& upstreams);
+		void				discardGeneration(ServerGeneration* generation);
+		bool				openAccessLogs(ServerGeneration& generation);
+		bool				openUpstreams(ServerGeneration& generation, const std::map<std::string, UpstreamConfig>& upstreams);
+		void				activateGeneration(ServerGeneration* generation);
+		void				bindClient(ClientState& state, ServerGeneration* generation, int server_index);
+		bool				rebindClient(ClientState& state);
+		void				releaseGeneration(ServerGeneration* generation);
+		void				reload();
+		Server*				listeningServer(const ClientState& state) const { return state.generation->servers[state.server_index]; }
+
+		// Access log and metrics
+		void				recordRequest(ClientState& state);
+		void				flushAccessLogs(time_t now, bool all);
+		Response			metricsResponse(int client_fd);
+		std::string			describeClient(int client_fd) const;
+		void				accountMemory(int client_fd);
+		void				applyBufferBudget();
+		void				setReadsPaused(bool paused);
+		void				dumpMemory();
+
 		std::string	extractHostname(const std::string& host) const;
 		
 		// CGI handling through poll
@@ -71,13 +174,35 @@ class   ServerManager
 		void		handleCGIRead(int cgi_stdout_fd);
 		void		finishCGI(int client_fd, bool success);
 		void		cleanupCGI(int client_fd);
+
+		// Reverse proxy (proxy_pass) through poll
+		void		startProxy(int client_fd, ClientState& state, const LocationConfig& location);
+		bool		connectUpstream(int client_fd, ClientState& state, bool pooled);
+		void		forwardRequestBody(int client_fd, ClientState& state, const char* data, size_t length);
+		void		handleUpstreamEvent(int upstream_fd, short revents);
+		void		readUpstream(int client_fd, ClientState& state);
+		void		upstreamFailed(int client_fd, ClientState& state, int status);
+		void		failProxy(int client_fd, ClientState& state, int status);
+		void		finishProxy(int client_fd, ClientState& state);
+		void		cleanupProxy(ClientState& state);
+
+		// Disk I/O pool
+		void		startDiskJob(int client_fd, Server* server, DiskJob* job);
+		void		finishDiskJob(DiskJob* job);
+		void		handleDiskCompletions();
 	public:
 		ServerManager();
 		~ServerManager();
 
-		bool	initServers(const std::vector<ServerConfig>& configs);
+		bool	initServers(const std::vector<ServerConfig>& configs, const GlobalConfig& global);
+		void	setConfigFile(const std::string& path) { config_file = path; }
 		void	run();
 		void	stop();
+
+		// Async-signal-safe: only sets a flag, the loop reloads on its next iteration
+		static void	requestReload() { reload_requested = 1; }
+		static void	requestMemoryDump() { memory_dump_requested = 1; }
+		static void	requestStop() { stop_requested = 1; }
 };
 
 #endif
\ No newline at end of file
@@ -0,0 +1,71 @@
+#ifndef UPSTREAM_HPP
+#define UPSTREAM_HPP
+
+#include <string>
+#include <vector>
+#include <deque>
+#include <ctime>
+#include <sys/socket.h>
+#include "Config.hpp"
+
+// Idle keep-alive connections unused this long are closed (seconds)
+#define UPSTREAM_KEEPALIVE_TIMEOUT 60
+
+// One server of an upstream group
+struct	UpstreamPeer
+{
+	std::string				name;			// "127.0.0.1:9000" as configured
+	struct sockaddr_storage	addr;			// Resolved when the configuration is loaded
+	socklen_t				addr_len;
+	int						max_fails;
+	int						fail_timeout;
+	int						fails;			// Failures since window_start
+	time_t					window_start;	// First failure of the current fail_timeout window
+	time_t					down_until;		// Skipped until then after max_fails failures (0 = up)
+	int						active;			// Requests using the peer right now
+};
+
+// A connection kept open for reuse after a complete response
+struct	IdleConnection
+{
+	int		fd;
+	int		peer;
+	time_t	since;
+};
+
+// Servers behind one proxy_pass target: peer choice (round-robin or least_conn),
+// passive health checks (max_fails / fail_timeout) and the keep-alive pool.
+// One per configuration generation; idle connections are not polled while pooled.
+class	Upstream
+{
+	private:
+		std::string					name;
+		std::vector<UpstreamPeer>	peers;
+		bool						least_conn;
+		size_t						keepalive;		// Most idle connections kept
+		size_t						next;			// Round-robin position
+		std::deque<IdleConnection>	idle;			// Oldest first
+
+		Upstream(const Upstream&);
+		Upstream&	operator=(const Upstream&);
+	public:
+		Upstream(const std::string& name, const UpstreamConfig& config);
+		~Upstream();
+
+		bool				resolve(const UpstreamConfig& config, std::string& error);
+		const std::string&	getName() const { return name; }
+		const std::string&	peerName(int peer) const { return peers[peer].name; }
+		size_t				size() const { return peers.size(); }
+		bool				keepsAlive() const { return keepalive > 0; }
+
+		// Next peer not in `tried` and not marked down (-1 = none left); counts it as active
+		int					select(const std::vector<bool>& tried, time_t now);
+		int					connect(int peer) const;					// Non-blocking socket, connect started (-1 = failed)
+		int					takeIdle(int peer);							// Pooled connection to `peer` (-1 = none)
+		void				release(int peer, int fd, bool reusable, time_t now);
+		void				failed(int peer, time_t now);
+		void				succeeded(int peer);
+		void				closeIdle(time_t now);						// Drop connections idle too long
+};
+
+#endif
@@ -0,0 +1,363 @@
+#include "AccessLog.hpp"
+#include "Request.hpp"
+#include <sstream>
+#include <cstdio>
+#include <cctype>
+#include <unistd.h>
+#include <fcntl.h>
+#include <sys/stat.h>
+
+// --- LogFormat ---
+
+// "user_agent" -> "User-Agent" (the case clients send; header lookup is exact)
+static std::string	headerName(const std::string& variable)
+{
+	std::string	name = variable;
+	bool		word_start = true;
+
+	for (size_t i = 0; i < name.length(); i++)
+	{
+		if (name[i] == '_')
+		{
+			name[i] = '-';
+			word_start = true;
+		}
+		else
+		{
+			name[i] = word_start ? std::toupper(name[i]) : std::tolower(name[i]);
+			word_start = false;
+		}
+	}
+	return (name);
+}
+
+bool	LogFormat::compile(const std::string& format, std::string& error)
+{
+	static const struct
+	{
+		const char*	name;
+		Variable	variable;
+	}	variables[] = {
+		{ "remote_addr", LOG_REMOTE_ADDR }, { "time_local", LOG_TIME_LOCAL },
+		{ "time_iso8601", LOG_TIME_ISO8601 }, { "msec", LOG_MSEC },
+		{ "request", LOG_REQUEST }, { "request_method", LOG_REQUEST_METHOD },
+		{ "request_uri", LOG_REQUEST_URI }, { "uri", LOG_URI },
+		{ "server_protocol", LOG_SERVER_PROTOCOL }, { "status", LOG_STATUS },
+		{ "bytes_sent", LOG_BYTES_SENT }, { "body_bytes_sent", LOG_BODY_BYTES_SENT },
+		{ "phase_times", LOG_PHASE_TIMES }, { "host", LOG_HOST }, { "server_name", LOG_SERVER_NAME },
+		{ NULL, LOG_LITERAL }
+	};
+	segments.clear();
+
+	size_t	pos = 0;
+
+	while (pos < format.length())
+	{
+		Segment	segment;
+		size_t	dollar = format.find('$', pos);
+
+		if (dollar != pos)
+		{
+			segment.variable = LOG_LITERAL;
+			segment.text = format.substr(pos, dollar == std::string::npos ? std::string::npos : dollar - pos);
+			segments.push_back(segment);
+			if (dollar == std::string::npos)
+				break ;
+		}
+
+		// $name or ${name}
+		size_t	start = dollar + 1;
+		bool	braced = (start < format.length() && format[start] == '{');
+
+		if (braced)
+			start++;
+
+		size_t	end = start;
+
+		while (end < format.length() && (std::isalnum(format[end]) || format[end] == '_'))
+			end++;
+		if (end == start || (braced && (end >= format.length() || format[end] != '}')))
+		{
+			error = "invalid variable in log format at '" + format.substr(dollar) + "'";
+			return (false);
+		}
+
+		std::string	name = format.substr(start, end - start);
+
+		pos = braced ? end + 1 : end;
+		if (name.find("http_") == 0 && name.length() > 5)
+		{
+			segment.variable = LOG_HTTP_HEADER;
+			segment.text = headerName(name.substr(5));
+			segments.push_back(segment);
+			continue ;
+		}
+
+		// $<phase>_time: seconds between two phases ($request_time, $upstream_response_time, ...)
+		int	i = 0;
+
+		while (phase_spans[i].name && name != std::string(phase_spans[i].name) + "_time")
+			i++;
+		if (phase_spans[i].name)
+		{
+			segment.variable = LOG_SPAN;
+			segment.from = phase_spans[i].from;
+			segment.to = phase_spans[i].to;
+			segments.push_back(segment);
+			continue ;
+		}
+		i = 0;
+		while (variables[i].name && name != variables[i].name)
+			i++;
+		if (!variables[i].name)
+		{
+			error = "unknown variable $" + name + " in log format";
+			return (false);
+		}
+		segment.variable = variables[i].variable;
+		segment.text.clear();
+		segments.push_back(segment);
+	}
+	return (true);
+}
+
+// Quotes, backslashes and control bytes from the client are written as \xXX (nginx escaping)
+static void	appendEscaped(std::string& line, const std::string& value)
+{
+	if (value.empty())
+	{
+		line += '-';
+		return ;
+	}
+	for (size_t i = 0; i < value.length(); i++)
+	{
+		unsigned char	c = value[i];
+
+		if (c == '"' || c == '\\' || c < 0x20 || c >= 0x7f)
+		{
+			char	hex[8];
+
+			snprintf(hex, sizeof(hex), "\\x%02X", c);
+			line += hex;
+		}
+		else
+			line += c;
+	}
+}
+
+static void	appendNumber(std::string& line, unsigned long value)
+{
+	char	digits[24];
+
+	snprintf(digits, sizeof(digits), "%lu", value);
+	line += digits;
+}
+
+static void	appendSeconds(std::string& line, double seconds)
+{
+	char	digits[32];
+
+	if (seconds < 0)
+		seconds = 0;
+	snprintf(digits, sizeof(digits), "%.3f", seconds);
+	line += digits;
+}
+
+// Host header without the port ("[::1]:8080" -> "[::1]")
+static std::string	hostName(const std::string& host)
+{
+	size_t	colon = host.rfind(':');
+
+	if (colon == std::string::npos || host[host.length() - 1] == ']')
+		return (host);
+	return (host.substr(0, colon));
+}
+
+// strftime() once per second, not once per line
+static const std::string&	formatTime(time_t now, bool iso8601)
+{
+	static time_t		cached[2] = { -1, -1 };
+	static std::string	text[2];
+	int					slot = iso8601 ? 1 : 0;
+
+	if (cached[slot] != now)
+	{
+		struct tm	local;
+		char		buffer[64];
+
+		localtime_r(&now, &local);
+		strftime(buffer, sizeof(buffer), iso8601 ? "%Y-%m-%dT%H:%M:%S%z" : "%d/%b/%Y:%H:%M:%S %z", &local);
+		text[slot] = buffer;
+		cached[slot] = now;
+	}
+	return (text[slot]);
+}
+
+void	LogFormat::append(std::string& line, const AccessLogRecord& record) const
+{
+	const Request*	req = record.request;
+
+	for (size_t i = 0; i < segments.size(); i++)
+	{
+		const Segment&	segment = segments[i];
+
+		switch (segment.variable)
+		{
+			case LOG_LITERAL:
+				line += segment.text;
+				break ;
+			case LOG_REMOTE_ADDR:
+				appendEscaped(line, record.remote_addr);
+				break ;
+			case LOG_TIME_LOCAL:
+				line += formatTime(record.end.tv_sec, false);
+				break ;
+			case LOG_TIME_ISO8601:
+				line += formatTime(record.end.tv_sec, true);
+				break ;
+			case LOG_MSEC:
+				appendSeconds(line, record.end.tv_sec + record.end.tv_usec / 1000000.0);
+				break ;
+			case LOG_REQUEST:
+			{
+				// As much of the request line as was parsed
+				std::string	request_line = req ? req->getMethod() : "";
+
+				if (req && !req->getPath().empty())
+					request_line += " " + req->getPath();
+				if (req && !req->getVersion().empty())
+					request_line += " " + req->getVersion();
+				appendEscaped(line, request_line);
+				break ;
+			}
+			case LOG_REQUEST_METHOD:
+				appendEscaped(line, req ? req->getMethod() : "");
+				break ;
+			case LOG_REQUEST_URI:
+				appendEscaped(line, req ? req->getPath() : "");
+				break ;
+			case LOG_URI:
+				appendEscaped(line, req && !req->getPath().empty() ? req->getUriPath() : "");
+				break ;
+			case LOG_SERVER_PROTOCOL:
+				appendEscaped(line, req ? req->getVersion() : "");
+				break ;
+			case LOG_STATUS:
+				appendNumber(line, record.status);
+				break ;
+			case LOG_BYTES_SENT:
+				appendNumber(line, record.bytes_sent);
+				break ;
+			case LOG_BODY_BYTES_SENT:
+				appendNumber(line, record.body_bytes_sent);
+				break ;
+			case LOG_SPAN:
+			{
+				long long	span = record.timeline ? record.timeline->span(segment.from, segment.to) : -1;
+
+				if (span < 0)
+					line += '-';
+				else
+					appendSeconds(line, span / 1000000.0);
+				break ;
+			}
+			case LOG_PHASE_TIMES:
+				line += record.timeline ? record.timeline->describe() : "-";
+				break ;
+			case LOG_HOST:
+			{
+				std::string	host = req ? hostName(req->getHeader("Host")) : "";
+
+				appendEscaped(line, host.empty() ? record.server_name : host);
+				break ;
+			}
+			case LOG_SERVER_NAME:
+				appendEscaped(line, record.server_name);
+				break ;
+			case LOG_HTTP_HEADER:
+				appendEscaped(line, req ? req->getHeader(segment.text) : "");
+				break ;
+		}
+	}
+	line += '\n';
+}
+
+// --- AccessLog ---
+
+AccessLog::AccessLog() : fd(-1), buffer_size(0), flush_interval(0), last_flush(time(NULL)), dropped(0) {}
+
+AccessLog::~AccessLog()
+{
+	flush();
+	if (fd >= 0)
+		close(fd);
+}
+
+bool	AccessLog::open(const std::string& file_path)
+{
+	int			std_fd = (file_path == "/dev/stdout") ? 1 : (file_path == "/dev/stderr") ? 2 : -1;
+	struct stat	st;
+
+	path = file_path;
+	// Standard output redirected to a file: share its offset, or lines written
+	// through std::cout and through a second descriptor would overwrite each other
+	if (std_fd >= 0 && fstat(std_fd, &st) == 0 && S_ISREG(st.st_mode))
+		fd = fcntl(std_fd, F_DUPFD_CLOEXEC, 3);
+	else
+		fd = ::open(path.c_str(), O_WRONLY | O_APPEND | O_CREAT | O_NONBLOCK | O_CLOEXEC, 0644);
+	return (fd >= 0);
+}
+
+// Several server blocks may share the log: the largest buffer and the shortest interval win
+void	AccessLog::configure(size_t size, time_t interval)
+{
+	if (size > buffer_size)
+		buffer_size = size;
+	if (flush_interval == 0 || (interval > 0 && interval < flush_interval))
+		flush_interval = interval;
+	buffer.reserve(buffer_size);
+}
+
+void	AccessLog::write(const std::string& line)
+{
+	if (fd < 0)
+		return ;
+	if (buffer.length() + line.length() > buffer_size * ACCESS_LOG_BACKLOG_FACTOR && buffer_size > 0)
+	{
+		dropped++;
+		return ;
+	}
+	buffer += line;
+	if (buffer.length() >= buffer_size)
+		flush();
+}
+
+// Called from the event loop once per iteration
+void	AccessLog::tick(time_t now)
+{
+	if (!buffer.empty() && now - last_flush >= flush_interval)
+		flush();
+}
+
+// One write() for everything pending; whatever the file does not take stays buffered
+void	AccessLog::flush()
+{
+	last_flush = time(NULL);
+	if (fd < 0)
+		return ;
+	if (dropped > 0)
+	{
+		std::ostringstream	note;
+
+		note << "webserv: " << dropped << " access log line(s) dropped, " << path << " is not keeping up\n";
+		buffer += note.str();
+		dropped = 0;
+	}
+	if (buffer.empty())
+		return ;
+
+	ssize_t	written = ::write(fd, buffer.data(), buffer.length());
+
+	if (written > 0)
+		buffer.erase(0, written);
+}
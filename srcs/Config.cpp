@@ -1,12 +1,47 @@
 #include "Config.hpp"
+#include "AccessLog.hpp"
 #include <fstream>
 #include <iostream>
 #include <sstream>
 #include <cctype>
 #include <cstdlib>
+#include <regex.h>
 
 Config::Config() {}
 
+GlobalConfig::GlobalConfig() : disk_io_threads(2), slow_loop_threshold(100), buffer_budget(256 * 1024 * 1024)
+{
+	log_formats["combined"] = "$remote_addr - - [$time_local] \"$request\" $status $body_bytes_sent "
+		"\"$http_referer\" \"$http_user_agent\"";
+	log_formats["timed"] = "$remote_addr $host [$time_local] \"$request\" $status $body_bytes_sent "
+		"rt=$request_time urt=$upstream_response_time $phase_times";
+	access_log.path = "/dev/stdout";
+}
+
+std::string	LocationConfig::relativeUri(const std::string& uri) const
+{
+	if ((match == LOCATION_PREFIX || match == LOCATION_PREFIX_NO_REGEX) && uri.compare(0, path.length(), path) == 0)
+		return (uri.substr(path.length()));
+	return (uri);
+}
+
+std::string	ServerConfig::listenAddress() const
+{
+	if (!unix_path.empty())
+		return ("unix:" + unix_path);
+
+	std::ostringstream	oss;
+
+	if (host.empty())
+		oss << "0.0.0.0";
+	else if (host.find(':') != std::string::npos)
+		oss << "[" << host << "]";
+	else
+		oss << host;
+	oss << ":" << port;
+	return (oss.str());
+}
+
 std::string	Config::trim(const std::string& str)
 {
 	size_t	start = 0;
@@ -72,6 +107,261 @@ bool	Config::isNumber(const std::string& str)
 	return (!str.empty());
 }
 
+// Parse the address part of a listen directive:
+// 8080, 127.0.0.1:8080, 127.0.0.1 (port 80), [::]:8080, [::1], unix:/run/webserv.sock
+bool	Config::parseListen(const std::string& value, ServerConfig& server)
+{
+	std::string	port_str;
+
+	server.host.clear();
+	server.unix_path.clear();
+	if (value.find("unix:") == 0)
+	{
+		server.unix_path = value.substr(5);
+		server.port = 0;
+		return (!server.unix_path.empty());
+	}
+	if (value[0] == '[')
+	{
+		size_t	close_bracket = value.find(']');
+
+		if (close_bracket == std::string::npos)
+			return (false);
+		server.host = value.substr(1, close_bracket - 1);
+		if (close_bracket + 1 < value.length())
+		{
+			if (value[close_bracket + 1] != ':')
+				return (false);
+			port_str = value.substr(close_bracket + 2);
+		}
+	}
+	else if (isNumber(value))
+		port_str = value;
+	else
+	{
+		size_t	colon = value.rfind(':');
+
+		if (colon != std::string::npos)
+		{
+			server.host = value.substr(0, colon);
+			port_str = value.substr(colon + 1);
+		}
+		else
+			server.host = value;
+	}
+	if (server.host == "*")
+		server.host.clear();
+	if (port_str.empty())
+	{
+		server.port = 80;
+		return (true);
+	}
+	if (!isNumber(port_str))
+		return (false);
+	server.port = std::atoi(port_str.c_str());
+	return (server.port > 0 && server.port <= 65535);
+}
+
+// "30" / "30s" / "5m" / "1h" -> seconds (-1 on bad input)
+int	Config::parseTime(const std::string& time_str)
+{
+	if (time_str.empty())
+		return (-1);
+
+	int			multiplier = 1;
+	std::string	num_str = time_str;
+	char		last_char = time_str[time_str.length() - 1];
+
+	if (last_char == 's' || last_char == 'm' || last_char == 'h')
+	{
+		multiplier = (last_char == 'h') ? 3600 : (last_char == 'm') ? 60 : 1;
+		num_str = time_str.substr(0, time_str.length() - 1);
+	}
+	if (!isNumber(num_str))
+		return (-1);
+	return (std::atoi(num_str.c_str()) * multiplier);
+}
+
+// "250ms", or any parseTime() value ("1s", "2m")
+int	Config::parseMilliseconds(const std::string& time_str)
+{
+	if (time_str.length() > 2 && time_str.compare(time_str.length() - 2, 2, "ms") == 0)
+	{
+		std::string	num_str = time_str.substr(0, time_str.length() - 2);
+
+		return (isNumber(num_str) ? std::atoi(num_str.c_str()) : -1);
+	}
+
+	int	secs = parseTime(time_str);
+
+	return (secs < 0 ? -1 : secs * 1000);
+}
+
+// access_log off | <path> [format] [buffer=size] [flush=time]
+bool	Config::parseAccessLog(const std::vector<std::string>& tokens, AccessLogConfig& log)
+{
+	log = AccessLogConfig();
+	log.path = tokens[1];
+	for (size_t i = 2; i < tokens.size(); i++)
+	{
+		if (tokens[i].find("buffer=") == 0)
+			log.buffer = parseSize(tokens[i].substr(7));
+		else if (tokens[i].find("flush=") == 0 && parseTime(tokens[i].substr(6)) > 0)
+			log.flush = parseTime(tokens[i].substr(6));
+		else if (i == 2 && tokens[i].find('=') == std::string::npos)
+			log.format_name = tokens[i];
+		else
+		{
+			std::cerr << "Error: Invalid access_log parameter '" << tokens[i] << "'" << std::endl;
+			return (false);
+		}
+	}
+	return (true);
+}
+
+// server <address> [max_fails=N] [fail_timeout=time] (address written as for listen, host required)
+bool	Config::parseUpstreamServer(const std::vector<std::string>& tokens, UpstreamConfig& upstream)
+{
+	ServerConfig			address;
+	UpstreamServerConfig	server;
+
+	if (!parseListen(tokens[1], address) || address.host.empty() || !address.unix_path.empty())
+	{
+		std::cerr << "Error: Invalid upstream server address '" << tokens[1] << "'" << std::endl;
+		return (false);
+	}
+	server.host = address.host;
+	server.port = address.port;
+	for (size_t i = 2; i < tokens.size(); i++)
+	{
+		if (tokens[i].find("max_fails=") == 0 && isNumber(tokens[i].substr(10)))
+			server.max_fails = std::atoi(tokens[i].c_str() + 10);
+		else if (tokens[i].find("fail_timeout=") == 0 && parseTime(tokens[i].substr(13)) >= 0)
+			server.fail_timeout = parseTime(tokens[i].substr(13));
+		else
+		{
+			std::cerr << "Error: Invalid upstream server parameter '" << tokens[i] << "'" << std::endl;
+			return (false);
+		}
+	}
+	upstream.servers.push_back(server);
+	return (true);
+}
+
+// proxy_pass http://<upstream name | host[:port]>[/uri]
+bool	Config::parseProxyPass(const std::string& url, LocationConfig& location)
+{
+	if (url.compare(0, 7, "http://") != 0 || url.length() == 7 || url[7] == '/')
+	{
+		std::cerr << "Error: proxy_pass needs an http:// URL: '" << url << "'" << std::endl;
+		return (false);
+	}
+
+	size_t	slash = url.find('/', 7);
+
+	location.proxy_pass = url.substr(7, slash - 7);
+	location.proxy_uri = (slash == std::string::npos) ? "" : url.substr(slash);
+	return (true);
+}
+
+// Upstream blocks need servers; a proxy_pass naming no upstream block is a single host[:port]
+bool	Config::resolveUpstreams()
+{
+	for (std::map<std::string, UpstreamConfig>::const_iterator it = global.upstreams.begin(); it != global.upstreams.end(); ++it)
+	{
+		if (it->second.servers.empty())
+		{
+			std::cerr << "Error: upstream '" << it->first << "' has no servers" << std::endl;
+			return (false);
+		}
+	}
+	for (size_t i = 0; i < servers.size(); i++)
+	{
+		for (size_t j = 0; j < servers[i].locations.size(); j++)
+		{
+			const std::string&	name = servers[i].locations[j].proxy_pass;
+
+			if (name.empty() || global.upstreams.find(name) != global.upstreams.end())
+				continue ;
+
+			std::vector<std::string>	tokens;
+			UpstreamConfig				upstream;
+
+			tokens.push_back("server");
+			tokens.push_back(name);
+			if (!parseUpstreamServer(tokens, upstream))
+				return (false);
+			global.upstreams[name] = upstream;
+		}
+	}
+	return (true);
+}
+
+// 'quoted' "strings" are joined, the quotes removed: log_format main '$status ' '$request'
+std::string	Config::unquote(const std::string& str)
+{
+	std::string	result;
+	size_t		i = 0;
+
+	while (i < str.length())
+	{
+		if (str[i] == '\'' || str[i] == '"')
+		{
+			size_t	close = str.find(str[i], i + 1);
+
+			if (close == std::string::npos)
+				close = str.length();
+			result += str.substr(i + 1, close - i - 1);
+			i = close + 1;
+		}
+		else if (std::isspace(str[i]))
+			i++;
+		else
+		{
+			size_t	end = str.find_first_of(" \t'\"", i);
+
+			if (end == std::string::npos)
+				end = str.length();
+			result += str.substr(i, end - i);
+			i = end;
+		}
+	}
+	return (result);
+}
+
+// Servers without access_log use the global one; every format name must exist and compile
+bool	Config::resolveAccessLogs()
+{
+	for (size_t i = 0; i < servers.size(); i++)
+	{
+		AccessLogConfig&	log = servers[i].access_log;
+
+		if (log.path.empty())
+			log = global.access_log;
+		if (log.path == "off")
+			continue ;
+
+		std::map<std::string, std::string>::const_iterator	it = global.log_formats.find(log.format_name);
+
+		if (it == global.log_formats.end())
+		{
+			std::cerr << "Error: Unknown log_format '" << log.format_name << "'" << std::endl;
+			return (false);
+		}
+		log.format = it->second;
+
+		LogFormat	compiled;
+		std::string	error;
+
+		if (!compiled.compile(log.format, error))
+		{
+			std::cerr << "Error: log_format '" << log.format_name << "': " << error << std::endl;
+			return (false);
+		}
+	}
+	return (true);
+}
+
 bool	Config::parse(const std::string& filename)
 {
 	std::ifstream	file(filename.c_str());
@@ -85,8 +375,11 @@ bool	Config::parse(const std::string& filename)
 	std::string		line;
 	ServerConfig*	current_server = NULL;
 	LocationConfig*	current_location = NULL;
+	UpstreamConfig*	current_upstream = NULL;
 	bool			in_server = false;
+	bool			in_upstream = false;
 	bool			in_location = false;
+	bool			in_types = false;
 	
 	while (std::getline(file, line))
 	{
@@ -115,15 +408,66 @@ bool	Config::parse(const std::string& filename)
 				current_server = &servers.back();
 				in_server = true;
 			}
+			else if (line.find("types") == 0 && in_server && !in_location)
+				in_types = true;	// types { <mime/type> <ext> [ext...]; }
+			else if (line.find("upstream") == 0 && !in_server)
+			{
+				// upstream <name> {
+				std::vector<std::string>	tokens = split(line.substr(0, line.rfind('{')), ' ');
+
+				if (tokens.size() != 2 || global.upstreams.find(tokens[1]) != global.upstreams.end())
+				{
+					std::cerr << "Error: upstream needs a unique name: '" << line << "'" << std::endl;
+					return (false);
+				}
+				current_upstream = &global.upstreams[tokens[1]];
+				in_upstream = true;
+			}
 			else if (line.find("location") == 0)
 			{
-				std::vector<std::string>	tokens = split(line, ' ');
+				// location [= | ^~ | ~ | ~*] <path> {
+				std::vector<std::string>	tokens = split(line.substr(0, line.rfind('{')), ' ');
 
 				if (tokens.size() >= 2 && current_server)
 				{
-					current_server->locations.push_back(LocationConfig());
+					LocationConfig	loc;
+					size_t			path_idx = 1;
+
+					if (tokens.size() >= 3)
+					{
+						path_idx = 2;
+						if (tokens[1] == "=")
+							loc.match = LOCATION_EXACT;
+						else if (tokens[1] == "^~")
+							loc.match = LOCATION_PREFIX_NO_REGEX;
+						else if (tokens[1] == "~")
+							loc.match = LOCATION_REGEX;
+						else if (tokens[1] == "~*")
+							loc.match = LOCATION_REGEX_ICASE;
+						else
+						{
+							std::cerr << "Error: Invalid location modifier '" << tokens[1] << "'" << std::endl;
+							return (false);
+						}
+					}
+					loc.path = tokens[path_idx];
+					if (loc.match == LOCATION_REGEX || loc.match == LOCATION_REGEX_ICASE)
+					{
+						// Reject bad patterns now rather than failing every request later
+						regex_t	compiled;
+						int		flags = REG_EXTENDED | REG_NOSUB;
+
+						if (loc.match == LOCATION_REGEX_ICASE)
+							flags |= REG_ICASE;
+						if (regcomp(&compiled, loc.path.c_str(), flags) != 0)
+						{
+							std::cerr << "Error: Invalid location regex '" << loc.path << "'" << std::endl;
+							return (false);
+						}
+						regfree(&compiled);
+					}
+					current_server->locations.push_back(loc);
 					current_location = &current_server->locations.back();
-					current_location->path = tokens[1];
 					in_location = true;
 				}
 			}
@@ -131,7 +475,14 @@ bool	Config::parse(const std::string& filename)
 		}
 		if (line.find('}') != std::string::npos)
 		{
-			if (in_location)
+			if (in_upstream)
+			{
+				in_upstream = false;
+				current_upstream = NULL;
+			}
+			else if (in_types)
+				in_types = false;
+			else if (in_location)
 			{
 				in_location = false;
 				current_location = NULL;
@@ -152,13 +503,166 @@ bool	Config::parse(const std::string& filename)
 		
 		std::string	directive = tokens[0];
 		
+		// Entries of a types {} block: the first token is the MIME type
+		if (in_types && current_server)
+		{
+			for (size_t i = 1; i < tokens.size(); i++)
+			{
+				std::string	extension = tokens[i];
+
+				for (size_t c = 0; c < extension.length(); c++)
+					extension[c] = std::tolower(extension[c]);
+				current_server->types[extension] = directive;
+			}
+			continue ;
+		}
+
+		// Entries of an upstream {} block
+		if (in_upstream && current_upstream)
+		{
+			if (directive == "server" && tokens.size() >= 2)
+			{
+				if (!parseUpstreamServer(tokens, *current_upstream))
+					return (false);
+			}
+			else if (directive == "least_conn")
+				current_upstream->least_conn = true;
+			else if (directive == "keepalive" && tokens.size() >= 2 && isNumber(tokens[1]))
+				current_upstream->keepalive = std::atoi(tokens[1].c_str());
+			else
+				std::cerr << "Warning: Ignoring directive '" << directive << "' in upstream block" << std::endl;
+			continue ;
+		}
+
+		// Global directives (outside any server block)
+		if (!in_server)
+		{
+			if (directive == "disk_io_threads" && tokens.size() >= 2 && isNumber(tokens[1]))
+				global.disk_io_threads = std::atoi(tokens[1].c_str());
+			else if (directive == "slow_loop_threshold" && tokens.size() >= 2 && parseMilliseconds(tokens[1]) >= 0)
+				global.slow_loop_threshold = parseMilliseconds(tokens[1]);
+			else if (directive == "buffer_budget" && tokens.size() >= 2)
+				global.buffer_budget = parseSize(tokens[1]);
+			else if (directive == "log_format" && tokens.size() >= 3)
+			{
+				// log_format <name> '<format>' ['<more format>' ...] (on one line, like every directive)
+				size_t	name_end = line.find(tokens[1], directive.length()) + tokens[1].length();
+
+				global.log_formats[tokens[1]] = unquote(line.substr(name_end));
+			}
+			else if (directive == "access_log" && tokens.size() >= 2)
+			{
+				if (!parseAccessLog(tokens, global.access_log))
+					return (false);
+			}
+			else
+				std::cerr << "Warning: Ignoring directive '" << directive << "' outside server block" << std::endl;
+			continue ;
+		}
+
 		// Server-level directives
 		if (in_server && !in_location && current_server)
 		{
 			if (directive == "listen" && tokens.size() >= 2)
-				current_server->port = std::atoi(tokens[1].c_str());
+			{
+				// listen <address> [default_server] [deferred[=secs]] [fastopen=N]
+				if (!parseListen(tokens[1], *current_server))
+				{
+					std::cerr << "Error: Invalid listen address '" << tokens[1] << "'" << std::endl;
+					return (false);
+				}
+				for (size_t i = 2; i < tokens.size(); i++)
+				{
+					if (tokens[i] == "default_server")
+						current_server->default_server = true;
+					else if (tokens[i] == "deferred")
+						current_server->defer_accept = 1;
+					else if (tokens[i].find("deferred=") == 0)
+						current_server->defer_accept = std::atoi(tokens[i].c_str() + 9);
+					else if (tokens[i].find("fastopen=") == 0)
+						current_server->fastopen = std::atoi(tokens[i].c_str() + 9);
+					else
+						std::cerr << "Warning: Unknown listen option '" << tokens[i] << "'" << std::endl;
+				}
+			}
+			else if (directive == "tcp_nodelay" && tokens.size() >= 2)
+				current_server->tcp_nodelay = (tokens[1] == "on");
+			else if (directive == "tcp_nopush" && tokens.size() >= 2)
+				current_server->tcp_nopush = (tokens[1] == "on");
+			else if (directive == "gzip" && tokens.size() >= 2)
+			{
+				current_server->gzip = (tokens[1] == "on");
+#ifndef WEBSERV_HAVE_ZLIB
+				if (current_server->gzip)
+					std::cerr << "Warning: gzip on ignored, built without zlib (gzip_static still works)" << std::endl;
+#endif
+			}
+			else if (directive == "gzip_static" && tokens.size() >= 2)
+				current_server->gzip_static = (tokens[1] == "on");
+			else if (directive == "gzip_min_length" && tokens.size() >= 2)
+				current_server->gzip_min_length = parseSize(tokens[1]);
+			else if (directive == "gzip_cache_size" && tokens.size() >= 2)
+				current_server->gzip_cache_size = parseSize(tokens[1]);
+			else if (directive == "mime_types" && tokens.size() >= 2)
+			{
+				std::ifstream	mime_file(tokens[1].c_str());
+
+				if (!mime_file.is_open())
+				{
+					std::cerr << "Error: Cannot open mime_types file: " << tokens[1] << std::endl;
+					return (false);
+				}
+				current_server->mime_types_file = tokens[1];
+			}
+			else if (directive == "default_type" && tokens.size() >= 2)
+				current_server->default_type = tokens[1];
+			else if (directive == "open_file_cache" && tokens.size() >= 2)
+			{
+				// open_file_cache off | max=N [inactive=time]
+				current_server->open_file_cache_max = 0;
+				for (size_t i = 1; i < tokens.size(); i++)
+				{
+					if (tokens[i] == "off")
+						current_server->open_file_cache_max = 0;
+					else if (tokens[i].find("max=") == 0 && isNumber(tokens[i].substr(4)))
+						current_server->open_file_cache_max = std::atoi(tokens[i].c_str() + 4);
+					else if (tokens[i].find("inactive=") == 0 && parseTime(tokens[i].substr(9)) > 0)
+						current_server->open_file_cache_inactive = parseTime(tokens[i].substr(9));
+					else
+					{
+						std::cerr << "Error: Invalid open_file_cache parameter '" << tokens[i] << "'" << std::endl;
+						return (false);
+					}
+				}
+			}
+			else if (directive == "open_file_cache_valid" && tokens.size() >= 2)
+			{
+				current_server->open_file_cache_valid = parseTime(tokens[1]);
+				if (current_server->open_file_cache_valid < 0)
+				{
+					std::cerr << "Error: Invalid open_file_cache_valid '" << tokens[1] << "'" << std::endl;
+					return (false);
+				}
+			}
+			else if (directive == "open_file_cache_errors" && tokens.size() >= 2)
+				current_server->open_file_cache_errors = (tokens[1] == "on");
+			else if (directive == "access_log" && tokens.size() >= 2)
+			{
+				if (!parseAccessLog(tokens, current_server->access_log))
+					return (false);
+			}
 			else if (directive == "server_name" && tokens.size() >= 2)
-				current_server->server_name = tokens[1];
+			{
+				// server_name example.com www.example.com *.example.org (host names are case-insensitive)
+				for (size_t i = 1; i < tokens.size(); i++)
+				{
+					std::string	name = tokens[i];
+
+					for (size_t c = 0; c < name.length(); c++)
+						name[c] = std::tolower(name[c]);
+					current_server->server_names.push_back(name);
+				}
+			}
 			else if (directive == "root" && tokens.size() >= 2)
 				current_server->root = tokens[1];
 			else if (directive == "index" && tokens.size() >= 2)
@@ -196,8 +700,17 @@ bool	Config::parse(const std::string& filename)
 				current_location->index = tokens[1];
 			else if (directive == "autoindex" && tokens.size() >= 2)
 				current_location->autoindex = (tokens[1] == "on");
+			else if (directive == "default_type" && tokens.size() >= 2)
+				current_location->default_type = tokens[1];
+			else if (directive == "metrics" && tokens.size() >= 2)
+				current_location->metrics = (tokens[1] == "on");
 			else if (directive == "upload_store" && tokens.size() >= 2)
 				current_location->upload_store = tokens[1];
+			else if (directive == "proxy_pass" && tokens.size() >= 2)
+			{
+				if (!parseProxyPass(tokens[1], *current_location))
+					return (false);
+			}
 			else if (directive == "cgi" && tokens.size() >= 3)
 				current_location->cgi_handlers[tokens[1]] = tokens[2];	// cgi .py /usr/bin/python3
 			else if (directive == "client_max_body_size" && tokens.size() >= 2)
@@ -220,22 +733,48 @@ bool	Config::parse(const std::string& filename)
 	// Validate that there are no duplicate port+server_name combinations
 	if (!validatePorts())
 		return (false);
+	if (!resolveAccessLogs())
+		return (false);
+	if (!resolveUpstreams())
+		return (false);
 	return (true);
 }
 
 bool	Config::validatePorts() const
 {
-	// Check for duplicate port + server_name combinations
+	// Check for duplicate listen address + server_name combinations
 	for (size_t i = 0; i < servers.size(); i++)
 	{
 		for (size_t j = i + 1; j < servers.size(); j++)
 		{
-			if (servers[i].port == servers[j].port && servers[i].server_name == servers[j].server_name)
+			if (servers[i].listenAddress() != servers[j].listenAddress())
+				continue ;
+			if (servers[i].default_server && servers[j].default_server)
 			{
-				std::cerr << "Error: Duplicate server configuration detected" << std::endl;
-				std::cerr << "  Port " << servers[i].port << " with server_name '" << servers[i].server_name << "' is defined multiple times" << std::endl;
+				std::cerr << "Error: Duplicate default_server for " << servers[i].listenAddress() << std::endl;
 				return (false);
 			}
+
+			// A block without server_name behaves like server_name ""
+			std::vector<std::string>	names_i = servers[i].server_names;
+			std::vector<std::string>	names_j = servers[j].server_names;
+
+			if (names_i.empty())
+				names_i.push_back("");
+			if (names_j.empty())
+				names_j.push_back("");
+			for (size_t a = 0; a < names_i.size(); a++)
+			{
+				for (size_t b = 0; b < names_j.size(); b++)
+				{
+					if (names_i[a] == names_j[b])
+					{
+						std::cerr << "Error: Duplicate server configuration detected" << std::endl;
+						std::cerr << "  Listen " << servers[i].listenAddress() << " with server_name '" << names_i[a] << "' is defined multiple times" << std::endl;
+						return (false);
+					}
+				}
+			}
 		}
 	}
 	return (true);
@@ -257,7 +796,11 @@ void	Config::print() const
 		const ServerConfig&	srv = servers[i];
 		
 		std::cout << "┌─ Server #" << (i + 1) << " ─────────────────────────────" << std::endl;
-		std::cout << "│  Listen:    " << srv.server_name << ":" << srv.port << std::endl;
+		std::cout << "│  Listen:    " << srv.listenAddress() << std::endl;
+		std::cout << "│  Name:      ";
+		for (size_t n = 0; n < srv.server_names.size(); n++)
+			std::cout << (n ? " " : "") << srv.server_names[n];
+		std::cout << (srv.default_server ? " (default)" : "") << std::endl;
 		std::cout << "│  Root:      " << srv.root << std::endl;
 		std::cout << "│  Index:     " << srv.index << std::endl;
 		
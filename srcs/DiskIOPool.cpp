@@ -0,0 +1,231 @@
+#include "DiskIOPool.hpp"
+#include <iostream>
+#include <sstream>
+#include <csignal>
+#include <cerrno>
+#include <cstdio>
+#include <unistd.h>
+#include <fcntl.h>
+#include <sys/stat.h>
+#include <sys/time.h>
+
+DiskIOPool::DiskIOPool() : stopping(false)
+{
+	notify_pipe[0] = -1;
+	notify_pipe[1] = -1;
+	pthread_mutex_init(&mutex, NULL);
+	pthread_cond_init(&cond, NULL);
+}
+
+DiskIOPool::~DiskIOPool()
+{
+	stop();
+	pthread_cond_destroy(&cond);
+	pthread_mutex_destroy(&mutex);
+}
+
+bool	DiskIOPool::start(size_t count)
+{
+	if (count == 0)
+		return (true);
+	if (pipe(notify_pipe) < 0)
+		return (false);
+	for (int i = 0; i < 2; i++)
+	{
+		fcntl(notify_pipe[i], F_SETFL, O_NONBLOCK);
+		fcntl(notify_pipe[i], F_SETFD, FD_CLOEXEC);
+	}
+
+	// Signals (SIGINT, SIGHUP) must be handled by the event loop thread only
+	sigset_t	all;
+	sigset_t	previous;
+
+	sigfillset(&all);
+	pthread_sigmask(SIG_BLOCK, &all, &previous);
+	for (size_t i = 0; i < count; i++)
+	{
+		pthread_t	thread;
+
+		if (pthread_create(&thread, NULL, worker, this) != 0)
+		{
+			std::cerr << "Warning: started only " << i << " of " << count << " disk I/O threads" << std::endl;
+			break ;
+		}
+		threads.push_back(thread);
+	}
+	pthread_sigmask(SIG_SETMASK, &previous, NULL);
+	return (!threads.empty());
+}
+
+// Let workers finish the queue, then join them
+void	DiskIOPool::stop()
+{
+	pthread_mutex_lock(&mutex);
+	stopping = true;
+	pthread_cond_broadcast(&cond);
+	pthread_mutex_unlock(&mutex);
+	for (size_t i = 0; i < threads.size(); i++)
+		pthread_join(threads[i], NULL);
+	threads.clear();
+	for (size_t i = 0; i < done.size(); i++)
+		delete done[i];
+	done.clear();
+	for (int i = 0; i < 2; i++)
+	{
+		if (notify_pipe[i] >= 0)
+			close(notify_pipe[i]);
+		notify_pipe[i] = -1;
+	}
+	stopping = false;
+}
+
+void*	DiskIOPool::worker(void* arg)
+{
+	DiskIOPool*	pool = static_cast<DiskIOPool*>(arg);
+
+	pthread_mutex_lock(&pool->mutex);
+	while (true)
+	{
+		while (pool->pending.empty() && !pool->stopping)
+			pthread_cond_wait(&pool->cond, &pool->mutex);
+		if (pool->pending.empty())
+			break ;
+
+		DiskJob*	job = pool->pending.front();
+
+		pool->pending.pop_front();
+		pthread_mutex_unlock(&pool->mutex);
+		execute(*job);
+		pthread_mutex_lock(&pool->mutex);
+		pool->done.push_back(job);
+
+		// A full pipe already guarantees a wakeup
+		char	byte = 1;
+		ssize_t	written = write(pool->notify_pipe[1], &byte, 1);
+
+		(void)written;
+	}
+	pthread_mutex_unlock(&pool->mutex);
+	return (NULL);
+}
+
+void	DiskIOPool::submit(DiskJob* job)
+{
+	pthread_mutex_lock(&mutex);
+	pending.push_back(job);
+	pthread_cond_signal(&cond);
+	pthread_mutex_unlock(&mutex);
+}
+
+// Called on POLLIN of the notify pipe: ONE read, then take every finished job
+void	DiskIOPool::collect(std::vector<DiskJob*>& jobs)
+{
+	char	buffer[256];
+	ssize_t	bytes_read = read(notify_pipe[0], buffer, sizeof(buffer));
+
+	(void)bytes_read;
+	pthread_mutex_lock(&mutex);
+	jobs.insert(jobs.end(), done.begin(), done.end());
+	done.clear();
+	pthread_mutex_unlock(&mutex);
+}
+
+// Write all of content to fd (a regular file: may block, which is why this runs on a worker)
+static bool	writeAll(int fd, const std::string& content)
+{
+	size_t	offset = 0;
+
+	while (offset < content.length())
+	{
+		ssize_t	written = write(fd, content.data() + offset, content.length() - offset);
+
+		if (written < 0 && errno == EINTR)
+			continue ;
+		if (written <= 0)
+			return (false);
+		offset += written;
+	}
+	return (true);
+}
+
+// "name.ext" -> "name_<sec>_<usec>_<pid>_<counter>.ext", the same token as
+// Server::generateFilename(); the counter is shared by all workers
+static std::string	uniqueName(const std::string& name)
+{
+	static pthread_mutex_t	counter_mutex = PTHREAD_MUTEX_INITIALIZER;
+	static unsigned long	counter = 0;
+	struct timeval			now;
+	std::ostringstream		token;
+	size_t					dot_pos = name.find_last_of('.');
+
+	gettimeofday(&now, NULL);
+	pthread_mutex_lock(&counter_mutex);
+	token << "_" << now.tv_sec << "_" << now.tv_usec << "_" << getpid() << "_" << counter++;
+	pthread_mutex_unlock(&counter_mutex);
+	if (dot_pos != std::string::npos)
+		return (name.substr(0, dot_pos) + token.str() + name.substr(dot_pos));
+	return (name + token.str());
+}
+
+// Create a file that did not exist before (O_EXCL: atomic, no check-then-create race).
+// With unique set an existing name gets a unique suffix (one retry, no probing), else it is replaced.
+static int	createUploadFile(const std::string& directory, const std::string& name, bool unique, std::string& saved)
+{
+	std::string	path = directory + "/" + name;
+	int			flags = O_WRONLY | O_CREAT | O_CLOEXEC;
+
+	saved = name;
+	if (!unique)
+		return (open(path.c_str(), flags | O_TRUNC, 0644));
+
+	int	fd = open(path.c_str(), flags | O_EXCL, 0644);
+
+	if (fd >= 0 || errno != EEXIST)
+		return (fd);
+	saved = uniqueName(name);
+	return (open((directory + "/" + saved).c_str(), flags | O_EXCL, 0644));
+}
+
+void	DiskIOPool::execute(DiskJob& job)
+{
+	struct stat	st;
+
+	if (job.operation == DISK_DELETE)
+	{
+		if (stat(job.path.c_str(), &st) != 0)
+			job.status = 404;
+		else if (S_ISDIR(st.st_mode))
+			job.status = 403;	// Don't allow deleting directories (for safety)
+		else if (std::remove(job.path.c_str()) != 0)
+			job.status = 500;
+		return ;
+	}
+
+	// Create upload directory if it doesn't exist
+	mkdir(job.directory.c_str(), 0755);
+	for (size_t i = 0; i < job.files.size(); i++)
+	{
+		DiskFile&	file = job.files[i];
+		int			fd = createUploadFile(job.directory, file.name, job.unique_names, file.saved);
+
+		if (fd < 0)
+		{
+			job.status = 500;
+			return ;
+		}
+
+		bool	written = writeAll(fd, file.data);
+
+		if (close(fd) != 0)
+			written = false;
+		if (!written)
+		{
+			// Don't leave a truncated upload behind
+			unlink((job.directory + "/" + file.saved).c_str());
+			job.status = 500;
+			return ;
+		}
+		// The data is no longer needed once it is on disk
+		std::string().swap(file.data);
+	}
+}
@@ -0,0 +1,91 @@
+#include "GzipCache.hpp"
+#ifdef WEBSERV_HAVE_ZLIB
+# include <zlib.h>
+#endif
+
+GzipCache::GzipCache() : max_bytes(GZIP_CACHE_SIZE), used_bytes(0) {}
+
+void	GzipCache::evict(std::map<std::string, Entry>::iterator it)
+{
+	used_bytes -= it->second.data.size();
+	lru.erase(it->second.lru);
+	entries.erase(it);
+}
+
+// Cached compressed body for the file, or NULL if missing or stale
+const std::string*	GzipCache::find(const std::string& path, const struct stat& st)
+{
+	std::map<std::string, Entry>::iterator	it = entries.find(path);
+
+	if (it == entries.end())
+		return (NULL);
+	if (it->second.mtime != st.st_mtime || it->second.size != st.st_size)
+	{
+		evict(it);
+		return (NULL);
+	}
+	lru.splice(lru.begin(), lru, it->second.lru);
+	return (&it->second.data);
+}
+
+void	GzipCache::insert(const std::string& path, const struct stat& st, const std::string& data)
+{
+	if (data.size() > max_bytes)
+		return ;
+
+	std::map<std::string, Entry>::iterator	it = entries.find(path);
+
+	if (it != entries.end())
+		evict(it);
+	// Drop least recently used entries until the new one fits
+	while (!lru.empty() && used_bytes + data.size() > max_bytes)
+		evict(entries.find(lru.back()));
+
+	Entry&	entry = entries[path];
+
+	entry.mtime = st.st_mtime;
+	entry.size = st.st_size;
+	entry.data = data;
+	lru.push_front(path);
+	entry.lru = lru.begin();
+	used_bytes += data.size();
+}
+
+bool	GzipCache::available()
+{
+#ifdef WEBSERV_HAVE_ZLIB
+	return (true);
+#else
+	return (false);
+#endif
+}
+
+// Compress into a complete gzip member (RFC 1952)
+bool	GzipCache::compress(const std::string& input, std::string& output)
+{
+#ifdef WEBSERV_HAVE_ZLIB
+	z_stream	stream;
+
+	stream.zalloc = Z_NULL;
+	stream.zfree = Z_NULL;
+	stream.opaque = Z_NULL;
+	// windowBits 15 + 16 selects the gzip wrapper instead of raw zlib
+	if (deflateInit2(&stream, 6, Z_DEFLATED, 15 + 16, 8, Z_DEFAULT_STRATEGY) != Z_OK)
+		return (false);
+	output.resize(deflateBound(&stream, input.size()) + 32);
+	stream.next_in = reinterpret_cast<Bytef*>(const_cast<char*>(input.data()));
+	stream.avail_in = input.size();
+	stream.next_out = reinterpret_cast<Bytef*>(&output[0]);
+	stream.avail_out = output.size();
+
+	int	status = deflate(&stream, Z_FINISH);
+
+	output.resize(stream.total_out);
+	deflateEnd(&stream);
+	return (status == Z_STREAM_END);
+#else
+	(void)input;
+	(void)output;
+	return (false);
+#endif
+}
@@ -0,0 +1,113 @@
+#include "LocationRouter.hpp"
+
+LocationRouter::LocationRouter() : locations(NULL), trie(NULL) {}
+
+LocationRouter::~LocationRouter()
+{
+	clear();
+}
+
+void	LocationRouter::freeNode(TrieNode* node)
+{
+	if (!node)
+		return ;
+	for (std::map<char, TrieNode*>::iterator it = node->children.begin(); it != node->children.end(); ++it)
+		freeNode(it->second);
+	delete node;
+}
+
+void	LocationRouter::clear()
+{
+	freeNode(trie);
+	trie = NULL;
+	exact.clear();
+	for (size_t i = 0; i < regexes.size(); i++)
+		regfree(&regexes[i].compiled);
+	regexes.clear();
+	locations = NULL;
+}
+
+void	LocationRouter::insertPrefix(const std::string& prefix, int index)
+{
+	TrieNode*	node = trie;
+
+	for (size_t i = 0; i < prefix.length(); i++)
+	{
+		std::map<char, TrieNode*>::iterator	it = node->children.find(prefix[i]);
+
+		if (it == node->children.end())
+			it = node->children.insert(std::make_pair(prefix[i], new TrieNode())).first;
+		node = it->second;
+	}
+	// First definition of a prefix wins
+	if (node->location == -1)
+		node->location = index;
+}
+
+// Build the lookup structures; locs must outlive the router (it is the owning server's config)
+void	LocationRouter::compile(const std::vector<LocationConfig>& locs)
+{
+	clear();
+	locations = &locs;
+	trie = new TrieNode();
+	for (size_t i = 0; i < locs.size(); i++)
+	{
+		const LocationConfig&	loc = locs[i];
+
+		if (loc.match == LOCATION_EXACT)
+			exact.insert(std::make_pair(loc.path, static_cast<int>(i)));
+		else if (loc.match == LOCATION_REGEX || loc.match == LOCATION_REGEX_ICASE)
+		{
+			RegexLocation	re;
+			int				flags = REG_EXTENDED | REG_NOSUB;
+
+			if (loc.match == LOCATION_REGEX_ICASE)
+				flags |= REG_ICASE;
+			// Patterns were validated by Config::parse
+			if (regcomp(&re.compiled, loc.path.c_str(), flags) != 0)
+				continue ;
+			re.location = i;
+			regexes.push_back(re);
+		}
+		else
+			insertPrefix(loc.path, i);
+	}
+}
+
+// path must not contain the query string
+const LocationConfig*	LocationRouter::match(const std::string& path) const
+{
+	if (!locations)
+		return (NULL);
+
+	std::map<std::string, int>::const_iterator	exact_it = exact.find(path);
+
+	if (exact_it != exact.end())
+		return (&(*locations)[exact_it->second]);
+
+	// Walk the trie once, remembering the deepest node that ends a location
+	int			longest = trie->location;
+	TrieNode*	node = trie;
+
+	for (size_t i = 0; i < path.length(); i++)
+	{
+		std::map<char, TrieNode*>::const_iterator	it = node->children.find(path[i]);
+
+		if (it == node->children.end())
+			break ;
+		node = it->second;
+		if (node->location != -1)
+			longest = node->location;
+	}
+	if (longest != -1 && (*locations)[longest].match == LOCATION_PREFIX_NO_REGEX)
+		return (&(*locations)[longest]);
+
+	for (size_t i = 0; i < regexes.size(); i++)
+	{
+		if (regexec(&regexes[i].compiled, path.c_str(), 0, NULL, 0) == 0)
+			return (&(*locations)[regexes[i].location]);
+	}
+	if (longest != -1)
+		return (&(*locations)[longest]);
+	return (NULL);
+}
@@ -0,0 +1,35 @@
+#include "MappedFile.hpp"
+#include <sys/mman.h>
+
+MappedFile::MappedFile(void* a, const struct stat& st)
+	: addr(a), length(st.st_size), ino(st.st_ino), size(st.st_size), mtime(st.st_mtime), refs(1) {}
+
+MappedFile::~MappedFile()
+{
+	munmap(addr, length);
+}
+
+// Map a regular file; returns NULL on failure (the caller falls back to read())
+MappedFile*	MappedFile::map(int fd, const struct stat& st)
+{
+	if (fd < 0 || st.st_size <= 0)
+		return (NULL);
+
+	void*	addr = mmap(NULL, st.st_size, PROT_READ, MAP_SHARED, fd, 0);
+
+	if (addr == MAP_FAILED)
+		return (NULL);
+	return (new MappedFile(addr, st));
+}
+
+void	MappedFile::release()
+{
+	if (--refs == 0)
+		delete this;
+}
+
+// Still the same file contents as when it was mapped
+bool	MappedFile::matches(const struct stat& st) const
+{
+	return (st.st_ino == ino && st.st_size == size && st.st_mtime == mtime);
+}
@@ -0,0 +1,424 @@
+#include "Metrics.hpp"
+#include <sstream>
+#include <cstdio>
+
+// --- LatencyHistogram ---
+
+LatencyHistogram::LatencyHistogram() : counts(LATENCY_BUCKETS, 0), total(0), sum(0) {}
+
+// Values below 2 * LATENCY_SUB_BUCKETS have a bucket each; above that the bucket
+// is picked by the top LATENCY_SUB_BITS + 1 bits of the value
+size_t	LatencyHistogram::bucketIndex(unsigned long long value)
+{
+	if (value >= (1ULL << LATENCY_MAX_BITS))
+		value = (1ULL << LATENCY_MAX_BITS) - 1;
+	if (value < 2 * LATENCY_SUB_BUCKETS)
+		return (value);
+
+	int	msb = 0;
+
+	while ((value >> (msb + 1)) != 0)
+		msb++;
+
+	int	shift = msb - LATENCY_SUB_BITS;
+
+	return (shift * LATENCY_SUB_BUCKETS + (value >> shift));
+}
+
+// Largest value that falls in a bucket
+unsigned long long	LatencyHistogram::bucketHighest(size_t index)
+{
+	if (index < 2 * LATENCY_SUB_BUCKETS)
+		return (index);
+
+	int					shift = index / LATENCY_SUB_BUCKETS - 1;
+	unsigned long long	mantissa = index - shift * LATENCY_SUB_BUCKETS;
+
+	return (((mantissa + 1) << shift) - 1);
+}
+
+void	LatencyHistogram::record(unsigned long long microseconds)
+{
+	counts[bucketIndex(microseconds)]++;
+	total++;
+	sum += microseconds;
+}
+
+// Values below 2^power_of_two us; exact because powers of two start a bucket
+unsigned long	LatencyHistogram::countBelow(int power_of_two) const
+{
+	size_t			end = bucketIndex(1ULL << power_of_two);
+	unsigned long	count = 0;
+
+	for (size_t i = 0; i < end && i < counts.size(); i++)
+		count += counts[i];
+	return (count);
+}
+
+// Value at or below which `fraction` of the recorded values fall (upper edge of its bucket)
+unsigned long long	LatencyHistogram::percentile(double fraction) const
+{
+	unsigned long	rank = static_cast<unsigned long>(fraction * total + 0.5);
+	unsigned long	seen = 0;
+
+	if (rank == 0)
+		rank = 1;
+	for (size_t i = 0; i < counts.size(); i++)
+	{
+		seen += counts[i];
+		if (seen >= rank)
+			return (bucketHighest(i));
+	}
+	return (0);
+}
+
+// --- ConnectionMemory ---
+
+size_t	ConnectionMemory::total() const
+{
+	size_t	sum = 0;
+
+	for (int i = 0; i < MEMORY_BUFFER_COUNT; i++)
+		sum += bytes[i];
+	return (sum);
+}
+
+const char*	ConnectionMemory::bufferName(MemoryBuffer buffer)
+{
+	static const char*	names[MEMORY_BUFFER_COUNT] = {
+		"request_raw", "request_body", "multipart", "response", "cgi_input", "cgi_output", "upstream"
+	};
+
+	return (names[buffer]);
+}
+
+// --- Metrics ---
+
+Metrics::Metrics() : started(time(NULL)), connections_accepted(0), bytes_received(0), bytes_sent(0),
+	cgi_spawned(0), cgi_spawn_failures(0), cgi_timeouts(0), cgi_failures(0), memory_total(0), memory_total_peak(0),
+	connection_memory_peak(0), buffer_budget(0), reads_paused(false), read_pauses(0)
+{
+	for (int i = 0; i < MEMORY_BUFFER_COUNT; i++)
+	{
+		memory[i] = 0;
+		memory_peak[i] = 0;
+	}
+}
+
+void	Metrics::upstreamRequest(const std::string& upstream, const std::string& peer, bool reused)
+{
+	if (reused)
+		upstream_reuses[std::make_pair(upstream, peer)]++;
+	else
+		upstream_connects[std::make_pair(upstream, peer)]++;
+}
+
+// A connection's buffers were measured again: `before` is what was last accounted for it
+void	Metrics::memoryChanged(const ConnectionMemory& before, const ConnectionMemory& after)
+{
+	for (int i = 0; i < MEMORY_BUFFER_COUNT; i++)
+	{
+		memory[i] = memory[i] - before.bytes[i] + after.bytes[i];
+		if (memory[i] > memory_peak[i])
+			memory_peak[i] = memory[i];
+	}
+	memory_total = memory_total - before.total() + after.total();
+	if (memory_total > memory_total_peak)
+		memory_total_peak = memory_total;
+	if (after.total() > connection_memory_peak)
+		connection_memory_peak = after.total();
+}
+
+void	Metrics::requestDone(const std::string& server, const std::string& location, int status,
+			size_t sent, const RequestTimeline& timeline)
+{
+	requests[server][status]++;
+	bytes_sent += sent;
+
+	long long	total = timeline.span(PHASE_FIRST_BYTE, PHASE_LAST_WRITE);
+
+	if (total >= 0)
+		latency[std::make_pair(server, location)].record(total);
+	// phase_spans[0] is the whole request, already recorded above
+	for (size_t i = 1; phase_spans[i].name; i++)
+	{
+		long long	duration = timeline.span(phase_spans[i].from, phase_spans[i].to);
+
+		if (duration >= 0)
+			phases[phase_spans[i].name].record(duration);
+	}
+}
+
+// Label values are quoted: escape backslash, quote and newline
+static std::string	label(const std::string& value)
+{
+	std::string	escaped;
+
+	for (size_t i = 0; i < value.length(); i++)
+	{
+		if (value[i] == '\\' || value[i] == '"')
+			escaped += '\\';
+		if (value[i] == '\n')
+			escaped += "\\n";
+		else
+			escaped += value[i];
+	}
+	return ("\"" + escaped + "\"");
+}
+
+static std::string	seconds(unsigned long long microseconds)
+{
+	char	text[32];
+
+	snprintf(text, sizeof(text), "%.6f", microseconds / 1000000.0);
+	return (text);
+}
+
+static void	header(std::ostream& out, const char* name, const char* type, const char* help)
+{
+	out << "# HELP " << name << " " << help << "\n# TYPE " << name << " " << type << "\n";
+}
+
+// Prometheus text exposition format 0.0.4
+std::string	Metrics::render(const ConnectionCounts& connections, const LoopProfiler& loop) const
+{
+	std::ostringstream	out;
+
+	header(out, "webserv_uptime_seconds", "gauge", "Seconds since the server started.");
+	out << "webserv_uptime_seconds " << (time(NULL) - started) << "\n";
+
+	header(out, "webserv_connections", "gauge", "Open client connections by state.");
+	out << "webserv_connections{state=\"reading\"} " << connections.reading << "\n";
+	out << "webserv_connections{state=\"writing\"} " << connections.writing << "\n";
+	out << "webserv_connections{state=\"idle\"} " << connections.idle << "\n";
+
+	header(out, "webserv_connection_memory_bytes", "gauge", "Bytes held by connection buffers, by buffer.");
+	for (int i = 0; i < MEMORY_BUFFER_COUNT; i++)
+		out << "webserv_connection_memory_bytes{buffer=\"" << ConnectionMemory::bufferName(static_cast<MemoryBuffer>(i)) << "\"} " << memory[i] << "\n";
+	header(out, "webserv_connection_memory_peak_bytes", "gauge", "High-water mark of each connection buffer kind since startup.");
+	for (int i = 0; i < MEMORY_BUFFER_COUNT; i++)
+		out << "webserv_connection_memory_peak_bytes{buffer=\"" << ConnectionMemory::bufferName(static_cast<MemoryBuffer>(i)) << "\"} " << memory_peak[i] << "\n";
+	header(out, "webserv_connection_memory_total_peak_bytes", "gauge", "High-water mark of all connection buffers together.");
+	out << "webserv_connection_memory_total_peak_bytes " << memory_total_peak << "\n";
+	header(out, "webserv_connection_memory_max_bytes", "gauge", "Most memory held by a single connection since startup.");
+	out << "webserv_connection_memory_max_bytes " << connection_memory_peak << "\n";
+
+	header(out, "webserv_buffer_budget_bytes", "gauge", "Connection buffer bytes allowed before reads pause (0 = unlimited).");
+	out << "webserv_buffer_budget_bytes " << buffer_budget << "\n";
+	header(out, "webserv_reads_paused", "gauge", "1 while connection buffers are over budget and reads are paused.");
+	out << "webserv_reads_paused " << (reads_paused ? 1 : 0) << "\n";
+	header(out, "webserv_read_pauses_total", "counter", "Times reads were paused for the buffer budget.");
+	out << "webserv_read_pauses_total " << read_pauses << "\n";
+
+	header(out, "webserv_connections_accepted_total", "counter", "Client connections accepted.");
+	out << "webserv_connections_accepted_total " << connections_accepted << "\n";
+
+	header(out, "webserv_requests_total", "counter", "Requests answered, by virtual host and status.");
+	for (std::map<std::string, std::map<int, unsigned long> >::const_iterator it = requests.begin(); it != requests.end(); ++it)
+	{
+		for (std::map<int, unsigned long>::const_iterator st = it->second.begin(); st != it->second.end(); ++st)
+			out << "webserv_requests_total{server=" << label(it->first) << ",status=\"" << st->first << "\"} " << st->second << "\n";
+	}
+
+	header(out, "webserv_received_bytes_total", "counter", "Bytes read from clients.");
+	out << "webserv_received_bytes_total " << bytes_received << "\n";
+	header(out, "webserv_sent_bytes_total", "counter", "Bytes written to clients.");
+	out << "webserv_sent_bytes_total " << bytes_sent << "\n";
+
+	header(out, "webserv_cgi_processes", "gauge", "CGI processes running.");
+	out << "webserv_cgi_processes " << connections.cgi << "\n";
+	header(out, "webserv_cgi_spawned_total", "counter", "CGI processes started.");
+	out << "webserv_cgi_spawned_total " << cgi_spawned << "\n";
+	header(out, "webserv_cgi_spawn_failures_total", "counter", "CGI scripts that could not be started.");
+	out << "webserv_cgi_spawn_failures_total " << cgi_spawn_failures << "\n";
+	header(out, "webserv_cgi_timeouts_total", "counter", "CGI processes killed for running too long.");
+	out << "webserv_cgi_timeouts_total " << cgi_timeouts << "\n";
+	header(out, "webserv_cgi_failures_total", "counter", "CGI processes that crashed, exited non-zero or sent no valid response.");
+	out << "webserv_cgi_failures_total " << cgi_failures << "\n";
+
+	typedef std::map<std::pair<std::string, std::string>, unsigned long>	PeerCounts;
+
+	header(out, "webserv_upstream_requests_total", "counter", "Requests sent to proxy_pass servers, on new or pooled keep-alive connections.");
+	for (PeerCounts::const_iterator it = upstream_connects.begin(); it != upstream_connects.end(); ++it)
+	{
+		out << "webserv_upstream_requests_total{upstream=" << label(it->first.first) << ",peer=" << label(it->first.second)
+			<< ",connection=\"new\"} " << it->second << "\n";
+	}
+	for (PeerCounts::const_iterator it = upstream_reuses.begin(); it != upstream_reuses.end(); ++it)
+	{
+		out << "webserv_upstream_requests_total{upstream=" << label(it->first.first) << ",peer=" << label(it->first.second)
+			<< ",connection=\"reused\"} " << it->second << "\n";
+	}
+	header(out, "webserv_upstream_failures_total", "counter", "Connect errors, resets and timeouts talking to proxy_pass servers.");
+	for (PeerCounts::const_iterator it = upstream_failures.begin(); it != upstream_failures.end(); ++it)
+		out << "webserv_upstream_failures_total{upstream=" << label(it->first.first) << ",peer=" << label(it->first.second) << "} " << it->second << "\n";
+
+	header(out, "webserv_request_duration_seconds", "histogram", "Time from the first request byte to the last response byte.");
+	for (std::map<std::pair<std::string, std::string>, LatencyHistogram>::const_iterator it = latency.begin(); it != latency.end(); ++it)
+	{
+		std::string	labels = "server=" + label(it->first.first) + ",location=" + label(it->first.second);
+
+		for (int power = LATENCY_EXPORT_FIRST; power <= LATENCY_EXPORT_LAST; power++)
+		{
+			out << "webserv_request_duration_seconds_bucket{" << labels << ",le=\"" << seconds(1ULL << power) << "\"} "
+				<< it->second.countBelow(power) << "\n";
+		}
+		out << "webserv_request_duration_seconds_bucket{" << labels << ",le=\"+Inf\"} " << it->second.getCount() << "\n";
+		out << "webserv_request_duration_seconds_sum{" << labels << "} " << seconds(it->second.getSum()) << "\n";
+		out << "webserv_request_duration_seconds_count{" << labels << "} " << it->second.getCount() << "\n";
+	}
+
+	header(out, "webserv_request_phase_seconds", "histogram", "Time spent in each request phase (phases a request skips are not counted).");
+	for (std::map<std::string, LatencyHistogram>::const_iterator it = phases.begin(); it != phases.end(); ++it)
+	{
+		std::string	labels = "phase=" + label(it->first);
+
+		for (int power = LATENCY_EXPORT_FIRST; power <= LATENCY_EXPORT_LAST; power++)
+		{
+			out << "webserv_request_phase_seconds_bucket{" << labels << ",le=\"" << seconds(1ULL << power) << "\"} "
+				<< it->second.countBelow(power) << "\n";
+		}
+		out << "webserv_request_phase_seconds_bucket{" << labels << ",le=\"+Inf\"} " << it->second.getCount() << "\n";
+		out << "webserv_request_phase_seconds_sum{" << labels << "} " << seconds(it->second.getSum()) << "\n";
+		out << "webserv_request_phase_seconds_count{" << labels << "} " << it->second.getCount() << "\n";
+	}
+
+	// Quantiles from the full-resolution buckets (the histogram above only exports powers of two)
+	static const double	quantiles[] = { 0.5, 0.9, 0.99, 0.999 };
+
+	header(out, "webserv_request_duration_quantile_seconds", "gauge", "Request time quantiles since startup (within 6%).");
+	for (std::map<std::pair<std::string, std::string>, LatencyHistogram>::const_iterator it = latency.begin(); it != latency.end(); ++it)
+	{
+		for (size_t q = 0; q < sizeof(quantiles) / sizeof(quantiles[0]); q++)
+		{
+			out << "webserv_request_duration_quantile_seconds{server=" << label(it->first.first) << ",location=" << label(it->first.second)
+				<< ",quantile=\"" << quantiles[q] << "\"} " << seconds(it->second.percentile(quantiles[q])) << "\n";
+		}
+	}
+
+	loop.render(out);
+	return (out.str());
+}
+
+// --- LoopProfiler ---
+
+LoopProfiler::LoopProfiler() : threshold(0), iteration_start(0), iteration_time(0), ready(0), slowest_handler(LOOP_ACCEPT),
+	slowest_fd(-1), slowest_time(0), iterations(0), slow_iterations(0), ready_total(0), poll_wait_total(0)
+{
+	for (int i = 0; i < LOOP_HANDLER_COUNT; i++)
+	{
+		spent[i] = 0;
+		calls[i] = 0;
+		spent_total[i] = 0;
+		calls_total[i] = 0;
+	}
+}
+
+const char*	LoopProfiler::handlerName(LoopHandler handler)
+{
+	static const char*	names[LOOP_HANDLER_COUNT] = {
+		"accept", "client_read", "client_write", "client_close", "cgi_read", "cgi_write", "cgi_finish",
+		"upstream", "disk", "timeouts", "log_flush"
+	};
+
+	return (names[handler]);
+}
+
+// Called when poll() returns; `poll_started` is the monotonic time poll() was entered
+void	LoopProfiler::beginIteration(unsigned long long poll_started, int ready_fds)
+{
+	iteration_start = monotonicMicros();
+	poll_wait_total += iteration_start - poll_started;
+	ready = ready_fds > 0 ? ready_fds : 0;
+	for (int i = 0; i < LOOP_HANDLER_COUNT; i++)
+	{
+		spent[i] = 0;
+		calls[i] = 0;
+	}
+	slowest_fd = -1;
+	slowest_time = 0;
+}
+
+void	LoopProfiler::stop(LoopHandler handler, int fd, unsigned long long started)
+{
+	unsigned long long	elapsed = monotonicMicros() - started;
+
+	spent[handler] += elapsed;
+	calls[handler]++;
+	if (elapsed >= slowest_time)
+	{
+		slowest_handler = handler;
+		slowest_fd = fd;
+		slowest_time = elapsed;
+	}
+}
+
+// Adds the iteration to the totals; true if it took longer than the threshold
+bool	LoopProfiler::endIteration()
+{
+	iteration_time = monotonicMicros() - iteration_start;
+	iterations++;
+	ready_total += ready;
+	busy.record(iteration_time);
+	for (int i = 0; i < LOOP_HANDLER_COUNT; i++)
+	{
+		spent_total[i] += spent[i];
+		calls_total[i] += calls[i];
+	}
+	if (threshold == 0 || iteration_time < threshold)
+		return (false);
+	slow_iterations++;
+	return (true);
+}
+
+// "slow event loop iteration: 153.204ms, 3 ready fds; client_read=150.981ms/1 accept=0.052ms/1;
+//  slowest: client_read 150.981ms on fd 7"
+std::string	LoopProfiler::trace() const
+{
+	std::ostringstream	out;
+	char				text[64];
+
+	snprintf(text, sizeof(text), "%.3fms", iteration_time / 1000.0);
+	out << "slow event loop iteration: " << text << ", " << ready << " ready fds;";
+	for (int i = 0; i < LOOP_HANDLER_COUNT; i++)
+	{
+		if (calls[i] == 0)
+			continue ;
+		snprintf(text, sizeof(text), "%.3fms", spent[i] / 1000.0);
+		out << " " << handlerName(static_cast<LoopHandler>(i)) << "=" << text << "/" << calls[i];
+	}
+	if (slowest_time > 0)
+	{
+		snprintf(text, sizeof(text), "%.3fms", slowest_time / 1000.0);
+		out << "; slowest: " << handlerName(slowest_handler) << " " << text;
+		if (slowest_fd >= 0)
+			out << " on fd " << slowest_fd;
+	}
+	return (out.str());
+}
+
+void	LoopProfiler::render(std::ostream& out) const
+{
+	header(out, "webserv_loop_iterations_total", "counter", "Event loop iterations.");
+	out << "webserv_loop_iterations_total " << iterations << "\n";
+	header(out, "webserv_loop_slow_iterations_total", "counter", "Event loop iterations longer than slow_loop_threshold.");
+	out << "webserv_loop_slow_iterations_total " << slow_iterations << "\n";
+	header(out, "webserv_loop_ready_fds_total", "counter", "Descriptors reported ready by poll(), summed over iterations.");
+	out << "webserv_loop_ready_fds_total " << ready_total << "\n";
+	header(out, "webserv_loop_poll_wait_seconds_total", "counter", "Time spent waiting in poll().");
+	out << "webserv_loop_poll_wait_seconds_total " << seconds(poll_wait_total) << "\n";
+
+	header(out, "webserv_loop_handler_seconds_total", "counter", "Event loop time spent in each kind of handler.");
+	for (int i = 0; i < LOOP_HANDLER_COUNT; i++)
+		out << "webserv_loop_handler_seconds_total{handler=\"" << handlerName(static_cast<LoopHandler>(i)) << "\"} " << seconds(spent_total[i]) << "\n";
+	header(out, "webserv_loop_handler_calls_total", "counter", "Event loop handler calls by kind.");
+	for (int i = 0; i < LOOP_HANDLER_COUNT; i++)
+		out << "webserv_loop_handler_calls_total{handler=\"" << handlerName(static_cast<LoopHandler>(i)) << "\"} " << calls_total[i] << "\n";
+
+	header(out, "webserv_loop_busy_seconds", "histogram", "Event loop iteration time after poll() returned.");
+	for (int power = LATENCY_EXPORT_FIRST; power <= LATENCY_EXPORT_LAST; power++)
+		out << "webserv_loop_busy_seconds_bucket{le=\"" << seconds(1ULL << power) << "\"} " << busy.countBelow(power) << "\n";
+	out << "webserv_loop_busy_seconds_bucket{le=\"+Inf\"} " << busy.getCount() << "\n";
+	out << "webserv_loop_busy_seconds_sum " << seconds(busy.getSum()) << "\n";
+	out << "webserv_loop_busy_seconds_count " << busy.getCount() << "\n";
+}
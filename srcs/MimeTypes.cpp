@@ -0,0 +1,100 @@
+#include "MimeTypes.hpp"
+#include <fstream>
+#include <sstream>
+#include <cctype>
+
+// Built-in table used when no mime_types file or types {} block overrides it
+static const char*	default_types[][2] = {
+	{"html", "text/html"}, {"htm", "text/html"}, {"shtml", "text/html"},
+	{"css", "text/css"}, {"js", "text/javascript"}, {"mjs", "text/javascript"},
+	{"txt", "text/plain"}, {"csv", "text/csv"}, {"md", "text/markdown"},
+	{"xml", "application/xml"}, {"json", "application/json"}, {"map", "application/json"},
+	{"webmanifest", "application/manifest+json"}, {"wasm", "application/wasm"},
+	{"pdf", "application/pdf"}, {"zip", "application/zip"}, {"gz", "application/gzip"},
+	{"tar", "application/x-tar"},
+	{"jpg", "image/jpeg"}, {"jpeg", "image/jpeg"}, {"png", "image/png"},
+	{"gif", "image/gif"}, {"webp", "image/webp"}, {"avif", "image/avif"},
+	{"svg", "image/svg+xml"}, {"ico", "image/x-icon"}, {"bmp", "image/bmp"},
+	{"woff", "font/woff"}, {"woff2", "font/woff2"}, {"ttf", "font/ttf"}, {"otf", "font/otf"},
+	{"mp3", "audio/mpeg"}, {"ogg", "audio/ogg"}, {"wav", "audio/wav"},
+	{"mp4", "video/mp4"}, {"webm", "video/webm"}
+};
+
+MimeTypes::MimeTypes()
+{
+	for (size_t i = 0; i < sizeof(default_types) / sizeof(default_types[0]); i++)
+		types[default_types[i][0]] = default_types[i][1];
+}
+
+void	MimeTypes::add(const std::string& extension, const std::string& type)
+{
+	std::string	key = extension;
+
+	if (!key.empty() && key[0] == '.')
+		key = key.substr(1);
+	for (size_t i = 0; i < key.length(); i++)
+		key[i] = std::tolower(key[i]);
+	if (!key.empty())
+		types[key] = type;
+}
+
+void	MimeTypes::add(const std::map<std::string, std::string>& table)
+{
+	for (std::map<std::string, std::string>::const_iterator it = table.begin(); it != table.end(); ++it)
+		add(it->first, it->second);
+}
+
+// Accepts both the system format ("text/html  html htm") and nginx's
+// ("types { text/html html htm; }")
+bool	MimeTypes::loadFile(const std::string& path)
+{
+	std::ifstream	file(path.c_str());
+
+	if (!file.is_open())
+		return (false);
+
+	std::string	line;
+
+	while (std::getline(file, line))
+	{
+		line = line.substr(0, line.find('#'));
+		if (line.find('{') != std::string::npos || line.find('}') != std::string::npos)
+			continue ;
+
+		size_t	semicolon = line.find(';');
+
+		if (semicolon != std::string::npos)
+			line = line.substr(0, semicolon);
+
+		std::istringstream	tokens(line);
+		std::string			type;
+		std::string			extension;
+
+		if (!(tokens >> type))
+			continue ;
+		while (tokens >> extension)
+			add(extension, type);
+	}
+	return (true);
+}
+
+// Content-Type for the file name's extension, or default_type if unknown
+const std::string&	MimeTypes::lookup(const std::string& path, const std::string& default_type) const
+{
+	size_t	dot_pos = path.find_last_of('.');
+	size_t	slash_pos = path.find_last_of('/');
+
+	if (dot_pos == std::string::npos || (slash_pos != std::string::npos && dot_pos < slash_pos))
+		return (default_type);
+
+	std::string	extension = path.substr(dot_pos + 1);
+
+	for (size_t i = 0; i < extension.length(); i++)
+		extension[i] = std::tolower(extension[i]);
+
+	std::map<std::string, std::string>::const_iterator	it = types.find(extension);
+
+	if (it == types.end())
+		return (default_type);
+	return (it->second);
+}
@@ -0,0 +1,134 @@
+#include "OpenFileCache.hpp"
+#include <unistd.h>
+#include <fcntl.h>
+
+OpenFileCache::OpenFileCache() : max_entries(0), inactive(60), valid(60), cache_errors(false), last_sweep(0) {}
+
+OpenFileCache::~OpenFileCache()
+{
+	while (!entries.empty())
+		evict(entries.begin());
+}
+
+void	OpenFileCache::configure(size_t max, time_t inactive_secs, time_t valid_secs, bool errors)
+{
+	max_entries = max;
+	inactive = inactive_secs;
+	valid = valid_secs;
+	cache_errors = errors;
+}
+
+void	OpenFileCache::evict(std::map<std::string, Entry>::iterator it)
+{
+	if (it->second.info.fd >= 0)
+		close(it->second.info.fd);
+	lru.erase(it->second.lru);
+	entries.erase(it);
+}
+
+// Drop entries unused for `inactive` seconds (oldest are at the back)
+void	OpenFileCache::sweep(time_t now)
+{
+	if (now == last_sweep)
+		return ;
+	last_sweep = now;
+	while (!lru.empty())
+	{
+		std::map<std::string, Entry>::iterator	it = entries.find(lru.back());
+
+		if (now - it->second.last_used < inactive)
+			break ;
+		evict(it);
+	}
+}
+
+// stat + open for a path; returns false if it does not exist
+bool	OpenFileCache::load(const std::string& path, Entry& entry)
+{
+	if (entry.info.fd >= 0)
+		close(entry.info.fd);
+	entry.info.fd = -1;
+	entry.exists = (stat(path.c_str(), &entry.info.st) == 0);
+	if (entry.exists && S_ISREG(entry.info.st.st_mode))
+	{
+		// Close-on-exec so CGI children do not inherit cached descriptors
+		entry.info.fd = open(path.c_str(), O_RDONLY | O_CLOEXEC);
+	}
+	return (entry.exists);
+}
+
+// Same contract as stat(): false if the path does not exist
+bool	OpenFileCache::lookup(const std::string& path, FileInfo& info)
+{
+	if (!enabled())
+	{
+		info.fd = -1;
+		return (stat(path.c_str(), &info.st) == 0);
+	}
+
+	time_t	now = std::time(NULL);
+
+	sweep(now);
+
+	std::map<std::string, Entry>::iterator	it = entries.find(path);
+
+	if (it != entries.end())
+	{
+		Entry&	entry = it->second;
+
+		if (now - entry.validated >= valid)
+		{
+			// Re-validate: reopen if the file was replaced or modified
+			struct stat	st;
+			bool		exists = (stat(path.c_str(), &st) == 0);
+
+			if (exists != entry.exists || (exists && (st.st_ino != entry.info.st.st_ino
+				|| st.st_size != entry.info.st.st_size || st.st_mtime != entry.info.st.st_mtime)))
+				load(path, entry);
+			else if (exists)
+				entry.info.st = st;
+			entry.validated = now;
+		}
+		else if (entry.info.fd >= 0)
+		{
+			// The path is trusted until `valid` runs out, the open file's size is not:
+			// one truncated or appended to in place must not be read or sent with the old length
+			struct stat	st;
+
+			if (fstat(entry.info.fd, &st) == 0)
+				entry.info.st = st;
+		}
+		if (!entry.exists && !cache_errors)
+		{
+			evict(it);
+			return (false);
+		}
+		entry.last_used = now;
+		lru.splice(lru.begin(), lru, entry.lru);
+		info = entry.info;
+		return (entry.exists);
+	}
+
+	Entry	entry;
+
+	if (!load(path, entry) && !cache_errors)
+		return (false);
+	if (entries.size() >= max_entries)
+		evict(entries.find(lru.back()));
+	entry.validated = now;
+	entry.last_used = now;
+	lru.push_front(path);
+	entry.lru = lru.begin();
+	entries[path] = entry;
+	info = entry.info;
+	return (entry.exists);
+}
+
+// Forget a path after the server itself changed it (upload, DELETE)
+void	OpenFileCache::invalidate(const std::string& path)
+{
+	std::map<std::string, Entry>::iterator	it = entries.find(path);
+
+	if (it != entries.end())
+		evict(it);
+}
@@ -0,0 +1,150 @@
+#include "OutputQueue.hpp"
+#include <unistd.h>
+#include <algorithm>
+#include <sys/uio.h>
+#ifdef __linux__
+# include <sys/sendfile.h>
+#endif
+
+const char*	OutputSegment::bytes() const
+{
+	if (map)
+		return (map->data() + offset);
+	if (fd >= 0)
+		return (NULL);
+	return (data.data() + offset);
+}
+
+void	OutputQueue::pushData(const std::string& data)
+{
+	if (data.empty())
+		return ;
+	segments.push_back(OutputSegment());
+	segments.back().data = data;
+	segments.back().remaining = data.length();
+}
+
+void	OutputQueue::pushMapped(MappedFile* map, off_t offset, size_t length)
+{
+	if (length == 0)
+		return ;
+	map->retain();
+	segments.push_back(OutputSegment());
+	segments.back().map = map;
+	segments.back().offset = offset;
+	segments.back().remaining = length;
+}
+
+void	OutputQueue::pushFile(int fd, off_t offset, size_t length)
+{
+	if (length == 0)
+	{
+		close(fd);
+		return ;
+	}
+	segments.push_back(OutputSegment());
+	segments.back().fd = fd;
+	segments.back().offset = offset;
+	segments.back().remaining = length;
+}
+
+size_t	OutputQueue::memoryBytes() const
+{
+	size_t	total = 0;
+
+	for (std::deque<OutputSegment>::const_iterator it = segments.begin(); it != segments.end(); ++it)
+		total += it->data.capacity();
+	return (total);
+}
+
+ssize_t	OutputQueue::send(int socket_fd, size_t& attempted)
+{
+	attempted = 0;
+	if (segments.empty())
+		return (0);
+	if (segments.front().fd >= 0)
+		return (sendFile(socket_fd, segments.front(), attempted));
+
+	// Everything in memory up to the next file segment, in one writev
+	struct iovec	iov[OUTPUT_IOV_MAX];
+	int				count = 0;
+
+	for (std::deque<OutputSegment>::iterator it = segments.begin();
+		it != segments.end() && it->fd < 0 && count < OUTPUT_IOV_MAX; ++it)
+	{
+		iov[count].iov_base = const_cast<char*>(it->bytes());
+		iov[count].iov_len = std::min(it->remaining, static_cast<size_t>(FILE_SEND_CHUNK));
+		attempted += iov[count].iov_len;
+		count++;
+		// consume() takes written bytes in queue order: nothing may follow a partial segment
+		if (iov[count - 1].iov_len < it->remaining)
+			break ;
+	}
+
+	ssize_t	written = writev(socket_fd, iov, count);
+
+	if (written > 0)
+		consume(written);
+	return (written);
+}
+
+// Next slice of a file region
+ssize_t	OutputQueue::sendFile(int socket_fd, OutputSegment& segment, size_t& attempted)
+{
+	attempted = std::min(segment.remaining, static_cast<size_t>(FILE_SEND_CHUNK));
+#ifdef __linux__
+	// Kernel copies straight from the page cache to the socket
+	off_t	offset = segment.offset;
+	ssize_t	written = sendfile(socket_fd, segment.fd, &offset, attempted);
+#else
+	char	buffer[65536];
+
+	if (attempted > sizeof(buffer))
+		attempted = sizeof(buffer);
+
+	ssize_t	bytes_read = pread(segment.fd, buffer, attempted, segment.offset);
+
+	// == 0: the file shrank under us
+	if (bytes_read <= 0)
+		return (-1);
+	attempted = bytes_read;
+
+	ssize_t	written = write(socket_fd, buffer, bytes_read);
+#endif
+	if (written > 0)
+		consume(written);
+	return (written);
+}
+
+// Drop `written` bytes from the front, finishing segments as they empty
+void	OutputQueue::consume(size_t written)
+{
+	while (written > 0 && !segments.empty())
+	{
+		OutputSegment&	front = segments.front();
+		size_t			used = std::min(written, front.remaining);
+
+		front.offset += used;
+		front.remaining -= used;
+		written -= used;
+		if (front.remaining > 0)
+			break ;
+		if (front.fd >= 0)
+			close(front.fd);
+		if (front.map)
+			front.map->release();
+		segments.pop_front();
+	}
+}
+
+void	OutputQueue::clear()
+{
+	for (std::deque<OutputSegment>::iterator it = segments.begin(); it != segments.end(); ++it)
+	{
+		if (it->fd >= 0)
+			close(it->fd);
+		if (it->map)
+			it->map->release();
+	}
+	segments.clear();
+}
@@ -0,0 +1,262 @@
+#include "Proxy.hpp"
+#include <sstream>
+#include <cstdlib>
+#include <cctype>
+#include <algorithm>
+#include <poll.h>
+
+static std::string	lowercase(const std::string& str)
+{
+	std::string	result = str;
+
+	for (size_t i = 0; i < result.length(); i++)
+		result[i] = std::tolower(result[i]);
+	return (result);
+}
+
+// Headers that describe one connection, not the message (RFC 7230 section 6.1)
+static bool	isHopByHop(const std::string& lower_name)
+{
+	return (lower_name == "connection" || lower_name == "keep-alive" || lower_name == "proxy-connection"
+		|| lower_name == "te" || lower_name == "trailer" || lower_name == "upgrade");
+}
+
+// --- BodyFramer ---
+
+void	BodyFramer::start(Mode body_mode, size_t length)
+{
+	mode = body_mode;
+	remaining = length;
+	chunk_state = CHUNK_SIZE;
+	line.clear();
+	done = (mode == NONE || (mode == LENGTH && length == 0));
+	error = false;
+}
+
+size_t	BodyFramer::feed(const char* data, size_t length)
+{
+	size_t	used = 0;
+
+	if (mode == UNTIL_CLOSE)
+		return (length);
+	while (used < length && !done && !error)
+	{
+		if (mode == LENGTH || chunk_state == CHUNK_DATA)
+		{
+			size_t	n = std::min(remaining, length - used);
+
+			used += n;
+			remaining -= n;
+			if (remaining == 0 && mode == LENGTH)
+				done = true;
+			else if (remaining == 0)
+				chunk_state = CHUNK_SIZE;
+			continue ;
+		}
+
+		// Chunk size and trailer lines, one byte at a time
+		char	c = data[used++];
+
+		if (c != '\n')
+		{
+			if (line.length() >= PROXY_LINE_MAX)
+				error = true;
+			line += c;
+			continue ;
+		}
+		if (!line.empty() && line[line.length() - 1] == '\r')
+			line.erase(line.length() - 1);
+		if (chunk_state == CHUNK_SIZE)
+		{
+			// "1a2b[;extension]"
+			char*			end;
+			unsigned long	size = std::strtoul(line.c_str(), &end, 16);
+
+			if (end == line.c_str() || (*end && *end != ';' && *end != ' ' && *end != '\t'))
+				error = true;
+			else if (size == 0)
+				chunk_state = CHUNK_TRAILER;
+			else
+			{
+				chunk_state = CHUNK_DATA;
+				remaining = size + 2;	// Data and its CRLF
+			}
+		}
+		else if (line.empty())
+			done = true;				// Blank line after the trailers
+		line.clear();
+	}
+	return (used);
+}
+
+// --- ProxyState ---
+
+ProxyState::ProxyState(Upstream* target) : upstream(target), peer(-1), fd(-1), connected(false), reused(false),
+	received(false), tried(target->size(), false), request_sent(0), replayable(true), body_received(0), body_limit(0),
+	headers_sent(false), keep_upstream(false), head_request(false), paused(false), last_activity(time(NULL)) {}
+
+short	ProxyState::pollEvents() const
+{
+	if (!connected)
+		return (POLLOUT);
+
+	short	events = 0;
+
+	if (pending() > 0)
+		events |= POLLOUT;
+	if (!paused)
+		events |= POLLIN;
+	return (events);
+}
+
+bool	ProxyState::wantsClientBody() const
+{
+	return (!request_body.isDone() && pending() < PROXY_BUFFER_SIZE);
+}
+
+void	ProxyState::restart()
+{
+	peer = -1;
+	fd = -1;
+	connected = false;
+	reused = false;
+	received = false;
+	request_sent = 0;
+	header.clear();
+	paused = false;
+	last_activity = time(NULL);
+}
+
+void	ProxyState::compact()
+{
+	if (request_sent == 0 || request.length() <= PROXY_BUFFER_SIZE)
+		return ;
+	request.erase(0, request_sent);
+	request_sent = 0;
+	replayable = false;
+}
+
+int	ProxyState::parseResponseHead(const std::string& block, bool& client_keep_alive, std::string& client_head, int& status)
+{
+	std::istringstream	stream(block);
+	std::string			line;
+
+	// "HTTP/1.1 200 OK"
+	std::getline(stream, line);
+	if (!line.empty() && line[line.length() - 1] == '\r')
+		line.erase(line.length() - 1);
+	if (line.length() < 12 || line.compare(0, 5, "HTTP/") != 0 || line[8] != ' ')
+		return (-1);
+	status = std::atoi(line.c_str() + 9);
+	if (status < 100 || status > 599)
+		return (-1);
+	if (status < 200)
+		return (status == 101 ? -1 : 0);	// No protocol upgrades through the proxy
+
+	std::ostringstream	head;
+	bool				chunked = false;
+	bool				other_encoding = false;
+	bool				has_length = false;
+	size_t				length = 0;
+
+	keep_upstream = (line.compare(0, 8, "HTTP/1.1") == 0);
+	head << "HTTP/1.1 " << line.substr(9) << "\r\n";
+	while (std::getline(stream, line))
+	{
+		if (!line.empty() && line[line.length() - 1] == '\r')
+			line.erase(line.length() - 1);
+
+		size_t	colon = line.find(':');
+
+		if (colon == std::string::npos)
+			continue ;
+
+		std::string	name = line.substr(0, colon);
+		std::string	lower = lowercase(name);
+		std::string	value = line.substr(colon + 1);
+
+		while (!value.empty() && (value[0] == ' ' || value[0] == '\t'))
+			value.erase(0, 1);
+		if (lower == "connection")
+		{
+			std::string	lower_value = lowercase(value);
+
+			if (lower_value.find("close") != std::string::npos)
+				keep_upstream = false;
+			else if (lower_value.find("keep-alive") != std::string::npos)
+				keep_upstream = true;
+		}
+		if (isHopByHop(lower))
+			continue ;
+		if (lower == "transfer-encoding")
+		{
+			chunked = lowercase(value).find("chunked") != std::string::npos;
+			other_encoding = !chunked;
+		}
+		else if (lower == "content-length")
+		{
+			has_length = true;
+			length = std::strtoul(value.c_str(), NULL, 10);
+		}
+		head << name << ": " << value << "\r\n";
+	}
+
+	// RFC 7230 section 3.3.3
+	if (head_request || status == 204 || status == 304)
+		response_body.start(BodyFramer::NONE, 0);
+	else if (chunked)
+		response_body.start(BodyFramer::CHUNKED, 0);
+	else if (has_length && !other_encoding)
+		response_body.start(BodyFramer::LENGTH, length);
+	else
+	{
+		// The end of the body is the end of the connection: neither side can be kept
+		response_body.start(BodyFramer::UNTIL_CLOSE, 0);
+		keep_upstream = false;
+		client_keep_alive = false;
+	}
+	head << "Connection: " << (client_keep_alive ? "keep-alive" : "close") << "\r\n\r\n";
+	client_head = head.str();
+	return (1);
+}
+
+// Origin-form request for the upstream: the location prefix replaced by the proxy_pass
+// URI (if it has one), end-to-end headers, X-Forwarded-For and the client's body framing
+std::string	ProxyState::buildRequestHead(const Request& req, const LocationConfig& location,
+	const std::string& remote_addr, bool keep_alive)
+{
+	std::string			uri = req.getPath();
+	std::string			forwarded_for = remote_addr;
+	std::ostringstream	head;
+
+	if (!location.proxy_uri.empty() && location.match != LOCATION_REGEX && location.match != LOCATION_REGEX_ICASE
+		&& uri.compare(0, location.path.length(), location.path) == 0)
+		uri = location.proxy_uri + uri.substr(location.path.length());
+	head << req.getMethod() << " " << uri << " HTTP/1.1\r\n";
+
+	const std::map<std::string, std::string>&	headers = req.getHeaders();
+
+	for (std::map<std::string, std::string>::const_iterator it = headers.begin(); it != headers.end(); ++it)
+	{
+		std::string	lower = lowercase(it->first);
+
+		// Framing is set below; 100-continue is answered by us, not the upstream
+		if (isHopByHop(lower) || lower == "content-length" || lower == "transfer-encoding" || lower == "expect")
+			continue ;
+		if (lower == "x-forwarded-for")
+		{
+			forwarded_for = it->second + ", " + remote_addr;
+			continue ;
+		}
+		head << it->first << ": " << it->second << "\r\n";
+	}
+	if (req.getHeader("Host").empty())
+		head << "Host: " << location.proxy_pass << "\r\n";
+	head << "X-Forwarded-For: " << forwarded_for << "\r\n";
+	if (req.isChunked())
+		head << "Transfer-Encoding: chunked\r\n";
+	else if (!req.getHeader("Content-Length").empty())
+		head << "Content-Length: " << req.getContentLength() << "\r\n";
+	head << "Connection: " << (keep_alive ? "keep-alive" : "close") << "\r\n\r\n";
+	return (head.str());
+}
@@ -15,7 +15,7 @@ static inline bool	is_base64(unsigned char c)
 	return (isalnum(c) || (c == '+') || (c == '/'));
 }
 
-Request::Request() : headers_complete(false), body_complete(false), content_length(0), is_chunked(false), parse_error(false), error_code(0), multipart_parsed(false) {}
+Request::Request() : headers_complete(false), body_complete(false), content_length(0), is_chunked(false), parse_error(false), error_code(0), multipart_parsed(false), location(NULL), location_resolved(false) {}
 
 void Request::reset()
 {
@@ -23,16 +23,28 @@ void Request::reset()
 	path.clear();
 	version.clear();
 	headers.clear();
-	body.clear();
-	raw_data.clear();
+	// Swap rather than clear so a large upload does not keep its buffers on a keep-alive connection
+	std::string().swap(body);
+	std::string().swap(raw_data);
 	headers_complete = false;
 	body_complete = false;
 	content_length = 0;
 	is_chunked = false;
 	parse_error = false;
 	error_code = 0;
-	multipart_parts.clear();
+	std::vector<MultipartPart>().swap(multipart_parts);
 	multipart_parsed = false;
+	location = NULL;
+	location_resolved = false;
+}
+
+size_t	Request::multipartBytes() const
+{
+	size_t	bytes = multipart_parts.capacity() * sizeof(MultipartPart);
+
+	for (size_t i = 0; i < multipart_parts.size(); i++)
+		bytes += multipart_parts[i].data.capacity() + multipart_parts[i].name.capacity() + multipart_parts[i].filename.capacity();
+	return (bytes);
 }
 
 std::string	Request::trim(const std::string& str) const
@@ -302,8 +314,8 @@ void	Request::appendData(const std::string& data)
 				body_complete = true;
 				body = raw_body;
 
-				// Trim body to content_length
-				if (content_length > 0 && body.length() > content_length)
+				// Trim body to content_length (the rest is the next pipelined request)
+				if (body.length() > content_length)
 					body = body.substr(0, content_length);
 			}
 			else
@@ -410,13 +422,55 @@ bool	Request::parseHeaders()
 	else if (content_length == 0 || body.length() >= content_length)
 	{
 		body_complete = true;
-		// Trim body to content_length
-		if (content_length > 0 && body.length() > content_length)
+		// Trim body to content_length (the rest is the next pipelined request)
+		if (body.length() > content_length)
 			body = body.substr(0, content_length);
 	}
 	return (true);
 }
 
+// Path without the query string
+std::string	Request::getUriPath() const
+{
+	size_t	qmark = path.find('?');
+
+	if (qmark == std::string::npos)
+		return (path);
+	return (path.substr(0, qmark));
+}
+
+// Bytes received after the end of this request: the next pipelined ones
+std::string	Request::getPipelined() const
+{
+	size_t	header_end = raw_data.find("\r\n\r\n");
+
+	if (!isComplete() || header_end == std::string::npos)
+		return ("");
+
+	size_t	end = header_end + 4 + content_length;
+
+	if (is_chunked)
+	{
+		// Same end-of-body test as appendData()
+		end = raw_data.find("0\r\n\r\n", header_end + 4);
+		if (end == std::string::npos)
+			return ("");
+		end += 5;
+	}
+	if (end >= raw_data.length())
+		return ("");
+	return (raw_data.substr(end));
+}
+
+std::string	Request::getRawBody() const
+{
+	size_t	header_end = raw_data.find("\r\n\r\n");
+
+	if (header_end == std::string::npos)
+		return ("");
+	return (raw_data.substr(header_end + 4));
+}
+
 std::string	Request::getHeader(const std::string& key) const
 {
 	std::map<std::string, std::string>::const_iterator	it = headers.find(key);
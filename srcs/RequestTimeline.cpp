@@ -0,0 +1,69 @@
+#include "RequestTimeline.hpp"
+#include <cstdio>
+#include <ctime>
+
+const PhaseSpan	phase_spans[] = {
+	{ "request", PHASE_FIRST_BYTE, PHASE_LAST_WRITE },
+	{ "accept_wait", PHASE_ACCEPT, PHASE_FIRST_BYTE },				// New connections only
+	{ "header", PHASE_FIRST_BYTE, PHASE_HEADERS },
+	{ "body", PHASE_HEADERS, PHASE_BODY },
+	{ "handler", PHASE_HANDLER_START, PHASE_HANDLER_END },
+	{ "upstream_header", PHASE_CGI_SPAWN, PHASE_CGI_FIRST_OUTPUT },
+	{ "upstream_response", PHASE_CGI_SPAWN, PHASE_CGI_EXIT },
+	{ "first_byte", PHASE_FIRST_BYTE, PHASE_FIRST_WRITE },
+	{ "send", PHASE_FIRST_WRITE, PHASE_LAST_WRITE },
+	{ NULL, PHASE_COUNT, PHASE_COUNT }
+};
+
+unsigned long long	monotonicMicros()
+{
+	struct timespec	now;
+
+	clock_gettime(CLOCK_MONOTONIC, &now);
+	return (now.tv_sec * 1000000ULL + now.tv_nsec / 1000);
+}
+
+void	RequestTimeline::reset()
+{
+	for (int i = 0; i < PHASE_COUNT; i++)
+		at[i] = 0;
+}
+
+// Microseconds between two phases (-1 if either was not reached)
+long long	RequestTimeline::span(RequestPhase from, RequestPhase to) const
+{
+	if (!at[from] || !at[to] || at[to] < at[from])
+		return (-1);
+	return (at[to] - at[from]);
+}
+
+// Every phase as milliseconds after the first request byte, "-" if not reached:
+// "hdr=0.051 body=0.052 hs=0.052 he=0.310 spawn=- cgi1=- exit=- w1=0.331 wN=0.402"
+std::string	RequestTimeline::describe() const
+{
+	static const struct
+	{
+		RequestPhase	phase;
+		const char*		name;
+	}	phases[] = {
+		{ PHASE_HEADERS, "hdr" }, { PHASE_BODY, "body" }, { PHASE_HANDLER_START, "hs" },
+		{ PHASE_HANDLER_END, "he" }, { PHASE_CGI_SPAWN, "spawn" }, { PHASE_CGI_FIRST_OUTPUT, "cgi1" },
+		{ PHASE_CGI_EXIT, "exit" }, { PHASE_FIRST_WRITE, "w1" }, { PHASE_LAST_WRITE, "wN" }
+	};
+	std::string	text;
+
+	for (size_t i = 0; i < sizeof(phases) / sizeof(phases[0]); i++)
+	{
+		long long	offset = span(PHASE_FIRST_BYTE, phases[i].phase);
+		char		value[32];
+
+		if (offset < 0)
+			snprintf(value, sizeof(value), "%s=-", phases[i].name);
+		else
+			snprintf(value, sizeof(value), "%s=%.3f", phases[i].name, offset / 1000.0);
+		if (!text.empty())
+			text += ' ';
+		text += value;
+	}
+	return (text);
+}
@@ -1,7 +1,41 @@
 #include "Response.hpp"
 #include <sstream>
+#include <cstring>
 
-Response::Response() : status_code(200), status_message("OK") {}
+Response::Response() : status_code(200), status_message("OK"), body_fd(-1), body_offset(0), body_length(0), body_map(NULL) {}
+
+Response::Response(const Response& other)
+	: status_code(other.status_code), status_message(other.status_message), headers(other.headers), body(other.body),
+	body_fd(other.body_fd), body_offset(other.body_offset), body_length(other.body_length), body_map(other.body_map)
+{
+	if (body_map)
+		body_map->retain();
+}
+
+Response&	Response::operator=(const Response& other)
+{
+	if (this == &other)
+		return (*this);
+	if (other.body_map)
+		other.body_map->retain();
+	if (body_map)
+		body_map->release();
+	status_code = other.status_code;
+	status_message = other.status_message;
+	headers = other.headers;
+	body = other.body;
+	body_fd = other.body_fd;
+	body_offset = other.body_offset;
+	body_length = other.body_length;
+	body_map = other.body_map;
+	return (*this);
+}
+
+Response::~Response()
+{
+	if (body_map)
+		body_map->release();
+}
 
 void	Response::setStatus(int code, const std::string& message)
 {
@@ -25,12 +59,44 @@ void	Response::setBody(const std::string& content)
 	setHeader("Content-Length", oss.str());
 }
 
+// Stream `length` bytes of an open file starting at `offset` as the body.
+// The fd is handed over with the response; whoever sends it closes it.
+void	Response::setFileBody(int fd, off_t offset, size_t length)
+{
+	body.clear();
+	body_fd = fd;
+	body_offset = offset;
+	body_length = length;
+
+	std::ostringstream	oss;
+
+	oss << length;
+	setHeader("Content-Length", oss.str());
+}
+
+// Send a whole shared mapping as the body (takes a reference)
+void	Response::setMappedBody(MappedFile* map)
+{
+	body.clear();
+	map->retain();
+	if (body_map)
+		body_map->release();
+	body_map = map;
+	body_offset = 0;
+	body_length = map->getLength();
+
+	std::ostringstream	oss;
+
+	oss << body_length;
+	setHeader("Content-Length", oss.str());
+}
+
 int	Response::getStatusCode() const
 {
 	return (status_code);
 }
 
-std::string	Response::toString() const
+std::string	Response::headerString() const
 {
 	std::ostringstream	response;
 	
@@ -43,44 +109,77 @@ std::string	Response::toString() const
 
 	// Empty line separates headers from body
 	response << "\r\n";
-
-	// Body
-	response << body;
 	return (response.str());
 }
 
-// Get Content-Type based on file extension
-std::string	Response::getContentType(const std::string& path)
+std::string	Response::toString() const
 {
-	// Find the extension
-	size_t	dot_pos = path.find_last_of('.');
+	return (headerString() + body);
+}
 
-	if (dot_pos == std::string::npos)
-		return ("application/octet-stream"); // Default for unknown types
-	
-	std::string	ext = path.substr(dot_pos);
-	
-	// Map extensions to MIME types
-	if (ext == ".html" || ext == ".htm")
-		return ("text/html");
-	else if (ext == ".css")
-		return ("text/css");
-	else if (ext == ".js")
-		return ("text/javascript");
-	else if (ext == ".json")
-		return ("application/json");
-	else if (ext == ".txt")
-		return ("text/plain");
-	else if (ext == ".jpg" || ext == ".jpeg")
-		return ("image/jpeg");
-	else if (ext == ".png")
-		return ("image/png");
-	else if (ext == ".gif")
-		return ("image/gif");
-	else if (ext == ".pdf")
-		return ("application/pdf");
-	else if (ext == ".xml")
-		return ("application/xml");
-	else
-		return ("application/octet-stream");
+std::string	Response::reasonPhrase(int code)
+{
+	switch (code)
+	{
+		case 400: return ("Bad Request");
+		case 403: return ("Forbidden");
+		case 404: return ("Not Found");
+		case 405: return ("Method Not Allowed");
+		case 408: return ("Request Timeout");
+		case 413: return ("Payload Too Large");
+		case 414: return ("URI Too Long");
+		case 416: return ("Range Not Satisfiable");
+		case 500: return ("Internal Server Error");
+		case 501: return ("Not Implemented");
+		case 502: return ("Bad Gateway");
+		case 503: return ("Service Unavailable");
+		case 504: return ("Gateway Timeout");
+		case 505: return ("HTTP Version Not Supported");
+		default: return ("Error");
+	}
+}
+
+// Used where no server block is involved yet (parse errors, body limit, CGI failures)
+const std::string&	Response::canned(int code, bool keep_alive)
+{
+	static std::map<int, std::string>	cache[2];
+	std::map<int, std::string>::iterator	it = cache[keep_alive].find(code);
+
+	if (it != cache[keep_alive].end())
+		return (it->second);
+
+	Response			res;
+	std::ostringstream	body;
+	std::string			reason = reasonPhrase(code);
+
+	body << "<html><body><h1>" << code << " " << reason << "</h1></body></html>";
+	res.setStatus(code, reason);
+	res.setHeader("Content-Type", "text/html");
+	res.setHeader("Connection", keep_alive ? "keep-alive" : "close");
+	res.setBody(body.str());
+	return (cache[keep_alive][code] = res.toString());
+}
+
+// Format a timestamp as an HTTP-date: "Sun, 06 Nov 1994 08:49:37 GMT"
+std::string	Response::httpDate(time_t t)
+{
+	struct tm	tm_utc;
+	char		buffer[64];
+
+	gmtime_r(&t, &tm_utc);
+	strftime(buffer, sizeof(buffer), "%a, %d %b %Y %H:%M:%S GMT", &tm_utc);
+	return (std::string(buffer));
+}
+
+// Parse an IMF-fixdate HTTP-date (the only format senders may generate)
+time_t	Response::parseHttpDate(const std::string& date)
+{
+	struct tm	tm_utc;
+
+	std::memset(&tm_utc, 0, sizeof(tm_utc));
+	const char*	end = strptime(date.c_str(), "%a, %d %b %Y %H:%M:%S GMT", &tm_utc);
+
+	if (!end || *end != '\0')
+		return (-1);
+	return (timegm(&tm_utc));
 }
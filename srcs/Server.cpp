@@ -3,6 +3,10 @@
 #include <iostream>
 #include <sys/socket.h>
 #include <netinet/in.h>
+#include <netinet/tcp.h>
+#include <sys/un.h>
+#include <netdb.h>
+#include <cstring>
 #include <unistd.h>
 #include <fstream>
 #include <sstream>
@@ -10,32 +14,149 @@
 #include <dirent.h>
 #include <ctime>
 #include <cstdlib>
+#include <cctype>
+#include <algorithm>
 #include <cstdio>
 #include <fcntl.h>
+#include <sys/time.h>
 
-Server::Server(const ServerConfig& cfg) : server_fd(-1), config(cfg) {}
+Server::Server(const ServerConfig& cfg) : server_fd(-1), config(cfg), mapped_bytes(0), access_log(NULL)
+{
+	std::string	log_error;
+
+	// Validated by Config::parse
+	if (config.access_log.path != "off")
+		log_format.compile(config.access_log.format, log_error);
+	router.compile(config.locations);
+	gzip_cache.setLimit(config.gzip_cache_size);
+	if (!config.mime_types_file.empty() && !mime_types.loadFile(config.mime_types_file))
+		std::cerr << "Warning: Cannot read mime_types file " << config.mime_types_file << std::endl;
+	mime_types.add(config.types);
+	loadErrorPages();
+	open_files.configure(config.open_file_cache_max, config.open_file_cache_inactive,
+		config.open_file_cache_valid, config.open_file_cache_errors);
+}
 
 Server::~Server()
 {
 	stop();
+	// Responses still being sent hold their own references
+	for (std::map<std::string, MappedFile*>::iterator it = mappings.begin(); it != mappings.end(); ++it)
+		it->second->release();
+}
+
+void	Server::logRequest(const AccessLogRecord& record)
+{
+	if (!access_log)
+		return ;
+	log_line.clear();
+	log_format.append(log_line, record);
+	access_log->write(log_line);
+}
+
+// Resolve the configured listen address (IPv4, IPv6 or Unix socket path)
+bool	Server::resolveListenAddress(struct sockaddr_storage& addr, socklen_t& addr_len) const
+{
+	std::memset(&addr, 0, sizeof(addr));
+	if (!config.unix_path.empty())
+	{
+		struct sockaddr_un*	un = reinterpret_cast<struct sockaddr_un*>(&addr);
+
+		if (config.unix_path.length() >= sizeof(un->sun_path))
+			return (false);
+		un->sun_family = AF_UNIX;
+		std::strcpy(un->sun_path, config.unix_path.c_str());
+		addr_len = sizeof(struct sockaddr_un);
+		return (true);
+	}
+	if (config.host.empty())
+	{
+		// Default: all IPv4 addresses
+		struct sockaddr_in*	in = reinterpret_cast<struct sockaddr_in*>(&addr);
+
+		in->sin_family = AF_INET;
+		in->sin_addr.s_addr = INADDR_ANY;
+		in->sin_port = htons(config.port);
+		addr_len = sizeof(struct sockaddr_in);
+		return (true);
+	}
+
+	struct addrinfo		hints;
+	struct addrinfo*	result = NULL;
+	std::ostringstream	port_ss;
+
+	std::memset(&hints, 0, sizeof(hints));
+	hints.ai_family = AF_UNSPEC;
+	hints.ai_socktype = SOCK_STREAM;
+	hints.ai_flags = AI_PASSIVE;
+	port_ss << config.port;
+	if (getaddrinfo(config.host.c_str(), port_ss.str().c_str(), &hints, &result) != 0 || !result)
+		return (false);
+	std::memcpy(&addr, result->ai_addr, result->ai_addrlen);
+	addr_len = result->ai_addrlen;
+	freeaddrinfo(result);
+	return (true);
+}
+
+// Optional TCP tuning on the listening socket (not fatal if the platform rejects it)
+void	Server::applyListenOptions()
+{
+	if (server_fd < 0 || !config.unix_path.empty())
+		return ;
+#ifdef TCP_DEFER_ACCEPT
+	// Only wake up accept() once the client has actually sent data
+	if (config.defer_accept > 0 && setsockopt(server_fd, IPPROTO_TCP, TCP_DEFER_ACCEPT, &config.defer_accept, sizeof(config.defer_accept)) < 0)
+		std::cerr << "Warning: TCP_DEFER_ACCEPT not supported on " << config.listenAddress() << std::endl;
+#endif
+#ifdef TCP_FASTOPEN
+	// Accept data in the SYN for repeat clients (saves one RTT)
+	if (config.fastopen > 0 && setsockopt(server_fd, IPPROTO_TCP, TCP_FASTOPEN, &config.fastopen, sizeof(config.fastopen)) < 0)
+		std::cerr << "Warning: TCP_FASTOPEN not supported on " << config.listenAddress() << std::endl;
+#endif
 }
 
 bool	Server::start()
 {
+	struct sockaddr_storage	address;
+	socklen_t				address_len = 0;
+	std::string				listen_address = config.listenAddress();
+
+	if (!resolveListenAddress(address, address_len))
+	{
+		std::cerr << "Error: Cannot resolve listen address " << listen_address << std::endl;
+		return (false);
+	}
+
 	// Create socket
-	server_fd = socket(AF_INET, SOCK_STREAM, 0);
+	server_fd = socket(address.ss_family, SOCK_STREAM, 0);
 	if (server_fd < 0)
 	{
 		std::cerr << "Error: Failed to create socket" << std::endl;
 		return (false);
 	}
 
-	// Set socket options
-	int opt = 1;
-	if (setsockopt(server_fd, SOL_SOCKET, SO_REUSEADDR, &opt, sizeof(opt)) < 0)
+	if (address.ss_family == AF_UNIX)
 	{
-		std::cerr << "Error: setsockopt failed" << std::endl;
-		return (false);
+		// Remove a stale socket file left by a previous run
+		struct stat	st;
+
+		if (stat(config.unix_path.c_str(), &st) == 0 && S_ISSOCK(st.st_mode))
+			unlink(config.unix_path.c_str());
+	}
+	else
+	{
+		// Set socket options
+		int opt = 1;
+		if (setsockopt(server_fd, SOL_SOCKET, SO_REUSEADDR, &opt, sizeof(opt)) < 0)
+		{
+			std::cerr << "Error: setsockopt failed" << std::endl;
+			return (false);
+		}
+
+		// Keep [::]:port IPv6-only so it can coexist with 0.0.0.0:port
+		if (address.ss_family == AF_INET6)
+			setsockopt(server_fd, IPPROTO_IPV6, IPV6_V6ONLY, &opt, sizeof(opt));
+		applyListenOptions();
 	}
 
 	// Set server socket to non-blocking mode (only F_SETFL and O_NONBLOCK allowed on macOS)
@@ -47,15 +168,10 @@ bool	Server::start()
 		return (false);
 	}
 
-	// Bind to port
-	struct sockaddr_in	address;
-	address.sin_family = AF_INET;
-	address.sin_addr.s_addr = INADDR_ANY;
-	address.sin_port = htons(config.port);
-	
-	if (bind(server_fd, (struct sockaddr*)&address, sizeof(address)) < 0)
+	// Bind to address
+	if (bind(server_fd, reinterpret_cast<struct sockaddr*>(&address), address_len) < 0)
 	{
-		std::cerr << "Error: Bind failed on port " << config.port << std::endl;
+		std::cerr << "Error: Bind failed on " << listen_address << std::endl;
 		return (false);
 	}
 
@@ -65,42 +181,51 @@ bool	Server::start()
 		std::cerr << "Error: Listen failed" << std::endl;
 		return (false);
 	}
-	std::cout << "[Server] " << config.server_name << ":" << config.port << " started" << std::endl;
+	std::cout << "[Server] " << getServerName() << " on " << listen_address << " started" << std::endl;
 	return (true);
 }
 
+// Take over a listening socket from a previous configuration (reload)
+void	Server::adoptListener(int fd)
+{
+	server_fd = fd;
+	applyListenOptions();
+}
+
+// Hand the listening socket to a new configuration without closing it
+int	Server::releaseListener()
+{
+	int	fd = server_fd;
+
+	server_fd = -1;
+	return (fd);
+}
+
 void	Server::stop()
 {
 	if (server_fd >= 0)
 	{
 		close(server_fd);
 		server_fd = -1;
+		if (!config.unix_path.empty())
+			unlink(config.unix_path.c_str());
 	}
 }
 
 const LocationConfig*	Server::findLocation(const std::string& path) const
 {
-	const LocationConfig*	best_match = NULL;
-	size_t					best_match_len = 0;
-	
-	// Find the longest matching location path
-	for (size_t i = 0; i < config.locations.size(); i++)
-	{
-		const LocationConfig&	loc = config.locations[i];
+	size_t	query_pos = path.find('?');
 
-		// Check if path starts with location path
-		if (path.find(loc.path) == 0)
-		{
-			size_t	loc_len = loc.path.length();
+	if (query_pos != std::string::npos)
+		return (router.match(path.substr(0, query_pos)));
+	return (router.match(path));
+}
 
-			if (loc_len > best_match_len)
-			{
-				best_match = &loc;
-				best_match_len = loc_len;
-			}
-		}
-	}
-	return (best_match);
+const LocationConfig*	Server::resolveLocation(Request& req) const
+{
+	if (!req.isLocationResolved())
+		req.setLocation(findLocation(req.getPath()));
+	return (req.getLocation());
 }
 
 bool	Server::isMethodAllowed(const std::string& method, const LocationConfig* location) const
@@ -132,10 +257,8 @@ std::string	Server::buildFilePath(const std::string& uri, const LocationConfig*
 		base_path = location->root;
 
 		// Remove the location path from URI since we're using a different root
-		std::string	relative_path = uri;
+		std::string	relative_path = location->relativeUri(uri);
 
-		if (relative_path.find(location->path) == 0)
-			relative_path = relative_path.substr(location->path.length());
 		if (relative_path.empty() || relative_path[0] != '/')
 			relative_path = "/" + relative_path;
 		return (base_path + relative_path);
@@ -146,32 +269,561 @@ std::string	Server::buildFilePath(const std::string& uri, const LocationConfig*
 	return (full_path);
 }
 
-Response	Server::serveFile(const std::string& path, const LocationConfig* location)
+// Strong validator built from inode, size and modification time
+std::string	Server::makeETag(const struct stat& st) const
+{
+	std::ostringstream	oss;
+
+	oss << std::hex << "\"" << st.st_ino << "-" << st.st_size << "-" << st.st_mtime << "\"";
+	return (oss.str());
+}
+
+// RFC 7232: If-None-Match takes precedence; If-Modified-Since is only used without it
+bool	Server::isNotModified(const Request& req, const std::string& etag, time_t mtime) const
+{
+	std::string	if_none_match = req.getHeader("If-None-Match");
+
+	if (!if_none_match.empty())
+	{
+		// "*" alone matches any current representation; a '*' inside a tag is just a character
+		size_t	first = if_none_match.find_first_not_of(" \t");
+		size_t	last = if_none_match.find_last_not_of(" \t");
+
+		if (first != std::string::npos && if_none_match.substr(first, last - first + 1) == "*")
+			return (true);
+
+		// Weak comparison: W/"x" matches "x"
+		std::istringstream	list(if_none_match);
+		std::string			tag;
+
+		while (std::getline(list, tag, ','))
+		{
+			size_t	start = tag.find_first_not_of(" \t");
+
+			if (start == std::string::npos)
+				continue ;
+			tag = tag.substr(start);
+			tag = tag.substr(0, tag.find_last_not_of(" \t") + 1);
+			if (tag.compare(0, 2, "W/") == 0)
+				tag = tag.substr(2);
+			if (tag == etag)
+				return (true);
+		}
+		return (false);
+	}
+
+	std::string	if_modified_since = req.getHeader("If-Modified-Since");
+
+	if (if_modified_since.empty() || req.getMethod() != "GET")
+		return (false);
+
+	time_t	since = Response::parseHttpDate(if_modified_since);
+
+	return (since != -1 && mtime <= since);
+}
+
+// Parse "bytes=0-499,1000-,-200" against a file of `size` bytes.
+// Returns 1 with satisfiable ranges filled in, 0 if the header must be ignored
+// (bad syntax, other unit, too many ranges) and -1 if nothing is satisfiable (416).
+int	Server::parseRanges(const std::string& header, off_t size, std::vector<ByteRange>& ranges) const
 {
-	(void)location;
+	if (header.compare(0, 6, "bytes=") != 0)
+		return (0);
+
+	std::istringstream	list(header.substr(6));
+	std::string			spec;
+	size_t				count = 0;
 
-	// Check read permission before opening
-	if (access(path.c_str(), R_OK) != 0)
+	while (std::getline(list, spec, ','))
+	{
+		size_t	start = spec.find_first_not_of(" \t");
+
+		if (start == std::string::npos)
+			continue ;
+		spec = spec.substr(start, spec.find_last_not_of(" \t") + 1 - start);
+		if (++count > MAX_RANGES)
+			return (0);
+
+		size_t	dash = spec.find('-');
+
+		if (dash == std::string::npos)
+			return (0);
+
+		std::string	first_str = spec.substr(0, dash);
+		std::string	last_str = spec.substr(dash + 1);
+
+		if (first_str.find_first_not_of("0123456789") != std::string::npos
+			|| last_str.find_first_not_of("0123456789") != std::string::npos
+			|| (first_str.empty() && last_str.empty()))
+			return (0);
+		if (first_str.empty())
+		{
+			// Suffix range: the last N bytes
+			off_t	suffix = std::strtoll(last_str.c_str(), NULL, 10);
+
+			if (suffix > 0 && size > 0)
+				ranges.push_back(ByteRange(suffix >= size ? 0 : size - suffix, size - 1));
+			continue ;
+		}
+
+		off_t	first = std::strtoll(first_str.c_str(), NULL, 10);
+		off_t	last = last_str.empty() ? size - 1 : std::strtoll(last_str.c_str(), NULL, 10);
+
+		if (!last_str.empty() && last < first)
+			return (0);
+		if (first >= size)
+			continue ;	// Unsatisfiable, but others may still be served
+		ranges.push_back(ByteRange(first, last >= size ? size - 1 : last));
+	}
+	if (count == 0)
+		return (0);
+	return (ranges.empty() ? -1 : 1);
+}
+
+// If-Range: serve the range only if the representation is unchanged (strong match)
+bool	Server::ifRangeMatches(const Request& req, const std::string& etag, time_t mtime) const
+{
+	std::string	if_range = req.getHeader("If-Range");
+
+	if (if_range.empty())
+		return (true);
+	if (if_range[0] == '"')
+		return (if_range == etag);
+	if (if_range.compare(0, 2, "W/") == 0)
+		return (false);
+	return (Response::parseHttpDate(if_range) == mtime);
+}
+
+// 206 Partial Content: one range streams straight from the file,
+// several are assembled into a multipart/byteranges body
+Response	Server::serveRanges(const std::string& path, const FileInfo& info, const std::vector<ByteRange>& ranges, const std::string& content_type)
+{
+	const struct stat&	st = info.st;
+	int					fd = openBody(path, info);
+
+	if (fd < 0)
+		return (serve500());
+
+	Response			res;
+	std::ostringstream	content_range;
+
+	res.setStatus(206, "Partial Content");
+	if (ranges.size() == 1)
+	{
+		content_range << "bytes " << ranges[0].first << "-" << ranges[0].last << "/" << st.st_size;
+		res.setHeader("Content-Type", content_type);
+		res.setHeader("Content-Range", content_range.str());
+		res.setFileBody(fd, ranges[0].first, ranges[0].last - ranges[0].first + 1);
+		return (res);
+	}
+
+	static unsigned long	boundary_counter = 0;
+	std::ostringstream		boundary;
+	std::string				body;
+
+	boundary << std::hex << std::time(NULL) << ++boundary_counter;
+	for (size_t i = 0; i < ranges.size(); i++)
+	{
+		std::ostringstream	part_header;
+		size_t				length = ranges[i].last - ranges[i].first + 1;
+
+		part_header << "\r\n--" << boundary.str() << "\r\n"
+			<< "Content-Type: " << content_type << "\r\n"
+			<< "Content-Range: bytes " << ranges[i].first << "-" << ranges[i].last << "/" << st.st_size << "\r\n\r\n";
+		body += part_header.str();
+
+		size_t	offset = body.size();
+
+		body.resize(offset + length);
+		if (pread(fd, &body[offset], length, ranges[i].first) != static_cast<ssize_t>(length))
+		{
+			close(fd);
+			return (serve500());
+		}
+	}
+	close(fd);
+	body += "\r\n--" + boundary.str() + "--\r\n";
+	res.setHeader("Content-Type", "multipart/byteranges; boundary=" + boundary.str());
+	res.setBody(body);
+	return (res);
+}
+
+// Accept-Encoding: "gzip, deflate;q=0.5, br;q=0" - a coding is acceptable if
+// listed (or covered by *) with a non-zero quality
+bool	Server::acceptsEncoding(const std::string& accept_encoding, const std::string& coding) const
+{
+	std::istringstream	list(accept_encoding);
+	std::string			item;
+	bool				wildcard = false;
+
+	while (std::getline(list, item, ','))
+	{
+		std::string	name = item.substr(0, item.find(';'));
+		size_t		start = name.find_first_not_of(" \t");
+
+		if (start == std::string::npos)
+			continue ;
+		name = name.substr(start, name.find_last_not_of(" \t") + 1 - start);
+		for (size_t i = 0; i < name.length(); i++)
+			name[i] = std::tolower(name[i]);
+
+		size_t	q = item.find("q=");
+		bool	allowed = (q == std::string::npos || std::strtod(item.c_str() + q + 2, NULL) > 0);
+
+		if (name == coding)
+			return (allowed);
+		if (name == "*")
+			wildcard = allowed;
+	}
+	return (wildcard);
+}
+
+// Text formats worth compressing; images and archives are already compressed
+bool	Server::isCompressible(const std::string& content_type) const
+{
+	return (content_type.compare(0, 5, "text/") == 0
+		|| content_type == "application/json"
+		|| content_type == "application/javascript"
+		|| content_type == "application/xml"
+		|| content_type == "image/svg+xml");
+}
+
+// gzip_static: look for file.br / file.gz next to the file, preferring brotli
+bool	Server::findPrecompressed(const std::string& path, const std::string& accept_encoding, std::string& encoded_path, FileInfo& encoded, std::string& encoding)
+{
+	static const char*	codings[][2] = {{"br", ".br"}, {"gzip", ".gz"}};
+
+	for (size_t i = 0; i < sizeof(codings) / sizeof(codings[0]); i++)
+	{
+		if (!acceptsEncoding(accept_encoding, codings[i][0]))
+			continue ;
+
+		std::string	candidate = path + codings[i][1];
+
+		if (open_files.lookup(candidate, encoded) && S_ISREG(encoded.st.st_mode)
+			&& (encoded.fd >= 0 || access(candidate.c_str(), R_OK) == 0))
+		{
+			encoded_path = candidate;
+			encoding = codings[i][0];
+			return (true);
+		}
+	}
+	return (false);
+}
+
+Response	Server::serveFile(const Request& req, const std::string& path, const LocationConfig* location)
+{
+	FileInfo	info;
+
+	if (!open_files.lookup(path, info))
+		return (serve404());
+
+	// Pick the representation: precompressed sibling, on-the-fly gzip or the file itself.
+	// Range requests always get the identity encoding so offsets refer to the real file.
+	std::string	content_type = mime_types.lookup(path, (location && !location->default_type.empty()) ? location->default_type : config.default_type);
+	std::string	range = req.getHeader("Range");
+	std::string	accept_encoding = req.getHeader("Accept-Encoding");
+	struct stat	st = info.st;
+	bool		compress_on_the_fly = config.gzip && GzipCache::available() && isCompressible(content_type)
+									&& st.st_size >= static_cast<off_t>(config.gzip_min_length)
+									&& st.st_size <= FILE_STREAM_THRESHOLD;
+	bool		vary = config.gzip_static || compress_on_the_fly;
+	std::string	body_path = path;
+	FileInfo	body = info;
+	std::string	encoding;
+
+	if (range.empty() && config.gzip_static)
+		findPrecompressed(path, accept_encoding, body_path, body, encoding);
+	if (range.empty() && encoding.empty() && compress_on_the_fly && acceptsEncoding(accept_encoding, "gzip"))
+		encoding = "gzip";
+	else
+		compress_on_the_fly = false;
+
+	// Validators are answered before the file is opened or read
+	std::string	etag = makeETag(body.st);
+	std::string	last_modified = Response::httpDate(st.st_mtime);
+
+	// Each encoding is a distinct representation with its own validator
+	if (compress_on_the_fly)
+		etag.insert(etag.length() - 1, "-gzip");
+	if (isNotModified(req, etag, st.st_mtime))
+	{
+		Response	res;
+
+		res.setStatus(304, "Not Modified");
+		res.setHeader("ETag", etag);
+		res.setHeader("Last-Modified", last_modified);
+		if (vary)
+			res.setHeader("Vary", "Accept-Encoding");
+		return (res);
+	}
+
+	// Check read permission before opening (a cached descriptor proves it)
+	if (info.fd < 0 && access(path.c_str(), R_OK) != 0)
 		return (serve403());
 
+	if (compress_on_the_fly)
+	{
+		const std::string*	cached = gzip_cache.find(path, st);
+		std::string			compressed;
+
+		if (!cached)
+		{
+			std::string	content = readFile(path, info);
+
+			if (content.empty() && st.st_size > 0)
+				return (serve500());
+			if (!GzipCache::compress(content, compressed))
+				return (serve500());
+			gzip_cache.insert(path, st, compressed);
+			cached = &compressed;
+		}
+
+		Response	res;
+
+		res.setStatus(200, "OK");
+		res.setHeader("Content-Type", content_type);
+		res.setHeader("Content-Encoding", "gzip");
+		res.setHeader("Vary", "Accept-Encoding");
+		res.setHeader("ETag", etag);
+		res.setHeader("Last-Modified", last_modified);
+		res.setBody(*cached);
+		return (res);
+	}
+
+	if (!range.empty() && req.getMethod() == "GET" && ifRangeMatches(req, etag, st.st_mtime))
+	{
+		std::vector<ByteRange>	ranges;
+		int						parsed = parseRanges(range, st.st_size, ranges);
+		size_t					total = 0;
+
+		for (size_t i = 0; i < ranges.size(); i++)
+			total += ranges[i].last - ranges[i].first + 1;
+		if (parsed < 0)
+			return (serve416(st.st_size));
+		if (parsed > 0 && (ranges.size() == 1 || total <= MAX_MULTIRANGE_BYTES))
+		{
+			Response	res = serveRanges(path, info, ranges, content_type);
+
+			res.setHeader("ETag", etag);
+			res.setHeader("Last-Modified", last_modified);
+			if (vary)
+				res.setHeader("Vary", "Accept-Encoding");
+			return (res);
+		}
+	}
+
 	Response	res;
-	std::string	content = readFile(path);
 
-	if (content.empty())
+	res.setStatus(200, "OK");
+	res.setHeader("Content-Type", content_type);
+	res.setHeader("ETag", etag);
+	res.setHeader("Last-Modified", last_modified);
+	if (!encoding.empty())
+		res.setHeader("Content-Encoding", encoding);
+	else
+		res.setHeader("Accept-Ranges", "bytes");
+	if (vary)
+		res.setHeader("Vary", "Accept-Encoding");
+
+	// Large files are streamed from disk after the headers
+	if (body.st.st_size > FILE_STREAM_THRESHOLD)
 	{
-		// File exists (caller checked) but read returned empty - could be truly empty or read error
-		struct stat	st;
-		if (stat(path.c_str(), &st) == 0 && st.st_size > 0)
+		int	fd = openBody(body_path, body);
+
+		if (fd < 0)
 			return (serve500());
-		// File is genuinely empty, serve it
+		res.setFileBody(fd, 0, body.st.st_size);
+		return (res);
 	}
-	res.setStatus(200, "OK");
-	res.setHeader("Content-Type", Response::getContentType(path));
+
+	// Mid-size files are sent from a mapping shared by all connections
+	if (body.st.st_size > MMAP_THRESHOLD)
+	{
+		MappedFile*	map = mapFile(body_path, body);
+
+		if (map)
+		{
+			res.setMappedBody(map);
+			return (res);
+		}
+	}
+
+	std::string	content = readFile(body_path, body);
+
+	// File exists but read returned empty - truly empty file or read error
+	if (content.empty() && body.st.st_size > 0)
+		return (serve500());
 	res.setBody(content);
 	return (res);
 }
 
-Response	Server::serveDirectory(const std::string& fs_path, const std::string& uri_path, const LocationConfig* location)
+// Escape a file name for HTML text and attribute values
+static std::string	htmlEscape(const std::string& str)
+{
+	std::string	out;
+
+	out.reserve(str.length());
+	for (size_t i = 0; i < str.length(); i++)
+	{
+		switch (str[i])
+		{
+			case '&': out += "&amp;"; break;
+			case '<': out += "&lt;"; break;
+			case '>': out += "&gt;"; break;
+			case '"': out += "&quot;"; break;
+			default: out += str[i]; break;
+		}
+	}
+	return (out);
+}
+
+// Percent-encode a file name for use in a link
+static std::string	urlEncode(const std::string& str)
+{
+	static const char	hex[] = "0123456789ABCDEF";
+	std::string			out;
+
+	out.reserve(str.length());
+	for (size_t i = 0; i < str.length(); i++)
+	{
+		unsigned char	c = str[i];
+
+		if (std::isalnum(c) || c == '-' || c == '_' || c == '.' || c == '~')
+			out += c;
+		else
+		{
+			out += '%';
+			out += hex[c >> 4];
+			out += hex[c & 15];
+		}
+	}
+	return (out);
+}
+
+// Directories first, then by name
+static bool	compareEntries(const DirectoryEntry& a, const DirectoryEntry& b)
+{
+	if (a.is_dir != b.is_dir)
+		return (a.is_dir);
+	return (a.name < b.name);
+}
+
+// Autoindex page for a directory; rendered pages are reused while the directory's
+// mtime is unchanged and for at most AUTOINDEX_CACHE_TTL seconds (entry sizes and
+// mtimes do not touch the directory itself). A page rendered within the same second
+// as the last change may have missed it (mtime granularity) and is never reused.
+const std::string*	Server::directoryListing(const std::string& fs_path, const std::string& uri_path)
+{
+	struct stat	dir_st;
+	time_t		now = std::time(NULL);
+	std::string	key = fs_path + '\n' + uri_path;
+
+	if (stat(fs_path.c_str(), &dir_st) != 0)
+		return (NULL);
+
+	std::map<std::string, DirectoryListing>::iterator	it = listing_cache.find(key);
+
+	if (it != listing_cache.end() && it->second.mtime == dir_st.st_mtime
+		&& it->second.rendered > it->second.mtime && now - it->second.rendered < AUTOINDEX_CACHE_TTL)
+		return (&it->second.html);
+
+	DIR*	dir = opendir(fs_path.c_str());
+
+	if (!dir)
+		return (NULL);
+
+	// One pass: readdir + fstatat relative to the open directory (no path rebuilding)
+	std::vector<DirectoryEntry>	entries;
+	struct dirent*				entry;
+	int							dir_fd = dirfd(dir);
+
+	while ((entry = readdir(dir)) != NULL)
+	{
+		DirectoryEntry	item;
+		struct stat		st;
+
+		item.name = entry->d_name;
+		if (item.name == "." || item.name == "..")
+			continue ;
+		item.is_dir = false;
+		item.size = 0;
+		item.mtime = 0;
+		if (fstatat(dir_fd, entry->d_name, &st, 0) == 0)
+		{
+			item.is_dir = S_ISDIR(st.st_mode);
+			item.size = st.st_size;
+			item.mtime = st.st_mtime;
+		}
+		entries.push_back(item);
+	}
+	closedir(dir);
+	std::sort(entries.begin(), entries.end(), compareEntries);
+
+	// Build base URI for links
+	std::string	base = uri_path;
+
+	if (!base.empty() && base[base.size() - 1] != '/')
+		base += '/';
+
+	// Appended piece by piece into one reserved buffer (~160 bytes per row)
+	std::string	title = htmlEscape(uri_path);
+	std::string	html;
+
+	html.reserve(1024 + entries.size() * 160);
+	html += "<!DOCTYPE html>\n<html>\n<head>\n";
+	html += "<title>Index of " + title + "</title>\n";
+	html += "<style>\n"
+		"body { font-family: Arial, sans-serif; margin: 40px; }\n"
+		"h1 { color: #333; }\n"
+		"table { border-collapse: collapse; }\n"
+		"td { padding: 5px 20px 5px 0; }\n"
+		"td.size { text-align: right; }\n"
+		"a { text-decoration: none; color: #0066cc; }\n"
+		"a:hover { text-decoration: underline; }\n"
+		"</style>\n";
+	html += "</head>\n<body>\n";
+	html += "<h1>Index of " + title + "</h1>\n";
+	html += "<table>\n<tr><td><a href=\"../\">../</a></td><td></td><td></td></tr>\n";
+	for (size_t i = 0; i < entries.size(); i++)
+	{
+		const DirectoryEntry&	item = entries[i];
+		std::string				suffix = item.is_dir ? "/" : "";
+		char					date[32];
+		struct tm				tm_utc;
+
+		gmtime_r(&item.mtime, &tm_utc);
+		std::strftime(date, sizeof(date), "%d-%b-%Y %H:%M", &tm_utc);
+		html += "<tr><td><a href=\"" + htmlEscape(base + urlEncode(item.name)) + suffix + "\">";
+		html += htmlEscape(item.name) + suffix + "</a></td><td>";
+		html += date;
+		html += "</td><td class=\"size\">";
+		if (item.is_dir)
+			html += "-";
+		else
+		{
+			std::ostringstream	size;
+
+			size << item.size;
+			html += size.str();
+		}
+		html += "</td></tr>\n";
+	}
+	html += "</table>\n</body>\n</html>";
+
+	// Bounded: drop an arbitrary entry when full
+	if (it == listing_cache.end() && listing_cache.size() >= AUTOINDEX_CACHE_ENTRIES)
+		listing_cache.erase(listing_cache.begin());
+
+	DirectoryListing&	listing = listing_cache[key];
+
+	listing.mtime = dir_st.st_mtime;
+	listing.rendered = now;
+	listing.html.swap(html);
+	return (&listing.html);
+}
+
+Response	Server::serveDirectory(const Request& req, const std::string& fs_path, const std::string& uri_path, const LocationConfig* location)
 {
 	// Try to serve index file
 	std::string	index_path = fs_path;
@@ -186,80 +838,29 @@ Response	Server::serveDirectory(const std::string& fs_path, const std::string& u
 		index_file = location->index;
 	index_path += index_file;
 	if (fileExists(index_path))
-		return (serveFile(index_path, location));
+		return (serveFile(req, index_path, location));
 
 	// If autoindex is enabled, show directory listing
 	if (location && location->autoindex)
 	{
+		const std::string*	html = directoryListing(fs_path, uri_path);
+
+		if (!html)
+			return (serve500());
+
 		Response	res;
 
 		res.setStatus(200, "OK");
 		res.setHeader("Content-Type", "text/html");
-
-		// Build base URI for links
-		std::string	base = uri_path;
-		if (!base.empty() && base[base.size() - 1] != '/')
-			base += '/';
-
-		// Generate directory listing HTML
-		std::ostringstream	html;
-
-		html << "<!DOCTYPE html>\n";
-		html << "<html>\n<head>\n";
-		html << "<title>Index of " << uri_path << "</title>\n";
-		html << "<style>\n";
-		html << "body { font-family: Arial, sans-serif; margin: 40px; }\n";
-		html << "h1 { color: #333; }\n";
-		html << "ul { list-style: none; padding: 0; }\n";
-		html << "li { padding: 5px; }\n";
-		html << "a { text-decoration: none; color: #0066cc; }\n";
-		html << "a:hover { text-decoration: underline; }\n";
-		html << "</style>\n";
-		html << "</head>\n<body>\n";
-		html << "<h1>Index of " << uri_path << "</h1>\n";
-		html << "<ul>\n";
-
-		// Read directory contents
-		DIR*	dir = opendir(fs_path.c_str());
-
-		if (dir)
-		{
-			struct dirent*	entry;
-
-			while ((entry = readdir(dir)) != NULL)
-			{
-				std::string	name = entry->d_name;
-
-				// Skip . but show ..
-				if (name == ".")
-					continue ;
-
-				std::string	href;
-				if (name == "..")
-					href = "../";
-				else
-				{
-					href = base + name;
-					if (entry->d_type == DT_DIR)
-						href += "/";
-				}
-
-				html << "<li><a href=\"" << href << "\">" << name;
-				if (entry->d_type == DT_DIR)
-					html << "/";
-				html << "</a></li>\n";
-			}
-			closedir(dir);
-		}
-		html << "</ul>\n</body>\n</html>";
-		res.setBody(html.str());
+		res.setBody(*html);
 		return (res);
 	}
 	// No index file and autoindex disabled = 404 Not Found
 	return (serve404());
 }
 
-Response	Server::serveErrorPage(int code, const std::string& message)
+// Build an error response, from the configured error_page file if there is one
+Response	Server::buildErrorPage(int code, const std::string& message)
 {
 	Response	res;
 
@@ -280,6 +881,7 @@ Response	Server::serveErrorPage(int code, const std::string& message)
 			res.setBody(content);
 			return (res);
 		}
+		std::cerr << "Warning: error_page " << code << " " << error_page_path << " not found, using the built-in page" << std::endl;
 	}
 
 	// Default error page
@@ -295,6 +897,30 @@ Response	Server::serveErrorPage(int code, const std::string& message)
 	return (res);
 }
 
+// Error pages are built once per server block (a reload builds new servers,
+// so edited error_page files are picked up on SIGHUP)
+void	Server::loadErrorPages()
+{
+	static const int	codes[] = {400, 403, 404, 405, 413, 416, 500, 501, 505};
+
+	for (size_t i = 0; i < sizeof(codes) / sizeof(codes[0]); i++)
+		error_responses[codes[i]] = buildErrorPage(codes[i], Response::reasonPhrase(codes[i]));
+	for (std::map<int, std::string>::const_iterator it = config.error_pages.begin(); it != config.error_pages.end(); ++it)
+	{
+		if (error_responses.find(it->first) == error_responses.end())
+			error_responses[it->first] = buildErrorPage(it->first, Response::reasonPhrase(it->first));
+	}
+}
+
+Response	Server::serveErrorPage(int code, const std::string& message)
+{
+	std::map<int, Response>::const_iterator	it = error_responses.find(code);
+
+	if (it != error_responses.end())
+		return (it->second);
+	return (buildErrorPage(code, message));
+}
+
 Response	Server::serve404()
 {
 	return (serveErrorPage(404, "Not Found"));
@@ -363,31 +989,75 @@ std::string	Server::readFile(const std::string& path)
 	return (buffer.str());
 }
 
-bool	Server::fileExists(const std::string& path)
+// Read through the cached descriptor when there is one (no path lookup, no open)
+std::string	Server::readFile(const std::string& path, const FileInfo& info)
 {
-	struct stat	buffer;
+	if (info.fd < 0)
+		return (readFile(path));
 
-	return (stat(path.c_str(), &buffer) == 0);
+	std::string	content(info.st.st_size, '\0');
+	size_t		done = 0;
+
+	while (done < content.size())
+	{
+		ssize_t	bytes_read = pread(info.fd, &content[done], content.size() - done, done);
+
+		// Shrank since it was stat()ed: read whatever the path holds now
+		if (bytes_read <= 0)
+			return (readFile(path));
+		done += bytes_read;
+	}
+	return (content);
 }
 
-bool	Server::isDirectory(const std::string& path)
+// Descriptor for a file body; the response owns (and closes) it.
+// Close-on-exec like the cached ones, so CGI children do not inherit it.
+int	Server::openBody(const std::string& path, const FileInfo& info)
 {
-	struct stat	buffer;
+	if (info.fd >= 0)
+		return (fcntl(info.fd, F_DUPFD_CLOEXEC, 0));
+	return (open(path.c_str(), O_RDONLY | O_CLOEXEC));
+}
 
-	if (stat(path.c_str(), &buffer) != 0)
-		return (false);
-	return (S_ISDIR(buffer.st_mode));
+// Shared mapping of a file, remapped when the file changed; NULL if mmap fails
+MappedFile*	Server::mapFile(const std::string& path, const FileInfo& info)
+{
+	std::map<std::string, MappedFile*>::iterator	it = mappings.find(path);
+
+	if (it != mappings.end())
+	{
+		if (it->second->matches(info.st))
+			return (it->second);
+		mapped_bytes -= it->second->getLength();
+		it->second->release();
+		mappings.erase(it);
+	}
+	// Bounded: drop arbitrary entries when full (in-flight responses keep theirs alive)
+	while (!mappings.empty() && mapped_bytes + info.st.st_size > MMAP_CACHE_SIZE)
+	{
+		mapped_bytes -= mappings.begin()->second->getLength();
+		mappings.begin()->second->release();
+		mappings.erase(mappings.begin());
+	}
+
+	int			fd = (info.fd >= 0) ? info.fd : open(path.c_str(), O_RDONLY | O_CLOEXEC);
+	MappedFile*	map = MappedFile::map(fd, info.st);
+
+	// The mapping stays valid after its descriptor is closed
+	if (info.fd < 0 && fd >= 0)
+		close(fd);
+	if (!map)
+		return (NULL);
+	mappings[path] = map;
+	mapped_bytes += map->getLength();
+	return (map);
 }
 
-bool	Server::writeFile(const std::string& path, const std::string& content)
+bool	Server::fileExists(const std::string& path)
 {
-	std::ofstream	file(path.c_str(), std::ios::binary);
+	struct stat	buffer;
 
-	if (!file.is_open())
-		return (false);
-	file.write(content.c_str(), content.length());
-	file.close();
-	return (file.good());
+	return (stat(path.c_str(), &buffer) == 0);
 }
 
 Response	Server::serve413()
@@ -395,6 +1065,16 @@ Response	Server::serve413()
 	return (serveErrorPage(413, "Payload Too Large"));
 }
 
+Response	Server::serve416(off_t size)
+{
+	Response			res = serveErrorPage(416, "Range Not Satisfiable");
+	std::ostringstream	content_range;
+
+	content_range << "bytes */" << size;
+	res.setHeader("Content-Range", content_range.str());
+	return (res);
+}
+
 std::string	Server::getUploadPath(const LocationConfig* location) const
 {
 	if (location && !location->upload_store.empty())
@@ -402,29 +1082,30 @@ std::string	Server::getUploadPath(const LocationConfig* location) const
 	return (config.root + "/uploads");
 }
 
+// Unique per process (counter) and across processes and restarts (pid, time in microseconds).
+// The worker still creates the file with O_EXCL, so a collision can never overwrite.
 std::string	Server::generateFilename() const
 {
-	std::ostringstream	oss;
+	static unsigned long	counter = 0;
+	struct timeval			now;
+	std::ostringstream		oss;
 
-	oss << "upload_" << std::time(NULL) << "_" << (std::rand() % 10000);
+	gettimeofday(&now, NULL);
+	oss << "upload_" << now.tv_sec << "_" << now.tv_usec << "_" << getpid() << "_" << counter++;
 	return (oss.str());
 }
 
-bool	Server::isCGIRequest(const Request& req, CGIInfo& info)
+bool	Server::isCGIRequest(Request& req, CGIInfo& info)
 {
 	// Find matching location
-	const LocationConfig*	location = findLocation(req.getPath());
+	const LocationConfig*	location = resolveLocation(req);
 
 	// Check for CGI handlers
 	if (!location || location->cgi_handlers.empty())
 		return (false);
 	
 	// Extract file extension from path
-	std::string	path = req.getPath();
-	size_t		query_pos = path.find('?');
-
-	if (query_pos != std::string::npos)
-		path = path.substr(0, query_pos);
+	std::string	path = req.getUriPath();
 
 	// Check each registered CGI extension
 	for (std::map<std::string, std::string>::const_iterator it = location->cgi_handlers.begin(); it != location->cgi_handlers.end(); ++it)
@@ -441,10 +1122,14 @@ bool	Server::isCGIRequest(const Request& req, CGIInfo& info)
 	return (false);
 }
 
-Response	Server::handleNonCGIRequest(const Request& req)
+// Uploads and DELETE that reach the disk return an empty response and set `job`;
+// the caller runs it and builds the real response with finishDiskJob
+Response	Server::handleNonCGIRequest(Request& req, DiskJob*& job)
 {
+	job = NULL;
+
 	// Find matching location
-	const LocationConfig*	location = findLocation(req.getPath());
+	const LocationConfig*	location = resolveLocation(req);
 
 	// Check for HTTP redirection first
 	if (location && location->redirect_code > 0 && !location->redirect_url.empty())
@@ -472,43 +1157,44 @@ Response	Server::handleNonCGIRequest(const Request& req)
 
 	// Handle POST requests (non-CGI)
 	if (req.getMethod() == "POST")
-		return (handlePost(req, location));
+		return (handlePost(req, location, job));
 
 	// Handle DELETE requests
 	if (req.getMethod() == "DELETE")
-		return (handleDelete(req, location));
+		return (handleDelete(req, location, job));
 
 	// Build file path for GET
 	std::string	file_path = buildFilePath(req.getPath(), location);
+	FileInfo	info;
 
 	// Check if path exist
-	if (!fileExists(file_path))
+	if (!open_files.lookup(file_path, info))
 		return (serve404());
 	
 	// Check if it's a directory
-	if (isDirectory(file_path))
+	if (S_ISDIR(info.st.st_mode))
 	{
 		std::string uri = req.getPath();
 		if (!uri.empty() && uri[uri.size() - 1] != '/')
 			return (serveRedirect(301, uri + "/"));
-		return (serveDirectory(file_path, req.getPath(), location));
+		return (serveDirectory(req, file_path, req.getPath(), location));
 	}
 
 	// It's a file, serve it
-	return (serveFile(file_path, location));
+	return (serveFile(req, file_path, location));
 }
 
-Response	Server::handlePost(const Request& req, const LocationConfig* location)
+Response	Server::handlePost(const Request& req, const LocationConfig* location, DiskJob*& job)
 {
 	// Check if this is a multipart upload
 	if (req.isMultipart())
-		return (handleMultipartUpload(req, location));
+		return (handleMultipartUpload(req, location, job));
 
 	// Handle raw POST data (application/x-www-form-urlencoded or raw file)
-	return (handleRawUpload(req, location));
+	return (handleRawUpload(req, location, job));
 }
 
-Response	Server::handleMultipartUpload(const Request& req, const LocationConfig* location)
+Response	Server::handleMultipartUpload(const Request& req, const LocationConfig* location, DiskJob*& job)
 {
 	// Parse multipart data
 	Request&	mutable_req = const_cast<Request&>(req);
@@ -537,14 +1223,11 @@ Response	Server::handleMultipartUpload(const Request& req, const LocationConfig*
 	}
 
 	const std::vector<MultipartPart>&	parts = req.getParts();
-	std::string							upload_dir = getUploadPath(location);
-
-	// Create upload directory if it doesn't exist
-	mkdir(upload_dir.c_str(), 0755);
 
-	int							files_saved = 0;
-	std::vector<std::string>	saved_files;
-	
+	job = new DiskJob(DISK_UPLOAD);
+	job->directory = getUploadPath(location);
+	job->unique_names = true;
+	job->location_uri = uploadLocationUri(location);
 	for (size_t i = 0; i < parts.size(); i++)
 	{
 		const MultipartPart&	part = parts[i];
@@ -556,41 +1239,15 @@ Response	Server::handleMultipartUpload(const Request& req, const LocationConfig*
 			continue ;
 		if (part.data.empty())
 			continue ;
-
-		// Generate unique filename if file already exists
-		std::string	base_path = upload_dir + "/" + part.filename;
-		std::string	file_path = base_path;
-		int			suffix = 1;
-		struct stat	st;
-
-		while (stat(file_path.c_str(), &st) == 0)
-		{
-			// File exists, add suffix
-			size_t				dot_pos = part.filename.find_last_of('.');
-			std::ostringstream	new_name;
-
-			if (dot_pos != std::string::npos)
-				new_name << upload_dir << "/" << part.filename.substr(0, dot_pos) << "_" << suffix << part.filename.substr(dot_pos);
-			else
-				new_name << upload_dir << "/" << part.filename << "_" << suffix;
-			file_path = new_name.str();
-			suffix++;
-		}
-		if (writeFile(file_path, part.data))
-		{
-			files_saved++;
-
-			// Extract just the filename from the path
-			size_t		last_slash = file_path.find_last_of('/');
-			std::string	saved_name = (last_slash != std::string::npos) ? file_path.substr(last_slash + 1) : file_path;
-
-			saved_files.push_back(saved_name);
-		}
-		else
-			return (serve500());
+		job->files.push_back(DiskFile());
+		job->files.back().name = part.filename;
+		job->files.back().data = part.data;
 	}
-	if (files_saved == 0)
+	if (job->files.empty())
 	{
+		delete job;
+		job = NULL;
+
 		Response	res;
 
 		res.setStatus(400, "Bad Request");
@@ -598,31 +1255,25 @@ Response	Server::handleMultipartUpload(const Request& req, const LocationConfig*
 		res.setBody("{\"status\":\"error\",\"message\":\"No files found in upload. Make sure the form field is a file input.\"}");
 		return (res);
 	}
+	// The files are written by the disk I/O pool, see finishDiskJob
+	return (Response());
+}
 
-	// Return 201 Created with Location header (nginx-like behavior)
-	Response	res;
-	res.setStatus(201, "Created");
-	res.setHeader("Content-Length", "0");
-
-	// Build Location header from the first uploaded file
-	std::string	location_path;
+// URI under which uploaded files are reachable (for the Location header)
+std::string	Server::uploadLocationUri(const LocationConfig* location) const
+{
 	if (location && !location->upload_store.empty())
 	{
 		// Derive URI path from upload_store relative to server root
 		std::string	store = location->upload_store;
+
 		if (store.find(config.root) == 0)
-			location_path = store.substr(config.root.length());
-		else
-			location_path = "/uploads";
+			return (store.substr(config.root.length()));
 	}
-	else
-		location_path = "/uploads";
-	if (!saved_files.empty())
-		res.setHeader("Location", location_path + "/" + saved_files[0]);
-	return (res);
+	return ("/uploads");
 }
 
-Response	Server::handleRawUpload(const Request& req, const LocationConfig* location)
+Response	Server::handleRawUpload(const Request& req, const LocationConfig* location, DiskJob*& job)
 {
 	std::string	body = req.getBody();
 
@@ -637,8 +1288,6 @@ Response	Server::handleRawUpload(const Request& req, const LocationConfig* locat
 	}
 	
 	std::string	upload_dir = getUploadPath(location);
-
-	mkdir(upload_dir.c_str(), 0755);
 	
 	// Generate filename based on Content-Type or use generic
 	std::string	filename = generateFilename();
@@ -660,39 +1309,52 @@ Response	Server::handleRawUpload(const Request& req, const LocationConfig* locat
 	else
 		filename += ".bin";
 
-	std::string	file_path = upload_dir + "/" + filename;
+	job = new DiskJob(DISK_UPLOAD);
+	job->directory = upload_dir;
+	job->unique_names = true;
+	job->location_uri = uploadLocationUri(location);
+	job->files.push_back(DiskFile());
+	job->files.back().name = filename;
+	job->files.back().data.swap(body);
+	return (Response());
+}
 
-	if (!writeFile(file_path, body))
+// Build the response for a finished disk job (runs in the event loop)
+Response	Server::finishDiskJob(const DiskJob& job)
+{
+	if (job.operation == DISK_DELETE)
+		open_files.invalidate(job.path);
+	for (size_t i = 0; i < job.files.size(); i++)
+	{
+		if (!job.files[i].saved.empty())
+			open_files.invalidate(job.directory + "/" + job.files[i].saved);
+	}
+	if (job.status == 404)
+		return (serve404());
+	if (job.status == 403)
+		return (serve403());
+	if (job.status != 0)
 		return (serve500());
 
-	// Return 201 Created with Location header (nginx-like behavior)
 	Response	res;
-	res.setStatus(201, "Created");
-	res.setHeader("Content-Length", "0");
 
-	std::string	location_path;
-	if (location && !location->upload_store.empty())
+	if (job.operation == DISK_DELETE)
 	{
-		std::string	store = location->upload_store;
-		if (store.find(config.root) == 0)
-			location_path = store.substr(config.root.length());
-		else
-			location_path = "/uploads";
+		// Return 204 No Content (nginx-like behavior)
+		res.setStatus(204, "No Content");
+		res.setHeader("Content-Length", "0");
+		return (res);
 	}
-	else
-		location_path = "/uploads";
-	res.setHeader("Location", location_path + "/" + filename);
-	return (res);
-}
 
-bool	Server::deleteFile(const std::string& path)
-{
-	if (remove(path.c_str()) == 0)
-		return (true);
-	return (false);
+	// Return 201 Created with Location header (nginx-like behavior)
+	res.setStatus(201, "Created");
+	res.setHeader("Content-Length", "0");
+	// Location of the first uploaded file
+	res.setHeader("Location", job.location_uri + "/" + job.files[0].saved);
+	return (res);
 }
 
-Response	Server::handleDelete(const Request& req, const LocationConfig* location)
+Response	Server::handleDelete(const Request& req, const LocationConfig* location, DiskJob*& job)
 {
 	std::string	file_path;
 
@@ -700,31 +1362,16 @@ Response	Server::handleDelete(const Request& req, const LocationConfig* location
 	if (location && !location->upload_store.empty())
 	{
 		// Extract filename from URI (remove location prefix)
-		std::string	uri = req.getPath();
-		std::string	filename;
+		std::string	filename = location->relativeUri(req.getPath());
 
-		if (uri.find(location->path) == 0)
-		{
-			filename = uri.substr(location->path.length());
-			// Remove leading slash if present
-			if (!filename.empty() && filename[0] == '/')
-				filename = filename.substr(1);
-		}
-		else
-			filename = uri;
+		// Remove leading slash if present
+		if (!filename.empty() && filename[0] == '/')
+			filename = filename.substr(1);
 		file_path = location->upload_store + "/" + filename;
 	}
 	else
 		file_path = buildFilePath(req.getPath(), location);	// Fall back to regular file path building
 
-	// Check if file exists
-	if (!fileExists(file_path))
-		return (serve404());
-
-	// Don't allow deleting directories (for safety)
-	if (isDirectory(file_path))
-		return (serve403());
-
 	// Security check: ensure we're only deleting within allowed paths
 	std::string	upload_dir = getUploadPath(location);
 	std::string	root = config.root;
@@ -736,13 +1383,8 @@ Response	Server::handleDelete(const Request& req, const LocationConfig* location
 	if (!in_root && !in_upload)
 		return (serve403());
 
-	// Attempt to delete the file
-	if (!deleteFile(file_path))
-		return (serve500());
-
-	// Return 204 No Content (nginx-like behavior)
-	Response	res;
-	res.setStatus(204, "No Content");
-	res.setHeader("Content-Length", "0");
-	return (res);
+	// Existence checks and the remove() itself run on the disk I/O pool
+	job = new DiskJob(DISK_DELETE);
+	job->path = file_path;
+	return (Response());
 }
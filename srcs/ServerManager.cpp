@@ -3,188 +3,643 @@
 #include <iostream>
 #include <unistd.h>
 #include <sys/socket.h>
+#include <netinet/in.h>
+#include <netinet/tcp.h>
+#include <arpa/inet.h>
 #include <sys/wait.h>
 #include <sys/stat.h>
 #include <signal.h>
 #include <fcntl.h>
 #include <sstream>
+#include <cerrno>
+#include <cstdlib>
+#include <algorithm>
 
-ServerManager::ServerManager() {}
+// Hold back partial frames while a response is being written, flush on release.
+// Linux calls this TCP_CORK, BSD/macOS TCP_NOPUSH.
+static void	setCork(int fd, bool on)
+{
+	int	opt = on ? 1 : 0;
+
+#if defined(TCP_CORK)
+	setsockopt(fd, IPPROTO_TCP, TCP_CORK, &opt, sizeof(opt));
+#elif defined(TCP_NOPUSH)
+	setsockopt(fd, IPPROTO_TCP, TCP_NOPUSH, &opt, sizeof(opt));
+#else
+	(void)fd;
+	(void)opt;
+#endif
+}
+
+// Zero-timeout poll() on one socket: writes past the first of an event still wait for readiness
+static bool	socketWritable(int fd)
+{
+	struct pollfd	pfd;
+
+	pfd.fd = fd;
+	pfd.events = POLLOUT;
+	pfd.revents = 0;
+	return (poll(&pfd, 1, 0) == 1 && (pfd.revents & POLLOUT));
+}
+
+// Numeric peer address for the access log
+static std::string	peerAddress(const struct sockaddr_storage& peer)
+{
+	char	text[INET6_ADDRSTRLEN];
+
+	if (peer.ss_family == AF_INET)
+		inet_ntop(AF_INET, &reinterpret_cast<const struct sockaddr_in*>(&peer)->sin_addr, text, sizeof(text));
+	else if (peer.ss_family == AF_INET6)
+		inet_ntop(AF_INET6, &reinterpret_cast<const struct sockaddr_in6*>(&peer)->sin6_addr, text, sizeof(text));
+	else
+		return ("unix:");
+	return (text);
+}
+
+// "ip:port" / "[v6]:port", the form of ServerConfig::listenAddress() for a numeric host
+static std::string	socketAddress(const struct sockaddr_storage& addr)
+{
+	std::ostringstream	oss;
+
+	if (addr.ss_family == AF_INET)
+		oss << peerAddress(addr) << ":" << ntohs(reinterpret_cast<const struct sockaddr_in*>(&addr)->sin_port);
+	else if (addr.ss_family == AF_INET6)
+		oss << "[" << peerAddress(addr) << "]:" << ntohs(reinterpret_cast<const struct sockaddr_in6*>(&addr)->sin6_port);
+	return (oss.str());
+}
+
+static bool	isWildcardAddress(const std::string& address)
+{
+	return (address.compare(0, 8, "0.0.0.0:") == 0 || address.compare(0, 5, "[::]:") == 0);
+}
+
+// Buffer capacity held by a connection (what it costs, not just the bytes in use)
+static ConnectionMemory	measureMemory(const ClientState& state)
+{
+	ConnectionMemory	memory;
+
+	memory.bytes[MEMORY_REQUEST_RAW] = state.request.rawBytes();
+	memory.bytes[MEMORY_REQUEST_BODY] = state.request.bodyBytes();
+	memory.bytes[MEMORY_MULTIPART] = state.request.multipartBytes();
+	memory.bytes[MEMORY_RESPONSE] = state.output.memoryBytes();
+	memory.bytes[MEMORY_CGI_INPUT] = state.cgi_input.capacity();
+	memory.bytes[MEMORY_CGI_OUTPUT] = state.cgi_output.capacity();
+	memory.bytes[MEMORY_UPSTREAM] = state.proxy ? state.proxy->memoryBytes() : 0;
+	return (memory);
+}
+
+volatile sig_atomic_t	ServerManager::reload_requested = 0;
+volatile sig_atomic_t	ServerManager::memory_dump_requested = 0;
+volatile sig_atomic_t	ServerManager::stop_requested = 0;
+
+ServerGeneration::~ServerGeneration()
+{
+	for (size_t i = 0; i < servers.size(); i++)
+		delete servers[i];
+	// Writes out whatever is still buffered
+	for (std::map<std::string, AccessLog*>::iterator it = access_logs.begin(); it != access_logs.end(); ++it)
+		delete it->second;
+	// Closes the pooled keep-alive connections
+	for (std::map<std::string, Upstream*>::iterator it = upstreams.begin(); it != upstreams.end(); ++it)
+		delete it->second;
+}
+
+ServerManager::ServerManager() : current(NULL), disk_io_threads(0), buffer_budget(0), reads_paused(false) {}
 
 ServerManager::~ServerManager()
 {
 	stop();
 }
 
-bool    ServerManager::initServers(const std::vector<ServerConfig>& configs)
+// Build servers and lookup tables for a configuration. Listening sockets whose
+// address is unchanged are taken over from the current generation instead of
+// being bound again. Returns NULL (leaving the current generation untouched) on failure.
+ServerGeneration*	ServerManager::createGeneration(const std::vector<ServerConfig>& configs,
+	const std::map<std::string, UpstreamConfig>& upstreams)
 {
-	// Track which ports have been bound (for virtual hosting support)
-	std::map<int, int>  port_to_server_index;
-	
-	// Create and start each server
+	ServerGeneration*		generation = new ServerGeneration();
+	std::set<std::string>	wildcards;
+
 	for (size_t i = 0; i < configs.size(); i++)
 	{
-		int	port = configs[i].port;
-		
-		// Check if this port is already bound by another server
-		if (port_to_server_index.find(port) != port_to_server_index.end())
-		{
-			// Port already in use - this is virtual hosting
-			Server*	server = new Server(configs[i]);
-			servers.push_back(server);
-			
-			// Map to the same fd as the first server on this port
-			int	first_server_idx = port_to_server_index[port];
-			int	shared_fd = servers[first_server_idx]->getServerFd();
-
-			fd_to_server[shared_fd] = first_server_idx;
-			continue ;
+		if (isWildcardAddress(configs[i].listenAddress()))
+			wildcards.insert(configs[i].listenAddress());
+	}
+	for (size_t i = 0; i < configs.size(); i++)
+	{
+		std::string	address = configs[i].listenAddress();
+		Server*		server = new Server(configs[i]);
+
+		generation->servers.push_back(server);
+		addVirtualHost(*generation, i);
+
+		// A specific address on a port that also has a wildcard listener cannot be bound
+		// next to it: the wildcard socket accepts for it, as in nginx (see handleNewConnection)
+		struct sockaddr_storage	bound;
+		socklen_t				bound_len;
+
+		if (!wildcards.empty() && !isWildcardAddress(address) && !server->isUnixSocket()
+			&& server->resolveListenAddress(bound, bound_len))
+		{
+			std::ostringstream	wildcard;
+
+			wildcard << (bound.ss_family == AF_INET6 ? "[::]" : "0.0.0.0") << ":" << configs[i].port;
+			if (wildcards.count(wildcard.str()))
+			{
+				generation->shared.insert(std::make_pair(socketAddress(bound), static_cast<int>(i)));
+				continue ;
+			}
 		}
 
-		// New port - create and bind
-		Server*	server = new Server(configs[i]);
+		// Address already in use - this is virtual hosting, share the first server's socket
+		if (generation->listeners.find(address) != generation->listeners.end())
+			continue ;
+		generation->listeners[address] = i;
+
+		// Same address in the running configuration: reuse its socket
+		if (current && current->listeners.find(address) != current->listeners.end())
+		{
+			server->adoptListener(current->servers[current->listeners[address]]->getServerFd());
+			continue ;
+		}
 
+		// New address - create and bind
 		if (!server->start())
 		{
-			std::cerr << "Failed to start server on port " << port << std::endl;
-			delete server;
-			return false;
+			std::cerr << "Failed to start server on " << address << std::endl;
+			discardGeneration(generation);
+			return (NULL);
+		}
+	}
+	if (!openAccessLogs(*generation) || !openUpstreams(*generation, upstreams))
+	{
+		discardGeneration(generation);
+		return (NULL);
+	}
+	return (generation);
+}
+
+// Undo a generation that failed to start
+void	ServerManager::discardGeneration(ServerGeneration* generation)
+{
+	// Give inherited sockets back before the servers are deleted
+	for (std::map<std::string, int>::iterator it = generation->listeners.begin(); it != generation->listeners.end(); ++it)
+	{
+		if (current && current->listeners.find(it->first) != current->listeners.end())
+			generation->servers[it->second]->releaseListener();
+	}
+	delete generation;
+}
+
+// One AccessLog per path, shared by every server block writing to it.
+// Reopened by every reload, which is also how log files are rotated (SIGHUP).
+bool	ServerManager::openAccessLogs(ServerGeneration& generation)
+{
+	for (size_t i = 0; i < generation.servers.size(); i++)
+	{
+		Server*					server = generation.servers[i];
+		const AccessLogConfig&	config = server->getConfig().access_log;
+
+		if (config.path == "off")
+			continue ;
+
+		std::map<std::string, AccessLog*>::iterator	it = generation.access_logs.find(config.path);
+
+		if (it == generation.access_logs.end())
+		{
+			AccessLog*	log = new AccessLog();
+
+			it = generation.access_logs.insert(std::make_pair(config.path, log)).first;
+			if (!log->open(config.path))
+			{
+				std::cerr << "Error: Cannot open access log " << config.path << std::endl;
+				return (false);
+			}
+		}
+		it->second->configure(config.buffer, config.flush);
+		server->setAccessLog(it->second);
+	}
+	return (true);
+}
+
+// One Upstream per upstream block (and per proxy_pass host:port). Addresses are
+// resolved here, so a name that does not resolve fails the (re)load, not a request.
+bool	ServerManager::openUpstreams(ServerGeneration& generation, const std::map<std::string, UpstreamConfig>& upstreams)
+{
+	for (std::map<std::string, UpstreamConfig>::const_iterator it = upstreams.begin(); it != upstreams.end(); ++it)
+	{
+		Upstream*	upstream = new Upstream(it->first, it->second);
+		std::string	error;
+
+		generation.upstreams[it->first] = upstream;
+		if (!upstream->resolve(it->second, error))
+		{
+			std::cerr << "Error: upstream " << it->first << ": " << error << std::endl;
+			return (false);
+		}
+	}
+	return (true);
+}
+
+// Make a freshly created generation the one new connections and requests use
+void	ServerManager::activateGeneration(ServerGeneration* generation)
+{
+	ServerGeneration*	previous = current;
+
+	if (previous)
+	{
+		// Close sockets for addresses that are gone; release the ones that were taken over
+		for (std::map<std::string, int>::iterator it = previous->listeners.begin(); it != previous->listeners.end(); ++it)
+		{
+			Server*	server = previous->servers[it->second];
+			int		fd = server->getServerFd();
+
+			if (generation->listeners.find(it->first) != generation->listeners.end())
+				server->releaseListener();
+			else
+			{
+				removePollFd(fd);
+				server_fds.erase(fd);
+				server->stop();
+				std::cout << "[Server] " << it->first << " closed" << std::endl;
+			}
+			fd_to_server.erase(fd);
+		}
+	}
+	current = generation;
+	for (std::map<std::string, int>::iterator it = generation->listeners.begin(); it != generation->listeners.end(); ++it)
+	{
+		int	fd = generation->servers[it->second]->getServerFd();
+
+		if (server_fds.find(fd) == server_fds.end())
+		{
+			server_fds.insert(fd);
+			addPollFd(fd, POLLIN);
+		}
+		fd_to_server[fd] = it->second;
+	}
+	if (!previous)
+		return ;
+
+	// Idle keep-alive connections switch right away; busy ones finish on the old configuration
+	retired.push_back(previous);
+	std::vector<int>	to_close;
+
+	for (std::map<int, ClientState>::iterator it = client_states.begin(); it != client_states.end(); ++it)
+	{
+		ClientState&	state = it->second;
+
+		if (state.response_ready || state.cgi_in_progress || state.proxy || state.request.hasPendingData())
+			continue ;
+		if (!rebindClient(state))
+			to_close.push_back(it->first);
+	}
+	for (size_t i = 0; i < to_close.size(); i++)
+		closeClient(to_close[i]);
+	releaseGeneration(previous);	// No-op while connections still use it
+}
+
+// Attach a connection to a generation, keeping reference counts in sync
+void	ServerManager::bindClient(ClientState& state, ServerGeneration* generation, int server_index)
+{
+	ServerGeneration*	previous = state.generation;
+
+	state.generation = generation;
+	state.server_index = server_index;
+	if (generation)
+		generation->connections++;
+	if (previous)
+	{
+		previous->connections--;
+		releaseGeneration(previous);
+	}
+}
+
+// Move a connection that finished its request onto the current configuration.
+// Returns false if its listen address no longer exists (caller closes it).
+bool	ServerManager::rebindClient(ClientState& state)
+{
+	if (state.generation == current)
+		return (true);
+
+	std::string									address = listeningServer(state)->getListenAddress();
+	std::map<std::string, int>::const_iterator	it = current->listeners.find(address);
+
+	if (it != current->listeners.end())
+	{
+		bindClient(state, current, it->second);
+		return (true);
+	}
+	// Accepted by a wildcard socket on behalf of the address
+	for (it = current->shared.begin(); it != current->shared.end(); ++it)
+	{
+		if (current->servers[it->second]->getListenAddress() == address)
+		{
+			bindClient(state, current, it->second);
+			return (true);
 		}
-		servers.push_back(server);
-		port_to_server_index[port] = i;
+	}
+	return (false);
+}
+
+// Free a retired generation once its last connection is gone
+void	ServerManager::releaseGeneration(ServerGeneration* generation)
+{
+	for (size_t i = 0; i < retired.size(); i++)
+	{
+		if (retired[i] == generation)
+		{
+			if (generation->connections > 0)
+				return ;
+			retired.erase(retired.begin() + i);
+			delete generation;
+			return ;
+		}
+	}
+}
+
+bool    ServerManager::initServers(const std::vector<ServerConfig>& configs, const GlobalConfig& global)
+{
+	ServerGeneration*	generation = createGeneration(configs, global.upstreams);
 
-		// Add server socket to poll
-		int	server_fd = server->getServerFd();
+	if (!generation)
+		return (false);
+	activateGeneration(generation);
 
-		addPollFd(server_fd, POLLIN);
-		fd_to_server[server_fd] = i;
-		server_fds.insert(server_fd);
+	// Blocking file operations run on worker threads and complete through a pipe in poll()
+	disk_io_threads = global.disk_io_threads;
+	if (disk_io_threads > 0)
+	{
+		if (disk_pool.start(disk_io_threads))
+			addPollFd(disk_pool.getNotifyFd(), POLLIN);
+		else
+			std::cerr << "Warning: disk I/O threads unavailable, file operations run in the event loop" << std::endl;
 	}
-	std::cout << "Webserv ready - listening on " << servers.size() << " server(s)" << std::endl;
+	profiler.setThreshold(global.slow_loop_threshold * 1000ULL);
+	buffer_budget = global.buffer_budget;
+	metrics.setBufferBudget(buffer_budget);
+	std::cout << "Webserv ready - listening on " << generation->servers.size() << " server(s)" << std::endl;
 	return (true);
 }
 
+// Re-read the configuration file (SIGHUP). On any error the running configuration stays active.
+void	ServerManager::reload()
+{
+	reload_requested = 0;
+	std::cout << "Reloading configuration from " << config_file << std::endl;
+
+	Config	config;
+
+	if (config_file.empty() || !config.parse(config_file))
+	{
+		std::cerr << "Reload failed: keeping current configuration" << std::endl;
+		return ;
+	}
+
+	ServerGeneration*	generation = createGeneration(config.getServers(), config.getGlobal().upstreams);
+
+	if (!generation)
+	{
+		std::cerr << "Reload failed: keeping current configuration" << std::endl;
+		return ;
+	}
+	if (config.getGlobal().disk_io_threads != disk_io_threads)
+		std::cerr << "Warning: disk_io_threads change needs a restart" << std::endl;
+	profiler.setThreshold(config.getGlobal().slow_loop_threshold * 1000ULL);
+	buffer_budget = config.getGlobal().buffer_budget;
+	metrics.setBufferBudget(buffer_budget);
+	activateGeneration(generation);
+	std::cout << "Configuration reloaded - " << generation->servers.size() << " server(s), "
+		<< retired.size() << " previous configuration(s) draining" << std::endl;
+}
+
 void	ServerManager::run()
 {
 	time_t	last_timeout_check = time(NULL);
 
-	while (true)
+	while (!stop_requested)
 	{
+		// Apply a pending SIGHUP before waiting again
+		if (reload_requested)
+			reload();
+		if (memory_dump_requested)
+			dumpMemory();
+
 		// Wait for activity on any socket (with 1 second timeout for checking idle connections)
-		int	activity = poll(&poll_fds[0], poll_fds.size(), 1000);
+		unsigned long long	poll_started = monotonicMicros();
+		int					activity = poll(&poll_fds[0], poll_fds.size(), pipelined.empty() ? 1000 : 0);
 		
 		if (activity < 0)
 		{
+			// Interrupted by a signal (SIGHUP reload, SIGINT), not an error
+			if (errno == EINTR)
+				continue ;
 			std::cerr << "poll() error" << std::endl;
 			break ;
 		}
+		profiler.beginIteration(poll_started, activity);
 		
+		// Write out access log lines buffered longer than their flush interval
+		unsigned long long	started = monotonicMicros();
+
+		flushAccessLogs(time(NULL), false);
+		profiler.stop(LOOP_LOG_FLUSH, -1, started);
+
 		// Periodically check for timed-out connections
 		if (time(NULL) - last_timeout_check >= 5)
 		{
+			started = monotonicMicros();
 			checkTimeouts();
+			profiler.stop(LOOP_TIMEOUTS, -1, started);
 			last_timeout_check = time(NULL);
 		}
 		
-		if (activity == 0)
+		if (activity > 0)
+			handleEvents();
+		handlePipelined();
+		applyBufferBudget();
+
+		// Everything runs on this thread: name the call that held up every other client
+		if (profiler.endIteration())
+		{
+			std::string	client = describeClient(profiler.getSlowestFd());
+
+			std::cerr << "Warning: " << profiler.trace() << (client.empty() ? "" : " (" + client + ")") << std::endl;
+		}
+	}
+
+	// SIGINT/SIGTERM: shut down here rather than in the handler, which cannot take the
+	// pool's locks or write out the access logs safely
+	if (stop_requested)
+		std::cout << "\nShutting down..." << std::endl;
+	flushAccessLogs(time(NULL), true);
+	stop();
+}
+
+// Dispatch the events reported by one poll() call
+void	ServerManager::handleEvents()
+{
+	unsigned long long	started;
+
+	// === FIRST PASS: Drain accept queues on ALL listening sockets immediately ===
+	// Listening sockets are only added/removed by reload() outside this loop, so direct iteration is safe.
+	for (size_t i = 0; i < poll_fds.size(); i++)
+	{
+		if (poll_fds[i].revents & POLLIN && server_fds.find(poll_fds[i].fd) != server_fds.end())
+		{
+			started = monotonicMicros();
+			handleNewConnection(fd_to_server[poll_fds[i].fd]);
+			profiler.stop(LOOP_ACCEPT, poll_fds[i].fd, started);
+		}
+	}
+	
+	// === SECOND PASS: Handle client sockets and CGI pipes ===
+	// Handlers may add/remove entries in poll_fds, so use index-based iteration
+	// and re-check bounds each step. Skip listening sockets (already handled).
+	for (size_t i = 0; i < poll_fds.size(); i++)
+	{
+		int		fd = poll_fds[i].fd;
+		short	revents = poll_fds[i].revents;
+
+		// Handled once: a rescan after removals must not dispatch it again
+		poll_fds[i].revents = 0;
+		
+		// Skip fds with no events, and skip listening sockets (handled in first pass)
+		if (revents == 0 || server_fds.find(fd) != server_fds.end())
 			continue ;
 		
-		// === FIRST PASS: Drain accept queues on ALL listening sockets immediately ===
-		// Listening sockets are always at stable indices (never removed), so direct iteration is safe.
-		for (size_t i = 0; i < poll_fds.size(); i++)
+		// --- Disk I/O pool completions ---
+		if (disk_pool.isRunning() && fd == disk_pool.getNotifyFd())
 		{
-			if (poll_fds[i].revents & POLLIN && server_fds.find(poll_fds[i].fd) != server_fds.end())
-				handleNewConnection(fd_to_server[poll_fds[i].fd]);
+			// Queued responses only change events, entries stay in place: no rescan
+			if (revents & POLLIN)
+			{
+				started = monotonicMicros();
+				handleDiskCompletions();
+				profiler.stop(LOOP_DISK, -1, started);
+			}
+			continue ;
 		}
-		
-		// === SECOND PASS: Handle client sockets and CGI pipes ===
-		// Handlers may add/remove entries in poll_fds, so use index-based iteration
-		// and re-check bounds each step. Skip listening sockets (already handled).
-		for (size_t i = 0; i < poll_fds.size(); i++)
-		{
-			int		fd = poll_fds[i].fd;
-			short	revents = poll_fds[i].revents;
-			
-			// Skip fds with no events, and skip listening sockets (handled in first pass)
-			if (revents == 0 || server_fds.find(fd) != server_fds.end())
-				continue ;
-			
-			// --- CGI pipe fd handling ---
-			std::map<int, int>::iterator	cgi_it = cgi_fd_to_client.find(fd);
-			if (cgi_it != cgi_fd_to_client.end())
+
+		started = monotonicMicros();
+
+		// --- Upstream (proxy_pass) connections ---
+		std::map<int, int>::iterator	proxy_it = proxy_fd_to_client.find(fd);
+		if (proxy_it != proxy_fd_to_client.end())
+		{
+			int	client_fd = proxy_it->second;
+
+			handleUpstreamEvent(fd, revents);
+			profiler.stop(LOOP_UPSTREAM, client_fd, started);
+			accountMemory(client_fd);
+			// The request may have finished, failed over or closed its client: restart scan
+			i = static_cast<size_t>(-1);
+			continue ;
+		}
+
+		// --- CGI pipe fd handling ---
+		std::map<int, int>::iterator	cgi_it = cgi_fd_to_client.find(fd);
+		if (cgi_it != cgi_fd_to_client.end())
+		{
+			int	client_fd = cgi_it->second;
+			std::map<int, ClientState>::iterator	state_it = client_states.find(client_fd);
+			if (state_it == client_states.end())
 			{
-				int	client_fd = cgi_it->second;
-				std::map<int, ClientState>::iterator	state_it = client_states.find(client_fd);
-				if (state_it == client_states.end())
-				{
-					// Client gone, cleanup CGI pipe
-					removePollFd(fd);
-					close(fd);
-					cgi_fd_to_client.erase(fd);
-					i--;	// Entry removed, adjust index
-					continue ;
-				}
-
-				ClientState&	state = state_it->second;
-
-				if (revents & (POLLERR | POLLNVAL))
-				{
-					finishCGI(client_fd, false);
-					// poll_fds may have changed, restart scan from beginning
-					i = static_cast<size_t>(-1);
-					continue ;
-				}
-				if ((revents & POLLIN) && fd == state.cgi_stdout_fd)
-				{
-					handleCGIRead(fd);
-					continue ;
-				}
-				if ((revents & POLLHUP) && fd == state.cgi_stdout_fd)
-				{
-					handleCGIRead(fd);
-					finishCGI(client_fd, true);
-					i = static_cast<size_t>(-1);
-					continue ;
-				}
-				if ((revents & POLLOUT) && fd == state.cgi_stdin_fd)
-				{
-					handleCGIWrite(fd);
-					continue ;
-				}
+				// Client gone, cleanup CGI pipe
+				removePollFd(fd);
+				close(fd);
+				cgi_fd_to_client.erase(fd);
+				i--;	// Entry removed, adjust index
 				continue ;
 			}
 
-			// --- Error/hangup on client fds ---
+			ClientState&	state = state_it->second;
+
 			if (revents & (POLLERR | POLLNVAL))
 			{
-				closeClient(fd);
-				i--;	// Entry removed, adjust index
+				finishCGI(client_fd, false);
+				profiler.stop(LOOP_CGI_FINISH, client_fd, started);
+				accountMemory(client_fd);
+				// poll_fds may have changed, restart scan from beginning
+				i = static_cast<size_t>(-1);
+				continue ;
+			}
+			if ((revents & POLLIN) && fd == state.cgi_stdout_fd)
+			{
+				handleCGIRead(fd);
+				profiler.stop(LOOP_CGI_READ, client_fd, started);
+				accountMemory(client_fd);
+				continue ;
+			}
+			if ((revents & POLLHUP) && fd == state.cgi_stdout_fd && !(poll_fds[i].events & POLLIN))
+			{
+				// An exited CGI is drained even while reads are paused: what is left fits in the pipe
+				poll_fds[i].events |= POLLIN;
+				continue ;
+			}
+			if ((revents & POLLHUP) && fd == state.cgi_stdout_fd)
+			{
+				handleCGIRead(fd);
+				profiler.stop(LOOP_CGI_READ, client_fd, started);
+				started = monotonicMicros();
+				finishCGI(client_fd, true);
+				profiler.stop(LOOP_CGI_FINISH, client_fd, started);
+				accountMemory(client_fd);
+				i = static_cast<size_t>(-1);
 				continue ;
 			}
+			if ((revents & POLLOUT) && fd == state.cgi_stdin_fd)
+			{
+				handleCGIWrite(fd);
+				profiler.stop(LOOP_CGI_WRITE, client_fd, started);
+				accountMemory(client_fd);
+				continue ;
+			}
+			continue ;
+		}
 
-			// --- Read events (POLLIN) ---
-			if (revents & POLLIN)
+		// --- Error/hangup on client fds ---
+		if (revents & (POLLERR | POLLNVAL))
+		{
+			closeClient(fd);
+			profiler.stop(LOOP_CLIENT_CLOSE, fd, started);
+			i--;	// Entry removed, adjust index
+			continue ;
+		}
+
+		// --- Read events (POLLIN) ---
+		if (revents & POLLIN)
+		{
+			if (client_states.find(fd) != client_states.end())
 			{
-				if (client_states.find(fd) != client_states.end())
-					handleClientRequest(fd);
+				handleClientRequest(fd);
+				profiler.stop(LOOP_CLIENT_READ, fd, started);
 			}
+		}
 
-			// Verify client still exists after read (may have been closed)
-			if (client_states.find(fd) == client_states.end())
-				continue ;
+		// Verify client still exists after read (may have been closed)
+		if (client_states.find(fd) == client_states.end())
+			continue ;
+		accountMemory(fd);
 
-			// --- Write events (POLLOUT) ---
-			if (revents & POLLOUT)
-				handleClientWrite(fd);
+		// --- Write events (POLLOUT) ---
+		if (revents & POLLOUT)
+		{
+			started = monotonicMicros();
+			handleClientWrite(fd);
+			profiler.stop(LOOP_CLIENT_WRITE, fd, started);
+			accountMemory(fd);
+		}
 
-			// --- POLLHUP without POLLIN means peer closed ---
-			if ((revents & POLLHUP) && !(revents & POLLIN))
+		// --- POLLHUP without POLLIN means peer closed ---
+		if ((revents & POLLHUP) && !(revents & POLLIN))
+		{
+			if (client_states.find(fd) != client_states.end())
 			{
-				if (client_states.find(fd) != client_states.end())
-				{
-					closeClient(fd);
-					i--;	// Entry removed, adjust index
-				}
+				started = monotonicMicros();
+				closeClient(fd);
+				profiler.stop(LOOP_CLIENT_CLOSE, fd, started);
+				i--;	// Entry removed, adjust index
 			}
 		}
 	}
@@ -192,29 +647,58 @@ void	ServerManager::run()
 
 void	ServerManager::handleNewConnection(int server_index)
 {
-	Server*	server = servers[server_index];
+	Server*	server = current->servers[server_index];
 	int		server_fd = server->getServerFd();
 	
 	// Drain the kernel accept queue (server socket is non-blocking)
 	// This is called only when poll() indicated POLLIN on the listening socket.
 	while (true)
 	{
-		int	client_fd = accept(server_fd, NULL, NULL);
+		struct sockaddr_storage	peer;
+		socklen_t				peer_len = sizeof(peer);
+		int						client_fd = accept(server_fd, reinterpret_cast<struct sockaddr*>(&peer), &peer_len);
 
 		if (client_fd < 0)
 			break ;	// No more pending connections
+		metrics.connectionAccepted();
 
 		// Set client socket to non-blocking mode
 		fcntl(client_fd, F_SETFL, O_NONBLOCK);
 
+		// Small responses should go out immediately instead of waiting on Nagle
+		if (server->getConfig().tcp_nodelay && !server->isUnixSocket())
+		{
+			int	opt = 1;
+			setsockopt(client_fd, IPPROTO_TCP, TCP_NODELAY, &opt, sizeof(opt));
+		}
+
 		// Register for POLLIN only; POLLOUT is enabled when response is ready
 		addPollFd(client_fd, POLLIN);
-		fd_to_server[client_fd] = server_index;
 
 		// Initialize client state for incremental parsing
-		ClientState	state;
-		state.server_index = server_index;
-		client_states[client_fd] = state;
+		ClientState&	state = client_states[client_fd];
+
+		state = ClientState();
+		state.timeline.mark(PHASE_ACCEPT);
+		state.remote_addr = peerAddress(peer);
+
+		// On a wildcard socket, the address the client connected to picks the server blocks
+		int	index = server_index;
+
+		if (!current->shared.empty() && !server->isUnixSocket())
+		{
+			struct sockaddr_storage	local;
+			socklen_t				local_len = sizeof(local);
+
+			if (getsockname(client_fd, reinterpret_cast<struct sockaddr*>(&local), &local_len) == 0)
+			{
+				std::map<std::string, int>::const_iterator	shared = current->shared.find(socketAddress(local));
+
+				if (shared != current->shared.end())
+					index = shared->second;
+			}
+		}
+		bindClient(state, current, index);
 	}
 }
 
@@ -230,14 +714,19 @@ void	ServerManager::handleClientRequest(int client_fd)
 		return ;
 	}
 
-	// If response is already ready, don't read more (wait for write to complete)
-	if (it->second.response_ready)
+	// If response is already ready, don't read more (wait for write to complete).
+	// A proxied request keeps forwarding its body while the response comes back.
+	if (it->second.response_ready && !it->second.proxy)
 		return;
 
 	// If CGI is in progress, don't read from client (wait for CGI to complete)
 	if (it->second.cgi_in_progress)
 		return ;
 
+	// Same while an upload/DELETE is running on the disk I/O pool
+	if (it->second.disk_job)
+		return ;
+
 	// ONE read per POLLIN event (poll() indicated readiness)
 	char	buffer[8192];
 	ssize_t	bytes_read = read(client_fd, buffer, sizeof(buffer) - 1);
@@ -249,57 +738,64 @@ void	ServerManager::handleClientRequest(int client_fd)
 		return ;
 	}
 	buffer[bytes_read] = '\0';
+	metrics.received(bytes_read);
 
 	ClientState&	state = it->second;
 
 	state.last_activity = time(NULL);	// Update activity timestamp
+	state.timeline.mark(PHASE_FIRST_BYTE);
 
-	Request&	req = state.request;
+	// Body of a request being proxied: straight to the upstream, not into the Request
+	if (state.proxy)
+	{
+		forwardRequestBody(client_fd, state, buffer, bytes_read);
+		return ;
+	}
 
 	// Append received data to request
-	req.appendData(std::string(buffer, bytes_read));
+	state.request.appendData(std::string(buffer, bytes_read));
+	processRequest(client_fd, state);
+}
+
+// Parse what has been received so far and dispatch the request once it is complete
+void	ServerManager::processRequest(int client_fd, ClientState& state)
+{
+	Request&	req = state.request;
 
 	// Try to parse headers if not done yet
 	if (!req.isHeadersComplete())
 	{
 		if (!req.parseHeaders())
 			return;	// Headers not complete yet, wait for more data
+		state.timeline.mark(PHASE_HEADERS);
 
 		// Check for malformed request (bad request line)
 		if (req.hasParseError())
 		{
 			state.keep_alive = false;
-			Response	res;
-			int ec = req.getErrorCode();
-			std::string status_text;
-			if (ec == 505)
-				status_text = "HTTP Version Not Supported";
-			else
-				status_text = "Bad Request";
-			res.setStatus(ec, status_text);
-			res.setHeader("Content-Type", "text/html");
-			res.setHeader("Connection", "close");
-			std::ostringstream	body;
-			body << "<html><body><h1>" << ec << " " << status_text << "</h1></body></html>";
-			res.setBody(body.str());
-			queueResponse(client_fd, res.toString());
+			queueResponse(client_fd, Response::canned(req.getErrorCode() == 505 ? 505 : 400, false));
 			return ;
 		}
 
 		// Check body size limit early
-		Server*	server = servers[state.server_index];
+		Server*	server = listeningServer(state);
 		size_t	max_size = server->getConfig().client_max_body_size;
 
 		if (req.getContentLength() > max_size)
 		{
 			// Queue 413 response and close after sending
 			state.keep_alive = false;
-			Response	res;
-			res.setStatus(413, "Payload Too Large");
-			res.setHeader("Content-Type", "text/html");
-			res.setHeader("Connection", "close");
-			res.setBody("<html><body><h1>413 Payload Too Large</h1></body></html>");
-			queueResponse(client_fd, res.toString());
+			queueResponse(client_fd, Response::canned(413, false));
+			return ;
+		}
+
+		// proxy_pass locations stream the body instead of waiting for all of it
+		const LocationConfig*	location = routeRequest(state)->resolveLocation(req);
+
+		if (location && !location->proxy_pass.empty())
+		{
+			state.timeline.mark(PHASE_HANDLER_START);
+			startProxy(client_fd, state, *location);
 			return ;
 		}
 	}
@@ -309,58 +805,57 @@ void	ServerManager::handleClientRequest(int client_fd)
 		return;	// Still waiting for body data
 	
 	// Request is complete, process it
+	state.timeline.mark(PHASE_BODY);
+	state.timeline.mark(PHASE_HANDLER_START);
 
-	// Determine keep-alive behavior from Connection header
-	std::string	conn_header = req.getHeader("Connection");
-	// Case-insensitive comparison
-	for (size_t ci = 0; ci < conn_header.length(); ci++)
-		conn_header[ci] = tolower(conn_header[ci]);
-	if (conn_header == "close")
-		state.keep_alive = false;
-	else
-		state.keep_alive = true;
+	// Virtual host and keep-alive were settled when the headers arrived
+	Server*	server = state.request_server;
 
-	// Get the original server (based on which port received the connection)
-	Server*	original_server = servers[state.server_index];
-	int		port = original_server->getPort();
-	
-	// Get Host header for virtual hosting
-	std::string	host_header = req.getHeader("Host");
-	
-	// Find the correct server based on Host header (virtual hosting)
-	int	server_index = state.server_index;  // Default to original
-	
-	if (!host_header.empty())
-	{
-		int	matched = findServerByHost(host_header, port);
+	// Counters page, answered here since only the manager sees every connection
+	const LocationConfig*	location = server->resolveLocation(req);
 
-		if (matched != -1)
-			server_index = matched;
+	if (location && location->metrics)
+	{
+		Response	response = (req.getMethod() == "GET") ? metricsResponse(client_fd) : Response();
+
+		// Marked before queueing: a response sent right away resets the timeline
+		state.timeline.mark(PHASE_HANDLER_END);
+		if (req.getMethod() != "GET")
+			queueResponse(client_fd, Response::canned(405, state.keep_alive));
+		else
+			queueResponse(client_fd, response);
+		return ;
 	}
 
-	Server*	server = servers[server_index];
-	std::cout << "[" << server->getConfig().server_name << ":" << server->getPort() << "] " << req.getMethod() << " " << req.getPath() << std::endl;
-
 	// Check if this is a CGI request
 	CGIInfo	cgi_info;
 
 	if (server->isCGIRequest(req, cgi_info))
 	{
 		// Start CGI execution
-		if (!startCGI(client_fd, req, server, cgi_info.location, cgi_info.cgi_extension, cgi_info.interpreter))
+		bool	started = startCGI(client_fd, req, server, cgi_info.location, cgi_info.cgi_extension, cgi_info.interpreter);
+
+		state.timeline.mark(PHASE_HANDLER_END);
+		if (!started)
 		{
 			// CGI failed to start, send error response
-			Response	res;
-			res.setStatus(500, "Internal Server Error");
-			res.setHeader("Content-Type", "text/html");
-			res.setBody("<html><body><h1>500 Internal Server Error</h1><p>CGI execution failed</p></body></html>");
-			queueResponse(client_fd, res.toString());
+			metrics.cgiSpawnFailed();
+			queueResponse(client_fd, Response::canned(500, state.keep_alive));
 		}
 		return ;
 	}
 
 	// Non-CGI request: get the response from server
-	Response	response = server->handleNonCGIRequest(req);
+	DiskJob*	job = NULL;
+	Response	response = server->handleNonCGIRequest(req, job);
+
+	// Uploads and DELETE answer once their file operations are done
+	if (job)
+	{
+		startDiskJob(client_fd, server, job);
+		return ;
+	}
+	state.timeline.mark(PHASE_HANDLER_END);
 	
 	// Set Connection header based on keep-alive decision
 	if (state.keep_alive)
@@ -369,9 +864,42 @@ void	ServerManager::handleClientRequest(int client_fd)
 		response.setHeader("Connection", "close");
 
 	// Queue the response to be sent when POLLOUT is ready
-	queueResponse(client_fd, response.toString());
+	queueResponse(client_fd, response);
+}
+
+// Settle keep-alive and the virtual host once the headers are in
+Server*	ServerManager::routeRequest(ClientState& state)
+{
+	const Request&	req = state.request;
+
+	// Determine keep-alive behavior from Connection header
+	std::string	conn_header = req.getHeader("Connection");
+	// Case-insensitive comparison
+	for (size_t ci = 0; ci < conn_header.length(); ci++)
+		conn_header[ci] = tolower(conn_header[ci]);
+	if (conn_header == "close")
+		state.keep_alive = false;
+	else
+		state.keep_alive = true;
+
+	// Get the original server (based on which address received the connection)
+	Server*		original_server = listeningServer(state);
+	std::string	listen_address = original_server->getListenAddress();
+	
+	// Get Host header for virtual hosting
+	std::string	host_header = req.getHeader("Host");
+	
+	// Find the correct server based on Host header (virtual hosting, default server when absent)
+	int	server_index = state.server_index;  // Default to original
+	int	matched = findServerByHost(*state.generation, host_header, listen_address);
+
+	if (matched != -1)
+		server_index = matched;
+	state.request_server = state.generation->servers[server_index];
+	return (state.request_server);
 }
 
+// Queue a fully serialized response (canned errors)
 void	ServerManager::queueResponse(int client_fd, const std::string& response)
 {
 	std::map<int, ClientState>::iterator	it = client_states.find(client_fd);
@@ -379,12 +907,102 @@ void	ServerManager::queueResponse(int client_fd, const std::string& response)
 	if (it == client_states.end())
 		return ;
 
-	it->second.response_buffer = response;
-	it->second.bytes_sent = 0;
-	it->second.response_ready = true;
+	ClientState&	state = it->second;
+	size_t			header_end = response.find("\r\n\r\n");
+
+	state.output.clear();
+	state.output.pushData(response);
+	// "HTTP/1.1 200 OK"
+	state.response_status = (response.length() > 12) ? std::atoi(response.c_str() + 9) : 0;
+	state.response_header_bytes = (header_end == std::string::npos) ? response.length() : header_end + 4;
+	startResponse(client_fd, state);
+}
+
+// Queue a response whose body may be a file region (takes ownership of its fd):
+// header block, in-memory body and file body are separate segments sent with one writev
+void	ServerManager::queueResponse(int client_fd, const Response& response)
+{
+	std::map<int, ClientState>::iterator	it = client_states.find(client_fd);
+
+	if (it == client_states.end())
+	{
+		if (response.getBodyFd() >= 0)
+			close(response.getBodyFd());
+		return ;
+	}
+
+	ClientState&	state = it->second;
+	std::string		headers = response.headerString();
+
+	state.output.clear();
+	state.output.pushData(headers);
+	state.output.pushData(response.getBody());
+	if (response.getBodyMap())
+	{
+		state.output.pushMapped(response.getBodyMap(), response.getBodyOffset(), response.getBodyLength());
+		if (response.getBodyFd() >= 0)
+			close(response.getBodyFd());
+	}
+	else if (response.getBodyFd() >= 0)
+		state.output.pushFile(response.getBodyFd(), response.getBodyOffset(), response.getBodyLength());
+	state.response_status = response.getStatusCode();
+	state.response_header_bytes = headers.length();
+	startResponse(client_fd, state);
+}
+
+// Send as much of a freshly queued response as the socket takes right away; most
+// responses fit and are done without another poll() round trip. Anything left,
+// a failed write and closing the connection are handled on the next POLLOUT.
+void	ServerManager::startResponse(int client_fd, ClientState& state)
+{
+	state.bytes_sent = 0;
+	state.response_ready = true;
+
+	// Cork the socket for the whole response so header and body share packets
+	if (!state.corked && listeningServer(state)->getConfig().tcp_nopush && !listeningServer(state)->isUnixSocket())
+	{
+		setCork(client_fd, true);
+		state.corked = true;
+	}
+	// Completing here must not remove poll entries (callers may be iterating them)
+	if (writeOutput(client_fd, state, false) && state.output.empty() && state.keep_alive
+		&& state.generation == current && !state.proxy)
+	{
+		completeResponse(client_fd, state);
+		return ;
+	}
+	updatePollEvents(client_fd, clientEvents(state));
+}
+
+// Write queued segments until the socket buffer is full, the queue is empty or
+// OUTPUT_FLUSH_LIMIT is reached. `polled`: poll() just reported the socket writable.
+// Returns false if the client must be closed.
+bool	ServerManager::writeOutput(int client_fd, ClientState& state, bool polled)
+{
+	size_t	flushed = 0;
 
-	// Enable POLLOUT now that there is data to send
-	updatePollEvents(client_fd, POLLIN | POLLOUT);
+	while (!state.output.empty() && flushed < OUTPUT_FLUSH_LIMIT)
+	{
+		// Every write needs readiness from poll(): ask again (without blocking) after the first
+		if (!polled && !socketWritable(client_fd))
+			break ;
+		polled = false;
+
+		size_t	attempted;
+		ssize_t	bytes_written = state.output.send(client_fd, attempted);
+
+		// > 0: progress, == 0: close, < 0: close (do NOT check errno)
+		if (bytes_written <= 0)
+			return (false);
+		state.timeline.mark(PHASE_FIRST_WRITE);
+		state.last_activity = time(NULL);	// A slow download is not an idle connection
+		state.bytes_sent += bytes_written;
+		flushed += bytes_written;
+		// A short write means the socket buffer is full
+		if (static_cast<size_t>(bytes_written) < attempted)
+			break ;
+	}
+	return (true);
 }
 
 void	ServerManager::handleClientWrite(int client_fd)
@@ -400,45 +1018,94 @@ void	ServerManager::handleClientWrite(int client_fd)
 	ClientState&	state = it->second;
 
 	// If no response is ready, nothing to write
-	if (!state.response_ready || state.response_buffer.empty())
+	if (!state.response_ready)
 		return ;
-	
-	// Calculate remaining data to send
-	size_t	remaining = state.response_buffer.length() - state.bytes_sent;
-
-	if (remaining > 0)
+	if (!writeOutput(client_fd, state, true))
 	{
-		// ONE write per POLLOUT event (poll() indicated readiness)
-		const char*	data = state.response_buffer.c_str() + state.bytes_sent;
-		ssize_t		bytes_written = write(client_fd, data, remaining);
+		closeClient(client_fd);
+		return ;
+	}
+	// Proxied: the client caught up with the upstream, which may be read again
+	if (state.proxy)
+	{
+		ProxyState&	proxy = *state.proxy;
 
-		// > 0: update bytes_sent, == 0: close, < 0: close (do NOT check errno)
-		if (bytes_written <= 0)
+		proxy.last_activity = time(NULL);
+		if (proxy.paused && state.output.memoryBytes() < PROXY_BUFFER_SIZE)
 		{
-			closeClient(client_fd);
-			return ;
+			proxy.paused = false;
+			updatePollEvents(proxy.fd, proxy.pollEvents());
 		}
+		updatePollEvents(client_fd, clientEvents(state));
+		return ;
+	}
+	if (state.output.empty())
+		completeResponse(client_fd, state);
+}
 
-		// Update bytes sent
-		state.bytes_sent += bytes_written;
+// The whole response is out: log it, then close or get ready for the next request
+void	ServerManager::completeResponse(int client_fd, ClientState& state)
+{
+	recordRequest(state);
+
+	// Uncork to push out the final partial packet right away
+	if (state.corked)
+	{
+		setCork(client_fd, false);
+		state.corked = false;
 	}
+	if (!state.keep_alive)
+	{
+		closeClient(client_fd);
+		return ;
+	}
+	// Next request uses the latest configuration (after a reload)
+	if (!rebindClient(state))
+	{
+		closeClient(client_fd);
+		return ;
+	}
+	// Reset for next request (keep-alive), keeping any pipelined request read with this one
+	std::string	next = state.request.getPipelined();
+
+	state.request.reset();
+	state.bytes_sent = 0;
+	state.response_ready = false;
+	state.last_activity = time(NULL);
+	// Disable POLLOUT until next response is ready
+	updatePollEvents(client_fd, POLLIN);
+	if (!next.empty())
+	{
+		state.request.appendData(next);
+		pipelined.push_back(client_fd);
+	}
+}
+
+// Requests already buffered behind the previous one: no POLLIN announces them, so
+// they are handled after the events of this iteration (run() does not wait in poll())
+void	ServerManager::handlePipelined()
+{
+	std::vector<int>	clients;
 
-	// Check if we've sent everything
-	if (state.bytes_sent >= state.response_buffer.length())
+	clients.swap(pipelined);
+	for (size_t i = 0; i < clients.size(); i++)
 	{
-		if (!state.keep_alive)
-		{
-			closeClient(client_fd);
-			return ;
-		}
-		// Reset for next request (keep-alive)
-		state.request.reset();
-		state.response_buffer.clear();
-		state.bytes_sent = 0;
-		state.response_ready = false;
+		std::map<int, ClientState>::iterator	it = client_states.find(clients[i]);
+
+		if (it == client_states.end())
+			continue ;
+
+		ClientState&		state = it->second;
+		unsigned long long	started = monotonicMicros();
+
+		// Still busy with a request (it will queue the next one when done)
+		if (state.response_ready || state.cgi_in_progress || state.disk_job || state.proxy)
+			continue ;
 		state.last_activity = time(NULL);
-		// Disable POLLOUT until next response is ready
-		updatePollEvents(client_fd, POLLIN);
+		state.timeline.mark(PHASE_FIRST_BYTE);
+		processRequest(clients[i], state);
+		profiler.stop(LOOP_CLIENT_READ, clients[i], started);
+		accountMemory(clients[i]);
 	}
 }
 
@@ -448,7 +1115,7 @@ void	ServerManager::updatePollEvents(int fd, short events)
 	{
 		if (poll_fds[i].fd == fd)
 		{
-			poll_fds[i].events = events;
+			poll_fds[i].events = throttleEvents(fd, events);
 			break ;
 		}
 	}
@@ -458,8 +1125,20 @@ void	ServerManager::closeClient(int client_fd)
 {
 	cleanupCGI(client_fd);	// Cleanup any ongoing CGI first
 	removePollFd(client_fd);
-	fd_to_server.erase(client_fd);
-	client_states.erase(client_fd);
+
+	std::map<int, ClientState>::iterator	it = client_states.find(client_fd);
+
+	if (it != client_states.end())
+	{
+		cleanupProxy(it->second);
+		// A response cut short is still logged, with the bytes that made it out
+		if (it->second.response_ready)
+			recordRequest(it->second);
+		it->second.output.clear();
+		bindClient(it->second, NULL, -1);	// Drop the reference on its configuration
+		metrics.memoryChanged(it->second.memory, ConnectionMemory());
+		client_states.erase(it);
+	}
 	close(client_fd);
 }
 
@@ -468,12 +1147,22 @@ void	ServerManager::checkTimeouts()
 	time_t				now = time(NULL);
 	std::vector<int>	to_close;
 	std::vector<int>	cgi_timeout;
+	std::vector<int>	proxy_timeout;
 	
-	// Find all timed-out connections and CGI processes
+	// Find all timed-out connections, CGI processes and upstreams
 	for (std::map<int, ClientState>::iterator it = client_states.begin(); it != client_states.end(); ++it)
 	{
+		const ProxyState*	proxy = it->second.proxy;
+		// Everything received so far is with the upstream: it waits for the client, not the other way round
+		bool				waits_for_client = proxy && proxy->connected && !proxy->request_body.isDone() && proxy->pending() == 0;
+
+		// Check upstream timeout (connect, then the wait for each response read)
+		if (proxy && !waits_for_client
+			&& now - proxy->last_activity > (proxy->connected ? PROXY_READ_TIMEOUT : PROXY_CONNECT_TIMEOUT))
+			proxy_timeout.push_back(it->first);
+
 		// Check connection timeout
-		if (now - it->second.last_activity > CONNECTION_TIMEOUT)
+		else if (now - it->second.last_activity > CONNECTION_TIMEOUT)
 			to_close.push_back(it->first);
 
 		// Check CGI timeout
@@ -485,9 +1174,29 @@ void	ServerManager::checkTimeouts()
 	for (size_t i = 0; i < cgi_timeout.size(); i++)
 	{
 		std::cerr << "CGI timeout for client " << cgi_timeout[i] << std::endl;
+		metrics.cgiTimedOut();
 		finishCGI(cgi_timeout[i], false);
 	}
 
+	// Handle upstream timeouts (another peer is tried if the request allows it)
+	for (size_t i = 0; i < proxy_timeout.size(); i++)
+	{
+		ClientState&	state = client_states[proxy_timeout[i]];
+
+		std::cerr << "Upstream timeout for client " << proxy_timeout[i] << " (" << state.proxy->upstream->getName()
+			<< ", " << state.proxy->upstream->peerName(state.proxy->peer) << ")" << std::endl;
+		upstreamFailed(proxy_timeout[i], state, 504);
+	}
+
+	// Pooled upstream connections unused for too long
+	for (std::map<std::string, Upstream*>::iterator it = current->upstreams.begin(); it != current->upstreams.end(); ++it)
+		it->second->closeIdle(now);
+	for (size_t i = 0; i < retired.size(); i++)
+	{
+		for (std::map<std::string, Upstream*>::iterator it = retired[i]->upstreams.begin(); it != retired[i]->upstreams.end(); ++it)
+			it->second->closeIdle(now);
+	}
+
 	// Close timed-out connections
 	for (size_t i = 0; i < to_close.size(); i++)
 		closeClient(to_close[i]);
@@ -498,7 +1207,7 @@ void	ServerManager::addPollFd(int fd, short events)
 	struct pollfd	pfd;
 
 	pfd.fd = fd;
-	pfd.events = events;
+	pfd.events = throttleEvents(fd, events);
 	pfd.revents = 0;
 	poll_fds.push_back(pfd);
 }
@@ -517,22 +1226,58 @@ void	ServerManager::removePollFd(int fd)
 
 void	ServerManager::stop()
 {
+	// Let workers finish what they are writing; their results are discarded
+	if (disk_pool.isRunning())
+	{
+		removePollFd(disk_pool.getNotifyFd());
+		disk_pool.stop();
+	}
+
+	// Close listening sockets first (also removes Unix socket files)
+	if (current)
+	{
+		for (std::map<std::string, int>::iterator it = current->listeners.begin(); it != current->listeners.end(); ++it)
+		{
+			removePollFd(current->servers[it->second]->getServerFd());
+			current->servers[it->second]->stop();
+		}
+	}
+
 	// Close all client connections
 	for (size_t i = 0; i < poll_fds.size(); i++)
 		close(poll_fds[i].fd);
 	poll_fds.clear();
+	pipelined.clear();
 	fd_to_server.clear();
+	server_fds.clear();
+	for (std::map<int, ClientState>::iterator it = client_states.begin(); it != client_states.end(); ++it)
+	{
+		it->second.output.clear();
+		delete it->second.proxy;	// Its connection was closed with the other poll fds
+	}
 	client_states.clear();
+	proxy_fd_to_client.clear();
 
 	// Delete all servers
-	for (size_t i = 0; i < servers.size(); i++)
-		delete servers[i];
-	servers.clear();
+	delete current;
+	current = NULL;
+	for (size_t i = 0; i < retired.size(); i++)
+		delete retired[i];
+	retired.clear();
 }
 
-// Extract hostname from Host header (removes port if present)
+// Extract hostname from Host header (removes port if present, handles [v6]:port)
 std::string	ServerManager::extractHostname(const std::string& host) const
 {
+	if (!host.empty() && host[0] == '[')
+	{
+		size_t	close_bracket = host.find(']');
+
+		if (close_bracket != std::string::npos)
+			return (host.substr(0, close_bracket + 1));
+		return (host);
+	}
+
 	size_t	colon_pos = host.find(':');
 
 	if (colon_pos != std::string::npos)
@@ -540,31 +1285,81 @@ std::string	ServerManager::extractHostname(const std::string& host) const
 	return (host);
 }
 
-// Find the best matching server based on Host header and port
-// Returns server index, or -1 if no match (should use default)
-int	ServerManager::findServerByHost(const std::string& host, int port) const
+// Register a server's names in the lookup table of its listen address
+void	ServerManager::addVirtualHost(ServerGeneration& generation, int server_index)
 {
-	std::string	hostname = extractHostname(host);
-	int			first_match_on_port = -1;
+	const ServerConfig&	config = generation.servers[server_index]->getConfig();
+	VirtualHostTable&	table = generation.virtual_hosts[config.listenAddress()];
 
-	for (size_t i = 0; i < servers.size(); i++)
+	if (table.default_server == -1 || config.default_server)
+		table.default_server = server_index;
+	for (size_t i = 0; i < config.server_names.size(); i++)
 	{
-		const ServerConfig&	config = servers[i]->getConfig();
+		const std::string&	name = config.server_names[i];
 
-		// Check if this server listens on the same port
-		if (config.port == port)
+		// First block to claim a name wins, as in nginx
+		if (name.length() > 2 && name.compare(0, 2, "*.") == 0)
+			table.leading_wildcards.insert(std::make_pair(name.substr(1), server_index));
+		else if (name.length() > 1 && name[0] == '.')
+		{
+			// .example.com matches example.com and all of its subdomains
+			table.leading_wildcards.insert(std::make_pair(name, server_index));
+			table.exact.insert(std::make_pair(name.substr(1), server_index));
+		}
+		else if (name.length() > 2 && name.compare(name.length() - 2, 2, ".*") == 0)
+			table.trailing_wildcards.insert(std::make_pair(name.substr(0, name.length() - 1), server_index));
+		else
+			table.exact.insert(std::make_pair(name, server_index));
+	}
+}
+
+// Find the best matching server based on Host header and listen address
+// Returns server index, or -1 if nothing listens on the address
+int	ServerManager::findServerByHost(const ServerGeneration& generation, const std::string& host, const std::string& listen_address) const
+{
+	std::map<std::string, VirtualHostTable>::const_iterator	table_it = generation.virtual_hosts.find(listen_address);
+
+	if (table_it == generation.virtual_hosts.end())
+		return (-1);
+
+	const VirtualHostTable&	table = table_it->second;
+	std::string				hostname = extractHostname(host);
+
+	// Host names are case-insensitive and may carry a trailing dot
+	for (size_t i = 0; i < hostname.length(); i++)
+		hostname[i] = tolower(hostname[i]);
+	if (!hostname.empty() && hostname[hostname.length() - 1] == '.')
+		hostname.erase(hostname.length() - 1);
+	if (hostname.empty())
+		return (table.default_server);
+
+	std::map<std::string, int>::const_iterator	it = table.exact.find(hostname);
+
+	if (it != table.exact.end())
+		return (it->second);
+
+	// Longest leading wildcard: try ".b.example.com", then ".example.com", then ".com"
+	if (!table.leading_wildcards.empty())
+	{
+		for (size_t dot = hostname.find('.'); dot != std::string::npos; dot = hostname.find('.', dot + 1))
 		{
-			// Remember first server on this port as fallback
-			if (first_match_on_port == -1)
-				first_match_on_port = i;
+			it = table.leading_wildcards.find(hostname.substr(dot));
+			if (it != table.leading_wildcards.end())
+				return (it->second);
+		}
+	}
 
-			// Check if server_name matches
-			if (config.server_name == hostname)
-				return (i);
+	// Longest trailing wildcard: try "www.example.", then "www."
+	if (!table.trailing_wildcards.empty())
+	{
+		for (size_t dot = hostname.rfind('.'); dot != std::string::npos && dot > 0; dot = hostname.rfind('.', dot - 1))
+		{
+			it = table.trailing_wildcards.find(hostname.substr(0, dot + 1));
+			if (it != table.trailing_wildcards.end())
+				return (it->second);
 		}
 	}
-	// No exact match, use first server on this port as default
-	return (first_match_on_port);
+	return (table.default_server);
 }
 
 // Start async CGI execution - returns true if CGI started successfully
@@ -584,12 +1379,9 @@ bool	ServerManager::startCGI(int client_fd, const Request& req, Server* server,
 	if (location && !location->root.empty())
 	{
 		doc_root = location->root;
-		if (url_path.find(location->path) == 0)
-		{
-			url_path = url_path.substr(location->path.length());
-			if (url_path.empty() || url_path[0] != '/')
-				url_path = "/" + url_path;
-		}
+		url_path = location->relativeUri(url_path);
+		if (url_path.empty() || url_path[0] != '/')
+			url_path = "/" + url_path;
 	}
 
 	std::string	script_path = CGI::getScriptPath(url_path, doc_root, extension);
@@ -625,7 +1417,9 @@ bool	ServerManager::startCGI(int client_fd, const Request& req, Server* server,
 	state.cgi_input_sent = 0;
 	state.cgi_output.clear();
 	state.cgi_start_time = time(NULL);
+	state.timeline.mark(PHASE_CGI_SPAWN);
 	state.cgi_handler = cgi;
+	metrics.cgiSpawned();
 
 	// Register CGI pipes with poll
 	// stdout for reading CGI output
@@ -723,6 +1517,7 @@ void	ServerManager::handleCGIRead(int cgi_stdout_fd)
 
 	if (bytes_read > 0)
 	{
+		state.timeline.mark(PHASE_CGI_FIRST_OUTPUT);
 		buffer[bytes_read] = '\0';
 		state.cgi_output += buffer;
 	}
@@ -777,6 +1572,8 @@ void	ServerManager::finishCGI(int client_fd, bool success)
 	if (!success)
 		cgi_failed = true;
 
+	state.timeline.mark(PHASE_CGI_EXIT);
+
 	// Build response
 	Response	response;
 
@@ -792,22 +1589,313 @@ void	ServerManager::finishCGI(int client_fd, bool success)
 
 	if (cgi_failed)
 	{
-		response.setStatus(500, "Internal Server Error");
-		response.setHeader("Content-Type", "text/html");
-		response.setBody("<html><body><h1>500 Internal Server Error</h1><p>CGI script failed</p></body></html>");
+		metrics.cgiFailed();
+		queueResponse(client_fd, Response::canned(500, state.keep_alive));
+	}
+	else
+	{
+		// Set Connection header based on keep-alive decision
+		if (state.keep_alive)
+			response.setHeader("Connection", "keep-alive");
+		else
+			response.setHeader("Connection", "close");
+
+		// Queue response
+		queueResponse(client_fd, response);
 	}
 
-	// Set Connection header based on keep-alive decision
+	// Cleanup CGI state
+	cleanupCGI(client_fd);
+}
+
+// Access log line and metrics for the response just sent (or cut short).
+// Runs before the request is reset, so every request field is still available.
+void	ServerManager::recordRequest(ClientState& state)
+{
+	if (!state.timeline.reached(PHASE_FIRST_BYTE) || !state.generation)
+		return ;
+	state.timeline.mark(PHASE_LAST_WRITE);
+
+	Server*			server = state.request_server ? state.request_server : listeningServer(state);
+	AccessLogRecord	record;
+
+	record.request = &state.request;
+	record.remote_addr = state.remote_addr;
+	record.server_name = server->getServerName();
+	record.status = state.response_status;
+	record.bytes_sent = state.bytes_sent;
+	record.body_bytes_sent = (record.bytes_sent > state.response_header_bytes) ? record.bytes_sent - state.response_header_bytes : 0;
+	record.timeline = &state.timeline;
+	gettimeofday(&record.end, NULL);
+	server->logRequest(record);
+
+	const LocationConfig*	location = state.request.getLocation();
+	std::string				server_label = server->getServerName().empty() ? server->getListenAddress() : server->getServerName();
+
+	metrics.requestDone(server_label, location ? location->path : "", record.status, record.bytes_sent, state.timeline);
+
+	state.timeline.reset();
+	state.request_server = NULL;
+}
+
+// Prometheus text for a "metrics on" location
+Response	ServerManager::metricsResponse(int client_fd)
+{
+	ConnectionCounts	connections;
+
+	for (std::map<int, ClientState>::const_iterator it = client_states.begin(); it != client_states.end(); ++it)
+	{
+		const ClientState&	state = it->second;
+
+		if (state.cgi_in_progress)
+			connections.cgi++;
+		if (it->first == client_fd || state.response_ready || state.cgi_in_progress || state.disk_job || state.proxy)
+			connections.writing++;
+		else if (state.request.hasPendingData())
+			connections.reading++;
+		else
+			connections.idle++;
+	}
+
+	Response	response;
+
+	response.setStatus(200, "OK");
+	response.setHeader("Content-Type", "text/plain; version=0.0.4; charset=utf-8");
+	response.setHeader("Cache-Control", "no-store");
+	response.setHeader("Connection", client_states[client_fd].keep_alive ? "keep-alive" : "close");
+	response.setBody(metrics.render(connections, profiler));
+	return (response);
+}
+
+// "127.0.0.1 GET /path" for the slow iteration trace (empty if the fd is not a client)
+std::string	ServerManager::describeClient(int client_fd) const
+{
+	std::map<int, ClientState>::const_iterator	it = client_states.find(client_fd);
+
+	if (it == client_states.end())
+		return ("");
+
+	const ClientState&	state = it->second;
+	std::ostringstream	oss;
+
+	oss << state.remote_addr;
+	if (state.request.isHeadersComplete())
+		oss << " " << state.request.getMethod() << " " << state.request.getPath();
+	if (state.cgi_in_progress)
+		oss << " CGI pid " << state.cgi_pid;
+	if (state.proxy && state.proxy->peer >= 0)
+		oss << " upstream " << state.proxy->upstream->peerName(state.proxy->peer);
+	return (oss.str());
+}
+
+// Report a connection's current buffer sizes to the metrics totals
+void	ServerManager::accountMemory(int client_fd)
+{
+	std::map<int, ClientState>::iterator	it = client_states.find(client_fd);
+
+	if (it == client_states.end())
+		return ;
+
+	ConnectionMemory	memory = measureMemory(it->second);
+
+	metrics.memoryChanged(it->second.memory, memory);
+	it->second.memory = memory;
+}
+
+// SIGUSR1: totals, high-water marks and the connections holding the most memory, on stderr
+void	ServerManager::dumpMemory()
+{
+	std::vector<std::pair<size_t, int> >	by_size;
+
+	memory_dump_requested = 0;
+	for (std::map<int, ClientState>::iterator it = client_states.begin(); it != client_states.end(); ++it)
+	{
+		accountMemory(it->first);
+		by_size.push_back(std::make_pair(it->second.memory.total(), it->first));
+	}
+	std::sort(by_size.rbegin(), by_size.rend());
+
+	std::cerr << "Memory report: " << client_states.size() << " connection(s) hold " << metrics.getMemoryTotal()
+		<< " bytes in buffers (peak " << metrics.getMemoryTotalPeak() << ", largest connection "
+		<< metrics.getConnectionMemoryPeak() << ")" << std::endl;
+	for (size_t i = 0; i < by_size.size() && i < MEMORY_DUMP_TOP; i++)
+	{
+		const ClientState&	state = client_states[by_size[i].second];
+		std::ostringstream	line;
+
+		line << "  fd " << by_size[i].second << ": " << by_size[i].first << " bytes";
+		for (int b = 0; b < MEMORY_BUFFER_COUNT; b++)
+		{
+			if (state.memory.bytes[b])
+				line << " " << ConnectionMemory::bufferName(static_cast<MemoryBuffer>(b)) << "=" << state.memory.bytes[b];
+		}
+		line << ", idle " << (time(NULL) - state.last_activity) << "s (" << describeClient(by_size[i].second) << ")";
+		std::cerr << line.str() << std::endl;
+	}
+}
+
+// Events a client socket waits for: the next request, and POLLOUT while a response is
+// queued. A proxied request reads body only while the upstream keeps up with it.
+short	ServerManager::clientEvents(const ClientState& state) const
+{
+	if (!state.proxy)
+		return (state.response_ready ? (POLLIN | POLLOUT) : POLLIN);
+
+	short	events = 0;
+
+	if (state.proxy->wantsClientBody())
+		events |= POLLIN;
+	if (state.response_ready && !state.output.empty())
+		events |= POLLOUT;
+	return (events);
+}
+
+// While reads are paused, CGI pipes and clients between requests are not read. A request
+// already being received is finished: only then can its memory be handed on and freed.
+bool	ServerManager::readBlocked(int fd) const
+{
+	if (!reads_paused || server_fds.find(fd) != server_fds.end() || (disk_pool.isRunning() && fd == disk_pool.getNotifyFd()))
+		return (false);
+
+	std::map<int, ClientState>::const_iterator	it = client_states.find(fd);
+
+	if (it == client_states.end())
+		return (true);	// CGI pipe, or a connection being accepted
+	return (!it->second.request.hasPendingData() && !it->second.request.isHeadersComplete());
+}
+
+short	ServerManager::throttleEvents(int fd, short events) const
+{
+	return (readBlocked(fd) ? (events & ~POLLIN) : events);
+}
+
+// Over buffer_budget, stop taking new requests and CGI output so no more data piles up;
+// queued responses keep draining and reads resume below the low-water mark
+void	ServerManager::applyBufferBudget()
+{
+	size_t	used = metrics.getMemoryTotal();
+
+	if (!reads_paused && buffer_budget && used > buffer_budget)
+	{
+		std::cerr << "Warning: connection buffers hold " << used << " bytes (buffer_budget " << buffer_budget
+			<< "), pausing reads" << std::endl;
+		setReadsPaused(true);
+	}
+	else if (reads_paused && (!buffer_budget || used <= buffer_budget / 100 * BUFFER_BUDGET_RESUME_PERCENT))
+	{
+		std::cerr << "Connection buffers down to " << used << " bytes, resuming reads" << std::endl;
+		setReadsPaused(false);
+	}
+}
+
+void	ServerManager::setReadsPaused(bool paused)
+{
+	reads_paused = paused;
+	metrics.readsPaused(paused);
+	for (size_t i = 0; i < poll_fds.size(); i++)
+	{
+		int										fd = poll_fds[i].fd;
+		std::map<int, int>::iterator			cgi_it = cgi_fd_to_client.find(fd);
+		std::map<int, int>::iterator			proxy_it = proxy_fd_to_client.find(fd);
+		std::map<int, ClientState>::iterator	client_it = client_states.find(fd);
+		bool									reader = false;
+
+		// Clients and upstreams: their usual events, without POLLIN where blocked
+		if (client_it != client_states.end())
+		{
+			poll_fds[i].events = throttleEvents(fd, clientEvents(client_it->second));
+			continue ;
+		}
+		if (proxy_it != proxy_fd_to_client.end())
+		{
+			poll_fds[i].events = throttleEvents(fd, client_states[proxy_it->second].proxy->pollEvents());
+			continue ;
+		}
+		// CGI stdin pipes only wait for POLLOUT
+		if (cgi_it != cgi_fd_to_client.end())
+		{
+			std::map<int, ClientState>::iterator	it = client_states.find(cgi_it->second);
+
+			reader = it != client_states.end() && it->second.cgi_stdout_fd == fd;
+		}
+		if (!reader)
+			continue ;
+		if (readBlocked(fd))
+			poll_fds[i].events &= ~POLLIN;
+		else
+			poll_fds[i].events |= POLLIN;
+	}
+}
+
+// Lines buffered longer than their flush interval, or every buffered line (`all`, on shutdown)
+void	ServerManager::flushAccessLogs(time_t now, bool all)
+{
+	std::vector<ServerGeneration*>	generations(retired);
+
+	if (current)
+		generations.push_back(current);
+	for (size_t i = 0; i < generations.size(); i++)
+	{
+		for (std::map<std::string, AccessLog*>::iterator it = generations[i]->access_logs.begin(); it != generations[i]->access_logs.end(); ++it)
+		{
+			if (all)
+				it->second->flush();
+			else
+				it->second->tick(now);
+		}
+	}
+}
+
+// Hand a request's file operations to the pool (or run them inline without one)
+void	ServerManager::startDiskJob(int client_fd, Server* server, DiskJob* job)
+{
+	ClientState&	state = client_states[client_fd];
+
+	job->client_fd = client_fd;
+	job->server = server;
+	state.disk_job = job;
+	if (!disk_pool.isRunning())
+	{
+		DiskIOPool::execute(*job);
+		finishDiskJob(job);
+		return ;
+	}
+	disk_pool.submit(job);
+}
+
+// Queue the response for a finished job, unless its client has gone away meanwhile
+void	ServerManager::finishDiskJob(DiskJob* job)
+{
+	std::map<int, ClientState>::iterator	it = client_states.find(job->client_fd);
+
+	// The fd may have been closed and reused by another connection: match the job too
+	if (it == client_states.end() || it->second.disk_job != job)
+	{
+		delete job;
+		return ;
+	}
+
+	ClientState&	state = it->second;
+	Response		response = job->server->finishDiskJob(*job);
+
+	state.disk_job = NULL;
+	delete job;
+	state.timeline.mark(PHASE_HANDLER_END);
 	if (state.keep_alive)
 		response.setHeader("Connection", "keep-alive");
 	else
 		response.setHeader("Connection", "close");
+	queueResponse(it->first, response);
+	accountMemory(it->first);
+}
 
-	// Queue response
-	queueResponse(client_fd, response.toString());
+void	ServerManager::handleDiskCompletions()
+{
+	std::vector<DiskJob*>	jobs;
 
-	// Cleanup CGI state
-	cleanupCGI(client_fd);
+	disk_pool.collect(jobs);
+	for (size_t i = 0; i < jobs.size(); i++)
+		finishDiskJob(jobs[i]);
 }
 
 // Cleanup CGI resources
@@ -848,8 +1936,381 @@ void    ServerManager::cleanupCGI(int client_fd)
 	// Reset CGI state
 	state.cgi_in_progress = false;
 	state.cgi_pid = -1;
-	state.cgi_input.clear();
+	std::string().swap(state.cgi_input);
 	state.cgi_input_sent = 0;
-	state.cgi_output.clear();
+	std::string().swap(state.cgi_output);
 	state.cgi_start_time = 0;
 }
+
+// proxy_pass: hand the request to the location's upstream once its headers are in.
+// The body is forwarded as it arrives and the response streamed back as it is read,
+// so neither is held in full; both sides stop being read while the other lags behind.
+void	ServerManager::startProxy(int client_fd, ClientState& state, const LocationConfig& location)
+{
+	Request&									req = state.request;
+	size_t										limit = location.client_max_body_size;
+	std::map<std::string, Upstream*>::iterator	it = state.generation->upstreams.find(location.proxy_pass);
+
+	if (limit == 0)
+		limit = state.request_server->getConfig().client_max_body_size;
+	state.timeline.mark(PHASE_HANDLER_END);
+	// methods applies as for any other location (none listed = all allowed); the body is not read
+	if (!location.methods.empty()
+		&& std::find(location.methods.begin(), location.methods.end(), req.getMethod()) == location.methods.end())
+	{
+		state.keep_alive = false;
+		queueResponse(client_fd, Response::canned(405, false));
+		return ;
+	}
+	if (req.getContentLength() > limit)
+	{
+		state.keep_alive = false;
+		queueResponse(client_fd, Response::canned(413, false));
+		return ;
+	}
+	if (it == state.generation->upstreams.end())
+	{
+		state.keep_alive = false;
+		queueResponse(client_fd, Response::canned(502, false));
+		return ;
+	}
+
+	ProxyState*	proxy = new ProxyState(it->second);
+
+	proxy->body_limit = limit;
+	proxy->head_request = (req.getMethod() == "HEAD");
+	proxy->request = ProxyState::buildRequestHead(req, location, state.remote_addr, it->second->keepsAlive());
+	if (req.isChunked())
+		proxy->request_body.start(BodyFramer::CHUNKED, 0);
+	else
+		proxy->request_body.start(BodyFramer::LENGTH, req.getContentLength());
+	state.proxy = proxy;
+	if (!connectUpstream(client_fd, state, true))
+	{
+		failProxy(client_fd, state, 502);
+		return ;
+	}
+	state.timeline.mark(PHASE_CGI_SPAWN);
+
+	std::string	body = req.getRawBody();
+	std::string	expect = req.getHeader("Expect");
+
+	for (size_t i = 0; i < expect.length(); i++)
+		expect[i] = tolower(expect[i]);
+	// The client waits for this before sending the body (answered here, the upstream never sees Expect)
+	if (expect == "100-continue" && body.empty() && !proxy->request_body.isDone() && socketWritable(client_fd))
+	{
+		static const char	continue_line[] = "HTTP/1.1 100 Continue\r\n\r\n";
+
+		if (write(client_fd, continue_line, sizeof(continue_line) - 1) <= 0)
+		{
+			closeClient(client_fd);
+			return ;
+		}
+	}
+	// Body bytes that came in with the headers
+	forwardRequestBody(client_fd, state, body.data(), body.length());
+}
+
+// Pick a peer and get a connection to it: a pooled keep-alive one if `pooled` and
+// there is one, else a new non-blocking connect() finished in handleUpstreamEvent
+bool	ServerManager::connectUpstream(int client_fd, ClientState& state, bool pooled)
+{
+	ProxyState&	proxy = *state.proxy;
+	time_t		now = time(NULL);
+	int			peer = proxy.upstream->select(proxy.tried, now);
+
+	if (peer < 0)
+		return (false);
+	proxy.restart();
+	proxy.peer = peer;
+	proxy.fd = pooled ? proxy.upstream->takeIdle(peer) : -1;
+	proxy.reused = (proxy.fd >= 0);
+	proxy.connected = proxy.reused;
+	if (proxy.fd < 0)
+		proxy.fd = proxy.upstream->connect(peer);
+	if (proxy.fd < 0)
+	{
+		// Out of sockets: not the peer's fault
+		proxy.upstream->release(peer, -1, false, now);
+		proxy.peer = -1;
+		return (false);
+	}
+	metrics.upstreamRequest(proxy.upstream->getName(), proxy.upstream->peerName(peer), proxy.reused);
+	addPollFd(proxy.fd, proxy.pollEvents());
+	proxy_fd_to_client[proxy.fd] = client_fd;
+	return (true);
+}
+
+// Request body bytes from the client, appended to what the upstream is sent (chunked
+// framing passed through). Bytes past the end of the body are a pipelined request,
+// which is not served: the connection closes after this response instead.
+void	ServerManager::forwardRequestBody(int client_fd, ClientState& state, const char* data, size_t length)
+{
+	ProxyState&	proxy = *state.proxy;
+	size_t		used = proxy.request_body.feed(data, length);
+
+	// The upstream was idle waiting for this: its timeout starts now, not when it last wrote
+	if (proxy.pending() == 0)
+		proxy.last_activity = time(NULL);
+	proxy.request.append(data, used);
+	proxy.body_received += used;
+	if (used < length)
+		state.keep_alive = false;
+	if (proxy.request_body.hasError() || proxy.body_received > proxy.body_limit)
+	{
+		// Chunk framing the upstream would choke on, or a chunked body over the limit
+		state.keep_alive = false;
+		failProxy(client_fd, state, proxy.request_body.hasError() ? 400 : 413);
+		return ;
+	}
+	if (proxy.request_body.isDone())
+		state.timeline.mark(PHASE_BODY);
+	if (proxy.fd >= 0)
+		updatePollEvents(proxy.fd, proxy.pollEvents());
+	updatePollEvents(client_fd, clientEvents(state));
+}
+
+// Readiness on an upstream connection: connect result, request bytes, response bytes
+void	ServerManager::handleUpstreamEvent(int upstream_fd, short revents)
+{
+	int										client_fd = proxy_fd_to_client[upstream_fd];
+	std::map<int, ClientState>::iterator	it = client_states.find(client_fd);
+
+	if (it == client_states.end() || !it->second.proxy)
+	{
+		// Client gone, cleanup upstream connection
+		removePollFd(upstream_fd);
+		proxy_fd_to_client.erase(upstream_fd);
+		close(upstream_fd);
+		return ;
+	}
+
+	ClientState&	state = it->second;
+	ProxyState&		proxy = *state.proxy;
+
+	proxy.last_activity = time(NULL);
+	state.last_activity = proxy.last_activity;
+	if (!proxy.connected)
+	{
+		// The outcome of a non-blocking connect() is the socket's pending error
+		int			error = 0;
+		socklen_t	error_len = sizeof(error);
+
+		if (getsockopt(upstream_fd, SOL_SOCKET, SO_ERROR, &error, &error_len) < 0 || error != 0)
+		{
+			upstreamFailed(client_fd, state, 502);
+			return ;
+		}
+		proxy.connected = true;
+	}
+	if ((revents & POLLOUT) && proxy.pending() > 0)
+	{
+		// ONE write per POLLOUT event
+		ssize_t	bytes_written = write(upstream_fd, proxy.request.data() + proxy.request_sent, proxy.pending());
+
+		// > 0: progress, <= 0: failed (do NOT check errno)
+		if (bytes_written <= 0)
+		{
+			upstreamFailed(client_fd, state, 502);
+			return ;
+		}
+		proxy.request_sent += bytes_written;
+		proxy.compact();
+		// Room again for more of the client's body
+		updatePollEvents(client_fd, clientEvents(state));
+	}
+	if (revents & (POLLIN | POLLHUP | POLLERR))
+	{
+		readUpstream(client_fd, state);
+		return ;
+	}
+	updatePollEvents(upstream_fd, proxy.pollEvents());
+}
+
+// ONE read from the upstream: the response head is parsed and rewritten for the
+// client, body bytes are queued as they are and written out right away
+void	ServerManager::readUpstream(int client_fd, ClientState& state)
+{
+	ProxyState&	proxy = *state.proxy;
+	char		buffer[65536];
+	ssize_t		bytes_read = read(proxy.fd, buffer, sizeof(buffer));
+
+	// == 0: a body that ends with the connection is complete, anything else is cut short
+	if (bytes_read == 0 && proxy.headers_sent && proxy.response_body.getMode() == BodyFramer::UNTIL_CLOSE)
+	{
+		finishProxy(client_fd, state);
+		return ;
+	}
+	if (bytes_read <= 0)
+	{
+		upstreamFailed(client_fd, state, 502);
+		return ;
+	}
+	proxy.received = true;
+	state.timeline.mark(PHASE_CGI_FIRST_OUTPUT);
+
+	const char*	body = buffer;
+	size_t		body_length = bytes_read;
+	std::string	rest;
+
+	if (!proxy.headers_sent)
+	{
+		proxy.header.append(buffer, bytes_read);
+
+		// Interim 1xx responses are skipped until the final one
+		while (true)
+		{
+			size_t	header_end = proxy.header.find("\r\n\r\n");
+
+			if (header_end == std::string::npos)
+			{
+				if (proxy.header.length() > PROXY_HEADER_MAX)
+					failProxy(client_fd, state, 502);
+				else
+					updatePollEvents(proxy.fd, proxy.pollEvents());
+				return ;
+			}
+
+			std::string	client_head;
+			int			status = 0;
+
+			// A response sent before the whole body was forwarded ends the client connection
+			if (!proxy.request_body.isDone())
+				state.keep_alive = false;
+
+			int			result = proxy.parseResponseHead(proxy.header.substr(0, header_end), state.keep_alive, client_head, status);
+
+			rest = proxy.header.substr(header_end + 4);
+			proxy.header.swap(rest);
+			if (result < 0)
+			{
+				failProxy(client_fd, state, 502);
+				return ;
+			}
+			if (result == 0)
+				continue ;
+			rest.swap(proxy.header);
+			std::string().swap(proxy.header);
+			state.output.clear();
+			state.output.pushData(client_head);
+			state.response_status = status;
+			state.response_header_bytes = client_head.length();
+			proxy.headers_sent = true;
+			body = rest.data();
+			body_length = rest.length();
+			break ;
+		}
+	}
+
+	size_t	used = proxy.response_body.feed(body, body_length);
+
+	// Bytes after the end of the response: the connection is out of step, do not reuse it
+	if (used < body_length || proxy.response_body.hasError())
+		proxy.keep_upstream = false;
+	state.output.pushData(std::string(body, used));
+	if (!state.response_ready)
+		startResponse(client_fd, state);
+	else if (!writeOutput(client_fd, state, false))
+	{
+		closeClient(client_fd);
+		return ;
+	}
+	if (proxy.response_body.hasError())
+	{
+		// Broken chunk framing: the client gets a truncated response
+		closeClient(client_fd);
+		return ;
+	}
+	if (proxy.response_body.isDone())
+	{
+		finishProxy(client_fd, state);
+		return ;
+	}
+	// The client is not keeping up: stop reading until its queue drains
+	if (state.output.memoryBytes() >= PROXY_BUFFER_SIZE)
+		proxy.paused = true;
+	updatePollEvents(proxy.fd, proxy.pollEvents());
+	updatePollEvents(client_fd, clientEvents(state));
+}
+
+// Connect error, reset, bad response or timeout. Before the first response byte a
+// request the buffer still holds in full moves on to the next peer (POST only if it
+// was never sent). A pooled connection the peer had closed meanwhile is retried on a
+// fresh connection without counting against the peer.
+void	ServerManager::upstreamFailed(int client_fd, ClientState& state, int status)
+{
+	ProxyState&	proxy = *state.proxy;
+	time_t		now = time(NULL);
+	bool		stale = proxy.reused && !proxy.received && status != 504;
+	bool		retry = !proxy.received && proxy.replayable
+		&& (stale || proxy.request_sent == 0 || state.request.getMethod() != "POST");
+
+	removePollFd(proxy.fd);
+	proxy_fd_to_client.erase(proxy.fd);
+	proxy.upstream->release(proxy.peer, proxy.fd, false, now);
+	if (!stale)
+	{
+		proxy.upstream->failed(proxy.peer, now);
+		metrics.upstreamFailed(proxy.upstream->getName(), proxy.upstream->peerName(proxy.peer));
+		proxy.tried[proxy.peer] = true;
+	}
+	proxy.fd = -1;
+	proxy.peer = -1;
+	if (retry && connectUpstream(client_fd, state, !stale))
+		return ;
+	failProxy(client_fd, state, status);
+}
+
+// Give up on the upstream: an error page if nothing was sent yet, else the client is
+// closed so it sees the response was cut short
+void	ServerManager::failProxy(int client_fd, ClientState& state, int status)
+{
+	bool	started = state.proxy->headers_sent;
+
+	// The rest of the body would be read as the next request
+	if (!state.proxy->request_body.isDone())
+		state.keep_alive = false;
+	cleanupProxy(state);
+	if (started)
+	{
+		closeClient(client_fd);
+		return ;
+	}
+	queueResponse(client_fd, Response::canned(status, state.keep_alive));
+}
+
+// The upstream response is complete: pool the connection if it can carry another
+// request, then finish the client's response once its queue is written out
+void	ServerManager::finishProxy(int client_fd, ClientState& state)
+{
+	ProxyState*	proxy = state.proxy;
+	bool		reusable = proxy->keep_upstream && proxy->request_body.isDone() && proxy->pending() == 0;
+
+	state.timeline.mark(PHASE_CGI_EXIT);
+	proxy->upstream->succeeded(proxy->peer);
+	removePollFd(proxy->fd);
+	proxy_fd_to_client.erase(proxy->fd);
+	proxy->upstream->release(proxy->peer, proxy->fd, reusable, time(NULL));
+	delete proxy;
+	state.proxy = NULL;
+	if (state.output.empty())
+		completeResponse(client_fd, state);
+	else
+		updatePollEvents(client_fd, clientEvents(state));
+}
+
+// Drop an unfinished proxied request (the connection is not reused)
+void	ServerManager::cleanupProxy(ClientState& state)
+{
+	if (!state.proxy)
+		return ;
+	if (state.proxy->fd >= 0)
+	{
+		removePollFd(state.proxy->fd);
+		proxy_fd_to_client.erase(state.proxy->fd);
+	}
+	state.proxy->upstream->release(state.proxy->peer, state.proxy->fd, false, time(NULL));
+	delete state.proxy;
+	state.proxy = NULL;
+}
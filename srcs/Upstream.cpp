@@ -0,0 +1,182 @@
+#include "Upstream.hpp"
+#include <iostream>
+#include <sstream>
+#include <cstring>
+#include <unistd.h>
+#include <fcntl.h>
+#include <netdb.h>
+#include <poll.h>
+#include <netinet/in.h>
+#include <netinet/tcp.h>
+
+Upstream::Upstream(const std::string& n, const UpstreamConfig& config)
+	: name(n), least_conn(config.least_conn), keepalive(config.keepalive), next(0) {}
+
+Upstream::~Upstream()
+{
+	for (size_t i = 0; i < idle.size(); i++)
+		close(idle[i].fd);
+}
+
+// Look up every server address (blocking, only while a configuration is loaded)
+bool	Upstream::resolve(const UpstreamConfig& config, std::string& error)
+{
+	for (size_t i = 0; i < config.servers.size(); i++)
+	{
+		const UpstreamServerConfig&	server = config.servers[i];
+		std::ostringstream			port;
+		struct addrinfo				hints;
+		struct addrinfo*			result = NULL;
+		UpstreamPeer				peer;
+
+		port << server.port;
+		std::memset(&hints, 0, sizeof(hints));
+		hints.ai_family = AF_UNSPEC;
+		hints.ai_socktype = SOCK_STREAM;
+		if (getaddrinfo(server.host.c_str(), port.str().c_str(), &hints, &result) != 0 || !result)
+		{
+			error = "cannot resolve " + server.host;
+			return (false);
+		}
+		std::memset(&peer.addr, 0, sizeof(peer.addr));
+		std::memcpy(&peer.addr, result->ai_addr, result->ai_addrlen);
+		peer.addr_len = result->ai_addrlen;
+		freeaddrinfo(result);
+		peer.name = (server.host.find(':') != std::string::npos ? "[" + server.host + "]" : server.host) + ":" + port.str();
+		peer.max_fails = server.max_fails;
+		peer.fail_timeout = server.fail_timeout;
+		peer.fails = 0;
+		peer.window_start = 0;
+		peer.down_until = 0;
+		peer.active = 0;
+		peers.push_back(peer);
+	}
+	return (true);
+}
+
+int	Upstream::select(const std::vector<bool>& tried, time_t now)
+{
+	int	chosen = -1;
+
+	for (size_t n = 0; n < peers.size(); n++)
+	{
+		size_t	i = (next + n) % peers.size();
+
+		if (tried[i] || peers[i].down_until > now)
+			continue ;
+		if (!least_conn)
+		{
+			chosen = i;
+			break ;
+		}
+		// Ties go to the round-robin order
+		if (chosen < 0 || peers[i].active < peers[chosen].active)
+			chosen = i;
+	}
+	if (chosen >= 0)
+	{
+		next = (chosen + 1) % peers.size();
+		peers[chosen].active++;
+	}
+	return (chosen);
+}
+
+// connect() on a non-blocking socket: the result (refused, unreachable, done) is read
+// with SO_ERROR once poll() reports the socket writable
+int	Upstream::connect(int peer) const
+{
+	int	fd = socket(peers[peer].addr.ss_family, SOCK_STREAM, 0);
+	int	on = 1;
+
+	if (fd < 0)
+		return (-1);
+	fcntl(fd, F_SETFL, O_NONBLOCK);
+	fcntl(fd, F_SETFD, FD_CLOEXEC);	// Not inherited by CGI processes
+	setsockopt(fd, IPPROTO_TCP, TCP_NODELAY, &on, sizeof(on));
+	::connect(fd, reinterpret_cast<const struct sockaddr*>(&peers[peer].addr), peers[peer].addr_len);
+	return (fd);
+}
+
+// Most recently pooled first. A pooled connection that is readable has been closed
+// by the peer (or sent something unasked): it is dropped instead of reused.
+int	Upstream::takeIdle(int peer)
+{
+	for (size_t i = idle.size(); i-- > 0; )
+	{
+		if (idle[i].peer != peer)
+			continue ;
+
+		struct pollfd	pfd;
+		int				fd = idle[i].fd;
+
+		idle.erase(idle.begin() + i);
+		pfd.fd = fd;
+		pfd.events = POLLIN;
+		pfd.revents = 0;
+		if (poll(&pfd, 1, 0) == 0)
+			return (fd);
+		close(fd);
+	}
+	return (-1);
+}
+
+// The request is done with the peer; a connection that can carry another request is pooled
+void	Upstream::release(int peer, int fd, bool reusable, time_t now)
+{
+	if (peer >= 0 && peers[peer].active > 0)
+		peers[peer].active--;
+	if (fd < 0)
+		return ;
+	if (!reusable || peer < 0 || keepalive == 0)
+	{
+		close(fd);
+		return ;
+	}
+
+	IdleConnection	connection;
+
+	connection.fd = fd;
+	connection.peer = peer;
+	connection.since = now;
+	idle.push_back(connection);
+	if (idle.size() > keepalive)
+	{
+		close(idle.front().fd);
+		idle.pop_front();
+	}
+}
+
+// Connection error or timeout. max_fails failures within fail_timeout take the peer out
+// of rotation for fail_timeout; a group of one is never taken out (nothing else to try).
+void	Upstream::failed(int peer, time_t now)
+{
+	UpstreamPeer&	p = peers[peer];
+
+	if (now - p.window_start >= p.fail_timeout)
+	{
+		p.window_start = now;
+		p.fails = 0;
+	}
+	p.fails++;
+	if (p.max_fails > 0 && p.fails >= p.max_fails && peers.size() > 1 && p.down_until <= now)
+	{
+		p.down_until = now + p.fail_timeout;
+		std::cerr << "Warning: upstream " << name << ": " << p.name << " failed " << p.fails
+			<< " time(s), skipped for " << p.fail_timeout << "s" << std::endl;
+	}
+}
+
+void	Upstream::succeeded(int peer)
+{
+	peers[peer].fails = 0;
+	peers[peer].down_until = 0;
+}
+
+void	Upstream::closeIdle(time_t now)
+{
+	while (!idle.empty() && now - idle.front().since > UPSTREAM_KEEPALIVE_TIMEOUT)
+	{
+		close(idle.front().fd);
+		idle.pop_front();
+	}
+}
@@ -4,23 +4,36 @@
 #include "Config.hpp"
 #include <cstdlib>
 
-// Global pointer for signal handling
-ServerManager* g_server_manager = NULL;
-
 void	signalHandler(int signum)
 {
 	(void)signum;
+	ServerManager::requestStop();
+}
+
+void	reloadHandler(int signum)
+{
+	(void)signum;
+	ServerManager::requestReload();
+}
 
-	std::cout << "\nShutting down..." << std::endl;
-	if (g_server_manager)
-		g_server_manager->stop();
-	exit(0);
+void	memoryDumpHandler(int signum)
+{
+	(void)signum;
+	ServerManager::requestMemoryDump();
 }
 
 int	main(int argc, char** argv)
 {
-	// Setup signal handler for Ctrl+C
+	// Setup signal handler for Ctrl+C (and kill/service stop): the event loop then writes
+	// out buffered access log lines and closes everything, outside signal context
 	signal(SIGINT, signalHandler);
+	signal(SIGTERM, signalHandler);
+
+	// SIGHUP re-reads the config file without dropping connections
+	signal(SIGHUP, reloadHandler);
+
+	// SIGUSR1 prints the connections holding the most buffer memory to stderr
+	signal(SIGUSR1, memoryDumpHandler);
 
 	// Ignore SIGPIPE: prevents server crash when writing to a client that has closed.
 	// Without this, write() on a broken connection kills the process.
@@ -59,16 +72,16 @@ int	main(int argc, char** argv)
 	
 	// Create server manager
 	ServerManager	manager;
-	g_server_manager = &manager;
+	manager.setConfigFile(config_file);
 	
 	// Initialize all servers
-	if (!manager.initServers(servers))
+	if (!manager.initServers(servers, config.getGlobal()))
 	{
 		std::cerr << "Failed to initialize servers" << std::endl;
 		return (1);
 	}
 
-	// Run server manager (infinite loop with poll)
+	// Run server manager (loop with poll, until SIGINT)
 	manager.run();
 	
 	return (0);